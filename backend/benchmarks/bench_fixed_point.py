@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+定点数计算基准测试
+
+对比Decimal实现与utils.fixed_point定点实现:
+- 成交重放: 逐笔加权平均(PositionState.apply_many,状态全程为定点整数)
+- 浮盈计算: 逐个持仓Decimal计算 vs 定点标量 vs 定点数组一次计算
+
+同时校验两种实现的结果误差
+
+使用方式(在backend目录下):
+    python benchmarks/bench_fixed_point.py
+    python benchmarks/bench_fixed_point.py --trades 100000 --positions 10000
+"""
+import argparse
+import random
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from engines.position_engine import replay_trades  # noqa: E402
+from utils import fixed_point as fp  # noqa: E402
+
+TICK = 1.0
+MULTIPLIER = 5
+
+
+def make_trades(count: int):
+    rng = random.Random(count)
+    trades = []
+    long_position = short_position = 0
+    for i in range(count):
+        direction = rng.choice(["buy", "sell"])
+        # 平仓量不超过持仓,避免大部分成交落在空仓上
+        held = short_position if direction == "buy" else long_position
+        offset = "close" if held > 0 and rng.random() < 0.4 else "open"
+        volume = rng.randint(1, held) if offset == "close" else rng.randint(1, 5)
+        if direction == "buy":
+            long_position += volume if offset == "open" else 0
+            short_position -= volume if offset == "close" else 0
+        else:
+            short_position += volume if offset == "open" else 0
+            long_position -= volume if offset == "close" else 0
+        trades.append({
+            "direction": direction,
+            "offset": offset,
+            "volume": volume,
+            "price": float(rng.randint(4800, 5200)) * TICK,
+        })
+    return trades
+
+
+class DecimalState:
+    """原Decimal实现的持仓状态(PositionState改为定点前的算法)"""
+
+    def __init__(self):
+        self.long_position = 0
+        self.long_avg_price = Decimal('0')
+        self.short_position = 0
+        self.short_avg_price = Decimal('0')
+
+    def apply(self, trade):
+        volume = trade['volume']
+        price = Decimal(str(trade['price']))
+
+        if trade['direction'] == 'buy':
+            if trade['offset'] == 'open':
+                if self.long_position > 0:
+                    old_cost = self.long_avg_price * self.long_position
+                    self.long_position += volume
+                    self.long_avg_price = (old_cost + price * volume) / self.long_position
+                else:
+                    self.long_position = volume
+                    self.long_avg_price = price
+            else:
+                self.short_position = max(0, self.short_position - volume)
+                if self.short_position == 0:
+                    self.short_avg_price = Decimal('0')
+        else:
+            if trade['offset'] == 'open':
+                if self.short_position > 0:
+                    old_cost = self.short_avg_price * self.short_position
+                    self.short_position += volume
+                    self.short_avg_price = (old_cost + price * volume) / self.short_position
+                else:
+                    self.short_position = volume
+                    self.short_avg_price = price
+            else:
+                self.long_position = max(0, self.long_position - volume)
+                if self.long_position == 0:
+                    self.long_avg_price = Decimal('0')
+
+
+def replay_decimal(trades):
+    state = DecimalState()
+    for trade in trades:
+        state.apply(trade)
+    return state
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_replay(count: int):
+    trades = make_trades(count)
+    dec_time, dec = timed(replay_decimal, trades)
+    fix_time, state = timed(replay_trades, trades, None, TICK)
+
+    assert (dec.long_position, dec.short_position) == (state.long_position, state.short_position)
+    error = max(abs(float(dec.long_avg_price) - state.long_avg_price),
+                abs(float(dec.short_avg_price) - state.short_avg_price))
+
+    print(f"成交重放 {count} 笔")
+    print(f"  Decimal: {dec_time * 1000:10.2f} ms")
+    print(f"  定点:    {fix_time * 1000:10.2f} ms   ({dec_time / fix_time:.1f}x)")
+    print(f"  均价最大误差: {error:.6f}")
+
+
+def bench_pnl(count: int):
+    rng = np.random.default_rng(count)
+    avg = rng.uniform(4800, 5200, count).round(4)
+    last = rng.integers(4800, 5200, count).astype(np.float64) * TICK
+    volume = rng.integers(1, 50, count)
+
+    def decimal_path():
+        return [
+            float((Decimal(str(p)) - Decimal(str(a))) * int(v) * MULTIPLIER)
+            for a, p, v in zip(avg.tolist(), last.tolist(), volume.tolist())
+        ]
+
+    def scalar_path():
+        return [
+            fp.pnl(fp.to_fixed(a, TICK), fp.to_fixed(p, TICK), v, MULTIPLIER, TICK)
+            for a, p, v in zip(avg.tolist(), last.tolist(), volume.tolist())
+        ]
+
+    def array_path():
+        return fp.pnl(fp.to_fixed(avg, TICK), fp.to_fixed(last, TICK), volume, MULTIPLIER, TICK)
+
+    dec_time, dec = timed(decimal_path)
+    scalar_time, scalar = timed(scalar_path)
+    array_time, array = timed(array_path)
+
+    error = float(np.max(np.abs(np.array(dec) - array)))
+    assert np.allclose(scalar, array)
+
+    print(f"浮盈计算 {count} 个持仓")
+    print(f"  Decimal:   {dec_time * 1000:10.3f} ms")
+    print(f"  定点标量:  {scalar_time * 1000:10.3f} ms   ({dec_time / scalar_time:.1f}x)")
+    print(f"  定点数组:  {array_time * 1000:10.3f} ms   ({dec_time / array_time:.1f}x)")
+    print(f"  最大误差: {error:.6f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="定点数计算基准测试")
+    parser.add_argument("--trades", type=int, default=50000)
+    parser.add_argument("--positions", type=int, default=1000)
+    args = parser.parse_args()
+
+    bench_replay(args.trades)
+    print()
+    bench_pnl(args.positions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+K线序列化基准测试
+
+对比K线接口的三种转换方式:
+- 逐行: 按行iloc取值逐条构造字典(原实现)
+- 整列+逐条: 整列过滤/转换后组装逐条字典(format=rows)
+- 列式: 整列过滤/转换,直接返回各列(format=columnar)
+
+同时对比两种响应形状的JSON大小和编码耗时
+
+使用方式(在backend目录下):
+    python benchmarks/bench_kline_serialization.py
+    python benchmarks/bench_kline_serialization.py --sizes 500 2000 8000 --repeat 20
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.kline_service import kline_columns, kline_rows  # noqa: E402
+
+
+def make_klines(rng: np.random.Generator, size: int) -> pd.DataFrame:
+    """生成天勤格式的K线DataFrame(约1%成交量为0的K线)"""
+    close = 5000 + np.cumsum(rng.normal(0, 2, size)).round()
+    volume = rng.integers(1, 500, size).astype(np.float64)
+    volume[rng.random(size) < 0.01] = 0
+    return pd.DataFrame({
+        "datetime": (1_735_779_600 + np.arange(size) * 60) * 1_000_000_000,
+        "open": close - 1,
+        "high": close + 3,
+        "low": close - 3,
+        "close": close,
+        "volume": volume,
+    })
+
+
+def iloc_rows(klines: pd.DataFrame):
+    """原实现: 逐行iloc"""
+    result = []
+    for i in range(len(klines)):
+        if klines.iloc[i]['volume'] == 0:
+            continue
+        result.append({
+            'time': int(klines.iloc[i]['datetime'] / 1e9),
+            'open': float(klines.iloc[i]['open']),
+            'high': float(klines.iloc[i]['high']),
+            'low': float(klines.iloc[i]['low']),
+            'close': float(klines.iloc[i]['close']),
+            'volume': int(klines.iloc[i]['volume']),
+        })
+    return result
+
+
+def timed(fn, repeat: int):
+    """返回(最小耗时ms, 结果)"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="K线序列化基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 8000])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    print(f"{'K线数':>6} {'逐行iloc':>10} {'整列+逐条':>10} {'列式':>8} "
+          f"{'逐条JSON':>12} {'列式JSON':>12} {'逐条编码':>9} {'列式编码':>9}")
+    for size in args.sizes:
+        df = make_klines(rng, size)
+        snapshot = {column: df[column].to_numpy() for column in df.columns}
+
+        t_iloc, before = timed(lambda: iloc_rows(df), max(1, args.repeat // 5))
+        t_rows, rows = timed(lambda: kline_rows(kline_columns(snapshot)), args.repeat)
+        t_columns, columns = timed(lambda: kline_columns(snapshot), args.repeat)
+        assert rows == before
+
+        t_rows_json, rows_json = timed(lambda: json.dumps(rows), args.repeat)
+        t_columns_json, columns_json = timed(lambda: json.dumps(columns), args.repeat)
+
+        print(f"{size:>6} {t_iloc:>8.2f}ms {t_rows:>8.2f}ms {t_columns:>6.2f}ms "
+              f"{len(rows_json):>11,}B {len(columns_json):>11,}B "
+              f"{t_rows_json:>7.2f}ms {t_columns_json:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+盯市计算基准测试
+
+对比三种实现在一次行情变化时的开销:
+- 逐条: 每个持仓转换合约代码、查询乘数、Python计算浮盈、单独UPDATE
+- 列式: PositionBook一次向量化计算全部持仓,变化的持仓一次批量upsert
+- 按合约: 只计算最新价变化合约的持仓(PositionBook.rows_for)
+
+每轮行情只有--changed个合约的价格变化
+
+数据库用计数桩代替,统计每轮的数据库往返次数,
+并按给定的往返延迟估算实际耗时
+
+使用方式(在backend目录下):
+    python benchmarks/bench_mark_to_market.py
+    python benchmarks/bench_mark_to_market.py --sizes 10 100 1000 --rounds 200 --rtt-ms 1 --changed 2
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from engines.position_book import PositionBook  # noqa: E402
+from utils.contract_mapper import ContractMapper  # noqa: E402
+
+SYMBOLS = [
+    ("ZCE|F|TA|2505", 5), ("ZCE|F|MA|2505", 10), ("ZCE|F|SR|2505", 10),
+    ("SHFE|F|CU|2502", 5), ("SHFE|F|RB|2505", 10), ("SHFE|F|AU|2506", 1000),
+    ("DCE|F|M|2505", 10), ("DCE|F|I|2505", 100), ("DCE|F|P|2505", 10),
+    ("INE|F|SC|2503", 1000),
+]
+
+
+class CountingQuery:
+    """记录execute次数的查询桩"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        self.db.round_trips += 1
+        return self
+
+
+class CountingDB:
+    """数据库往返计数桩"""
+
+    def __init__(self):
+        self.round_trips = 0
+
+    def table(self, name):
+        return CountingQuery(self)
+
+
+def make_positions(count: int):
+    rng = random.Random(count)
+    rows = []
+    for i in range(count):
+        symbol, _ = SYMBOLS[i % len(SYMBOLS)]
+        rows.append({
+            "id": f"pos-{i}",
+            "account_id": f"acc-{i % 20}",
+            "symbol": symbol,
+            "long_position": rng.randint(0, 20),
+            "long_avg_price": round(rng.uniform(3000, 6000), 2),
+            "short_position": rng.randint(0, 20),
+            "short_avg_price": round(rng.uniform(3000, 6000), 2),
+            "last_price": None,
+            "long_profit": 0,
+            "short_profit": 0,
+        })
+    return rows
+
+
+def make_rounds(rng: random.Random, rounds: int, changed: int):
+    """生成每轮的行情(全部合约最新价)和最新价变化的合约"""
+    tq_symbols = [ContractMapper.polar_to_tqsdk(symbol) for symbol, _ in SYMBOLS]
+    prices = {tq_symbol: round(rng.uniform(3000, 6000), 2) for tq_symbol in tq_symbols}
+    result = [({s: {"last_price": p} for s, p in prices.items()}, tq_symbols)]
+    for _ in range(rounds - 1):
+        symbols = rng.sample(tq_symbols, changed)
+        for tq_symbol in symbols:
+            prices[tq_symbol] = round(rng.uniform(3000, 6000), 2)
+        result.append(({s: {"last_price": p} for s, p in prices.items()}, symbols))
+    return result
+
+
+def run_row_by_row(positions, quotes_per_round, multipliers):
+    """逐条实现(原update_position_prices逻辑)"""
+    db = CountingDB()
+    start = time.perf_counter()
+
+    for quotes, _ in quotes_per_round:
+        for position in positions:
+            tqsdk_symbol = ContractMapper.polar_to_tqsdk(position['symbol'])
+            if tqsdk_symbol not in quotes:
+                continue
+            last_price = quotes[tqsdk_symbol]["last_price"]
+
+            # 原实现每条持仓查询一次合约乘数
+            db.table("contracts").select("multiplier").eq("polar_symbol", position['symbol']).execute()
+            multiplier = multipliers[position['symbol']]
+
+            long_profit = 0
+            short_profit = 0
+            if position['long_position'] > 0 and position['long_avg_price']:
+                long_profit = (last_price - float(position['long_avg_price'])) * \
+                    position['long_position'] * multiplier
+            if position['short_position'] > 0 and position['short_avg_price']:
+                short_profit = (float(position['short_avg_price']) - last_price) * \
+                    position['short_position'] * multiplier
+
+            db.table("positions").update({
+                "last_price": last_price,
+                "long_profit": long_profit,
+                "short_profit": short_profit,
+            }).eq("id", position['id']).execute()
+
+    return time.perf_counter() - start, db.round_trips
+
+
+def run_columnar(positions, quotes_per_round, multipliers):
+    """列式实现(PositionBook + 批量upsert)"""
+    db = CountingDB()
+    book = PositionBook()
+    book.load(positions, ContractMapper.polar_to_tqsdk, multipliers.__getitem__)
+
+    start = time.perf_counter()
+    for quotes, _ in quotes_per_round:
+        changed = book.mark(book.price_vector(quotes))
+        if len(changed):
+            rows = book.to_rows(changed, "2025-01-01T00:00:00")
+            db.table("positions").upsert(rows, on_conflict="id").execute()
+
+    return time.perf_counter() - start, db.round_trips
+
+
+def run_symbol_indexed(positions, quotes_per_round, multipliers):
+    """按合约实现(只计算最新价变化合约的持仓)"""
+    db = CountingDB()
+    book = PositionBook()
+    book.load(positions, ContractMapper.polar_to_tqsdk, multipliers.__getitem__)
+
+    start = time.perf_counter()
+    for quotes, symbols in quotes_per_round:
+        changed = book.mark(book.price_vector(quotes), book.rows_for(symbols))
+        if len(changed):
+            rows = book.to_rows(changed, "2025-01-01T00:00:00")
+            db.table("positions").upsert(rows, on_conflict="id").execute()
+
+    return time.perf_counter() - start, db.round_trips
+
+
+def main():
+    parser = argparse.ArgumentParser(description="盯市计算基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--rounds", type=int, default=100, help="模拟的行情变化次数")
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="估算用的数据库往返延迟(毫秒)")
+    parser.add_argument("--changed", type=int, default=2, help="每轮最新价变化的合约数")
+    args = parser.parse_args()
+
+    multipliers = dict(SYMBOLS)
+    rng = random.Random(42)
+    quotes_per_round = make_rounds(rng, args.rounds, min(args.changed, len(SYMBOLS)))
+
+    header = f"{'持仓数':>8} {'实现':>6} {'CPU/轮(ms)':>12} {'往返/轮':>8} {'估算/轮(ms)':>12}"
+    print(f"行情变化 {args.rounds} 次, 数据库往返延迟按 {args.rtt_ms}ms 估算")
+    print(header)
+    print("-" * len(header))
+
+    for size in args.sizes:
+        positions = make_positions(size)
+        for name, runner in (("逐条", run_row_by_row), ("列式", run_columnar),
+                             ("按合约", run_symbol_indexed)):
+            elapsed, round_trips = runner(positions, quotes_per_round, multipliers)
+            cpu_ms = elapsed * 1000 / args.rounds
+            trips = round_trips / args.rounds
+            estimate = cpu_ms + trips * args.rtt_ms
+            print(f"{size:>8} {name:>6} {cpu_ms:>12.3f} {trips:>8.1f} {estimate:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,10 @@ class Settings(BaseSettings):
 
     # 数据库配置
     database_url: str
+    db_pool_enabled: bool = True   # 使用asyncpg连接池直连数据库(失败时回退PostgREST)
+    db_pool_min_size: int = 1      # 连接池最小连接数
+    db_pool_max_size: int = 10     # 连接池最大连接数
+    db_query_timeout: float = 5    # 单次查询超时(秒)
 
     # 天勤配置
     tqsdk_account: Optional[str] = None
@@ -23,6 +27,62 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 8888
 
+    # 账户ID解析缓存
+    account_cache_size: int = 1024          # 最大缓存账户数
+    account_cache_ttl: float = 300          # 正缓存有效期(秒)
+    account_cache_negative_ttl: float = 30  # 不存在账户的负缓存有效期(秒)
+
+    # 成交入库配置
+    trade_batch_max_size: int = 1000  # 批量成交接口单次最大条数
+    trade_dedup_cache_size: int = 100000  # 内存去重集合保留的最近成交数
+    trade_ingest_mode: str = "sync"   # sync: 同步入库; journal: 先写本地日志再后台批量入库
+    trade_journal_path: str = "data/trade_journal.jsonl"  # 成交日志文件
+    trade_journal_flush_interval: float = 0.2  # 后台刷写间隔(秒)
+    trade_journal_batch_size: int = 500        # 单次刷写最大条数
+
+    # 持仓计算配置
+    rebuild_workers: int = 4  # 账户持仓重建的并行进程数
+    position_checkpoint_interval: int = 500  # 每累计多少笔成交写一次持仓检查点(交易日切换时也会写)
+
+    # 行情盯市配置
+    position_book_refresh_interval: float = 5    # 未收到持仓变更通知时,持仓簿记从数据库重新加载的间隔(秒)
+    position_book_resync_interval: float = 300   # 持仓变更实时同步时,兜底全量重载的间隔(秒)
+    position_price_write_interval: float = 1   # 同一持仓最新价/浮盈的最小写库间隔(秒)
+
+    # 行情记录配置(market_data表)
+    market_data_record_enabled: bool = True
+    market_data_sample_interval: float = 60  # 同一合约两条记录的最小间隔(秒)
+    market_data_batch_size: int = 500        # 单次批量写入的最大行数
+    market_data_flush_interval: float = 5    # 定时写入间隔(秒)
+
+    # 行情线程配置
+    market_pump_wait_timeout: float = 0.05  # wait_update最长等待(秒),即无行情时pump.call的最大延迟
+
+    # K线缓存配置
+    kline_cache_budget: int = 32  # 最多同时订阅的K线序列数,超出时淘汰最久未使用的
+
+    # K线重采样配置
+    kline_resample_enabled: bool = True  # 5分钟/1小时/日线等由1分钟K线本地合成
+    kline_base_length: int = 8192        # 1分钟序列的订阅长度
+
+    # 本地K线存储配置
+    kline_store_enabled: bool = True
+    kline_store_dir: str = "data/klines"  # 已完成K线的列文件目录
+
+    # 行情共享表配置
+    quote_table_path: str = "data/quote_table.bin"  # 最新行情共享表文件(各进程映射读取)
+    quote_table_capacity: int = 4096                # 最大合约数
+    quote_table_max_age: float = 10                 # 写入方心跳超过该秒数视为行情进程已停,共享表过期
+
+    # 实时K线合成配置(由行情tick合成1分钟K线)
+    bar_aggregator_enabled: bool = True
+    bar_close_grace: float = 3     # K线结束后等待迟到tick的时间(秒),之后强制收线
+    bar_ws_queue_size: int = 1000  # 每个WebSocket订阅者最多积压的K线数
+
+    # 持仓推送配置(/ws/positions)
+    position_ws_max_rate: float = 4        # 每个连接每秒最多推送的消息数,间隔内的变化按持仓合并
+    position_ws_mark_interval: float = 0.5  # 推送用的盯市计算间隔(秒)
+
     # Ntfy配置
     ntfy_url: str = "https://ntfy.zmddg.com/claude"
 
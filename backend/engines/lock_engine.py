@@ -3,13 +3,14 @@
 负责执行锁仓操作,记录执行历史
 """
 from typing import Optional, Dict, Any
-from decimal import Decimal
 from datetime import datetime
 import uuid
 from supabase import Client
 
-from utils.db import get_supabase_client
+from utils import fixed_point as fp
+from utils.db import async_db, get_supabase_client
 from utils.logger import get_logger
+from services.contract_registry import contract_registry
 
 logger = get_logger(__name__)
 
@@ -86,11 +87,9 @@ class LockEngine:
             )
 
             # 6. 计算锁定利润
-            multiplier = await self._get_contract_multiplier(symbol)
-            if direction == "long":
-                locked_profit = (trigger_price - Decimal(str(before_state["avg_price"]))) * lock_volume * multiplier
-            else:
-                locked_profit = (Decimal(str(before_state["avg_price"])) - trigger_price) * lock_volume * multiplier
+            locked_profit = self._locked_profit(
+                symbol, direction, before_state["avg_price"], trigger_price, lock_volume
+            )
 
             # 7. 更新持仓锁定状态
             await self._update_position_lock(
@@ -207,27 +206,30 @@ class LockEngine:
 
     async def _get_position(self, account_id: str, symbol: str) -> Optional[Dict]:
         """获取持仓信息"""
-        result = (
-            self.db.table("positions")
-            .select("*")
-            .eq("account_id", account_id)
-            .eq("symbol", symbol)
-            .execute()
+        rows = await async_db.select(
+            "positions", filters={"account_id": account_id, "symbol": symbol}
         )
+        return rows[0] if rows else None
 
-        return result.data[0] if result.data else None
-
-    async def _get_contract_multiplier(self, symbol: str) -> int:
-        """获取合约乘数"""
-        result = (
-            self.db.table("contracts")
-            .select("multiplier")
-            .eq("polar_symbol", symbol)
-            .execute()
+    def _locked_profit(
+        self,
+        symbol: str,
+        direction: str,
+        avg_price: float,
+        lock_price: float,
+        lock_volume: int
+    ) -> float:
+        """按锁仓价计算锁定利润(定点计算)"""
+        tick = contract_registry.get_price_tick(symbol, fp.DEFAULT_TICK)
+        return fp.locked_profit(
+            fp.to_fixed(avg_price or 0, tick),
+            fp.to_fixed(lock_price, tick),
+            lock_volume,
+            contract_registry.get_multiplier(symbol),
+            tick,
+            1 if direction == "long" else -1
         )
 
-        return result.data[0]["multiplier"] if result.data else 10
-
     async def _update_position_lock(
         self,
         account_id: str,
@@ -258,16 +260,16 @@ class LockEngine:
             remaining = position["long_position"] - lock_volume
             if remaining > 0:
                 update_data["legacy_long_position"] = lock_volume
-                update_data["legacy_long_profit"] = (
-                    lock_price - position["long_avg_price"]
-                ) * lock_volume * await self._get_contract_multiplier(symbol)
+                update_data["legacy_long_profit"] = self._locked_profit(
+                    symbol, direction, position["long_avg_price"], lock_price, lock_volume
+                )
         else:
             remaining = position["short_position"] - lock_volume
             if remaining > 0:
                 update_data["legacy_short_position"] = lock_volume
-                update_data["legacy_short_profit"] = (
-                    position["short_avg_price"] - lock_price
-                ) * lock_volume * await self._get_contract_multiplier(symbol)
+                update_data["legacy_short_profit"] = self._locked_profit(
+                    symbol, direction, position["short_avg_price"], lock_price, lock_volume
+                )
 
         self.db.table("positions").update(update_data).eq("id", position["id"]).execute()
 
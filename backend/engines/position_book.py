@@ -0,0 +1,365 @@
+"""
+持仓列式簿记
+
+盯市计算用的内存持仓集合,按列存放在NumPy数组中:
+- 多/空持仓量、多/空均价(定点,见utils.fixed_point)
+- 合约乘数、最小变动价位
+- 合约索引(指向合约表,同一合约的持仓共用一个行情价格)
+
+按合约索引持仓: 行情变化时只对变化合约的持仓向量化计算浮盈,
+数值确实变化的行标记为待写,按行限制写库频率(每行每个间隔最多写一次),
+由调用方一次批量写库
+
+成交入库/重建后通过upsert同步单个持仓,无需整体重载;不再需要盯市的账户用remove_account移除
+"""
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from utils import fixed_point as fp
+
+
+class PositionBook:
+    """持仓列式簿记"""
+
+    # 加载持仓时需要的字段
+    COLUMNS = (
+        "id, account_id, symbol, long_position, long_avg_price, "
+        "short_position, short_avg_price, last_price, long_profit, short_profit"
+    )
+
+    # 按行存放的数组
+    ROW_ARRAYS = (
+        "long_volume", "long_avg", "short_volume", "short_avg", "multiplier", "tick",
+        "symbol_index", "last_price", "long_profit", "short_profit", "dirty", "written_at"
+    )
+
+    def __init__(self):
+        self._resolvers = None
+        self.clear()
+
+    def clear(self):
+        """清空簿记"""
+        # 行: 每个持仓一行
+        self.ids: List[str] = []
+        self.account_ids: List[str] = []
+        self.symbols: List[str] = []  # 极星格式
+
+        self.long_volume = np.zeros(0, dtype=np.int64)
+        self.long_avg = np.zeros(0, dtype=np.int64)
+        self.short_volume = np.zeros(0, dtype=np.int64)
+        self.short_avg = np.zeros(0, dtype=np.int64)
+        self.multiplier = np.zeros(0, dtype=np.int64)
+        self.tick = np.zeros(0, dtype=np.float64)
+        self.symbol_index = np.zeros(0, dtype=np.int32)
+
+        # 上次写库的值,用于判断是否变化
+        self.last_price = np.zeros(0, dtype=np.float64)
+        self.long_profit = np.zeros(0, dtype=np.float64)
+        self.short_profit = np.zeros(0, dtype=np.float64)
+
+        # 待写库标记和上次写库时间(time.monotonic)
+        self.dirty = np.zeros(0, dtype=bool)
+        self.written_at = np.zeros(0, dtype=np.float64)
+
+        # 合约表: 天勤格式合约代码,下标即symbol_index
+        self.tq_symbols: List[str] = []
+        self._symbol_slots: Dict[str, int] = {}
+        # 持仓ID → 行
+        self._row_of: Dict[str, int] = {}
+        # 合约下标 → 行(按需构建,增删行后失效)
+        self._symbol_rows: Optional[Dict[int, np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def load(
+        self,
+        rows: List[Dict],
+        to_tqsdk: Callable[[str], Optional[str]],
+        multiplier_of: Callable[[str], int],
+        tick_of: Callable[[str], float] = lambda symbol: fp.DEFAULT_TICK
+    ) -> int:
+        """
+        从positions表记录构建簿记(整体替换)
+
+        Args:
+            rows: positions表记录,字段见COLUMNS
+            to_tqsdk: 极星格式 → 天勤格式,无法转换时返回None
+            multiplier_of: 极星格式合约代码 → 合约乘数
+            tick_of: 极星格式合约代码 → 最小变动价位
+
+        Returns:
+            载入的持仓数
+        """
+        self.clear()
+        self._resolvers = (to_tqsdk, multiplier_of, tick_of)
+
+        symbol_slots: Dict[str, int] = {}
+        # 合约转换和乘数只按合约查一次
+        symbol_cache: Dict[str, Optional[tuple]] = {}
+        columns: Dict[str, list] = {
+            name: [] for name in (
+                "long_volume", "long_avg", "short_volume", "short_avg", "multiplier",
+                "tick", "symbol_index", "last_price", "long_profit", "short_profit"
+            )
+        }
+
+        for row in rows:
+            symbol = row['symbol']
+            if symbol not in symbol_cache:
+                tq_symbol = to_tqsdk(symbol)
+                symbol_cache[symbol] = (
+                    (tq_symbol, multiplier_of(symbol), tick_of(symbol)) if tq_symbol else None
+                )
+            resolved = symbol_cache[symbol]
+            if resolved is None:
+                continue
+
+            tq_symbol, multiplier, tick = resolved
+            slot = symbol_slots.setdefault(tq_symbol, len(symbol_slots))
+
+            self.ids.append(row['id'])
+            self.account_ids.append(row['account_id'])
+            self.symbols.append(symbol)
+            columns["long_volume"].append(row.get('long_position') or 0)
+            columns["long_avg"].append(fp.to_fixed(row.get('long_avg_price') or 0, tick))
+            columns["short_volume"].append(row.get('short_position') or 0)
+            columns["short_avg"].append(fp.to_fixed(row.get('short_avg_price') or 0, tick))
+            columns["multiplier"].append(multiplier)
+            columns["tick"].append(tick)
+            columns["symbol_index"].append(slot)
+            # 未写过最新价的持仓记为NaN,首次行情必定写库
+            last_price = row.get('last_price')
+            columns["last_price"].append(float(last_price) if last_price else np.nan)
+            columns["long_profit"].append(float(row.get('long_profit') or 0))
+            columns["short_profit"].append(float(row.get('short_profit') or 0))
+
+        self.tq_symbols = list(symbol_slots)
+        self._symbol_slots = symbol_slots
+        self._row_of = {position_id: i for i, position_id in enumerate(self.ids)}
+        self.dirty = np.zeros(len(self.ids), dtype=bool)
+        self.written_at = np.full(len(self.ids), -np.inf, dtype=np.float64)
+        self.long_volume = np.array(columns["long_volume"], dtype=np.int64)
+        self.long_avg = np.array(columns["long_avg"], dtype=np.int64)
+        self.short_volume = np.array(columns["short_volume"], dtype=np.int64)
+        self.short_avg = np.array(columns["short_avg"], dtype=np.int64)
+        self.multiplier = np.array(columns["multiplier"], dtype=np.int64)
+        self.tick = np.array(columns["tick"], dtype=np.float64)
+        self.symbol_index = np.array(columns["symbol_index"], dtype=np.int32)
+        self.last_price = np.array(columns["last_price"], dtype=np.float64)
+        self.long_profit = np.array(columns["long_profit"], dtype=np.float64)
+        self.short_profit = np.array(columns["short_profit"], dtype=np.float64)
+
+        return len(self.ids)
+
+    def price_vector(self, quotes: Dict[str, Dict]) -> np.ndarray:
+        """
+        按合约表顺序取最新价,未订阅或无效价格为NaN
+
+        Args:
+            quotes: {天勤格式合约代码: 最新行情字段}
+        """
+        prices = np.full(len(self.tq_symbols), np.nan, dtype=np.float64)
+        for slot, tq_symbol in enumerate(self.tq_symbols):
+            quote = quotes.get(tq_symbol)
+            if quote is not None and quote.get("last_price") is not None:
+                prices[slot] = quote["last_price"]
+        return prices
+
+    def rows_for(self, tq_symbols: Iterable[str]) -> np.ndarray:
+        """
+        指定合约的持仓行下标
+
+        Args:
+            tq_symbols: 天勤格式合约代码
+        """
+        if self._symbol_rows is None:
+            order = np.argsort(self.symbol_index, kind="stable")
+            bounds = np.flatnonzero(np.diff(self.symbol_index[order])) + 1
+            self._symbol_rows = {
+                int(self.symbol_index[group[0]]): group
+                for group in np.split(order, bounds) if len(group)
+            }
+
+        groups = [
+            self._symbol_rows[self._symbol_slots[tq_symbol]]
+            for tq_symbol in tq_symbols
+            if tq_symbol in self._symbol_slots
+            and self._symbol_slots[tq_symbol] in self._symbol_rows
+        ]
+        if not groups:
+            return np.zeros(0, dtype=np.intp)
+        return np.concatenate(groups)
+
+    def mark(self, prices: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        按合约最新价重新计算持仓的浮盈,变化的行标记为待写
+
+        Args:
+            prices: 合约表对应的最新价(NaN表示无行情)
+            rows: 只计算这些行(见rows_for),默认全部
+
+        Returns:
+            发生变化的行下标
+        """
+        if rows is None:
+            rows = np.arange(len(self.ids))
+        if not len(rows):
+            return np.zeros(0, dtype=np.intp)
+
+        row_price = prices[self.symbol_index[rows]]
+        valid = np.isfinite(row_price) & (row_price > 0)
+        tick = self.tick[rows]
+        last = fp.to_fixed(np.where(valid, row_price, 0.0), tick)
+
+        long_volume, long_avg = self.long_volume[rows], self.long_avg[rows]
+        short_volume, short_avg = self.short_volume[rows], self.short_avg[rows]
+        multiplier = self.multiplier[rows]
+        has_long = (long_volume > 0) & (long_avg > 0)
+        has_short = (short_volume > 0) & (short_avg > 0)
+
+        # 与数据库DECIMAL(12,2)保持一致,避免浮点尾差导致无意义的写入
+        long_profit = np.round(np.where(
+            has_long,
+            fp.pnl(long_avg, last, long_volume, multiplier, tick, 1),
+            0.0
+        ), 2)
+        short_profit = np.round(np.where(
+            has_short,
+            fp.pnl(short_avg, last, short_volume, multiplier, tick, -1),
+            0.0
+        ), 2)
+
+        changed = valid & (
+            (row_price != self.last_price[rows])
+            | (long_profit != self.long_profit[rows])
+            | (short_profit != self.short_profit[rows])
+        )
+        changed_rows = rows[changed]
+
+        self.last_price[changed_rows] = row_price[changed]
+        self.long_profit[changed_rows] = long_profit[changed]
+        self.short_profit[changed_rows] = short_profit[changed]
+        self.dirty[changed_rows] = True
+        return changed_rows
+
+    def due(self, now: float, interval: float) -> np.ndarray:
+        """待写且距上次写库已满interval秒的行"""
+        return np.flatnonzero(self.dirty & (now - self.written_at >= interval))
+
+    def mark_written(self, rows: np.ndarray, now: float):
+        """记录写库完成"""
+        self.dirty[rows] = False
+        self.written_at[rows] = now
+
+    def upsert(self, row: Dict) -> Optional[int]:
+        """
+        同步单个持仓(成交入库/重建后调用)
+
+        已有持仓更新持仓量和均价,新持仓追加一行;浮盈在下次行情时重新计算。
+        簿记尚未加载或合约无法转换时忽略
+
+        Args:
+            row: positions表记录(需包含id)
+
+        Returns:
+            行下标
+        """
+        position_id = row.get('id')
+        if not position_id or self._resolvers is None:
+            return None
+
+        i = self._row_of.get(position_id)
+        if i is not None:
+            tick = float(self.tick[i])
+            self.long_volume[i] = row.get('long_position') or 0
+            self.long_avg[i] = fp.to_fixed(row.get('long_avg_price') or 0, tick)
+            self.short_volume[i] = row.get('short_position') or 0
+            self.short_avg[i] = fp.to_fixed(row.get('short_avg_price') or 0, tick)
+            return i
+
+        to_tqsdk, multiplier_of, tick_of = self._resolvers
+        symbol = row['symbol']
+        tq_symbol = to_tqsdk(symbol)
+        if tq_symbol is None:
+            return None
+
+        slot = self._symbol_slots.get(tq_symbol)
+        if slot is None:
+            slot = self._symbol_slots[tq_symbol] = len(self.tq_symbols)
+            self.tq_symbols.append(tq_symbol)
+
+        tick = tick_of(symbol)
+        last_price = row.get('last_price')
+        i = len(self.ids)
+        self.ids.append(position_id)
+        self.account_ids.append(row['account_id'])
+        self.symbols.append(symbol)
+        self.long_volume = np.append(self.long_volume, row.get('long_position') or 0)
+        self.long_avg = np.append(self.long_avg, fp.to_fixed(row.get('long_avg_price') or 0, tick))
+        self.short_volume = np.append(self.short_volume, row.get('short_position') or 0)
+        self.short_avg = np.append(self.short_avg, fp.to_fixed(row.get('short_avg_price') or 0, tick))
+        self.multiplier = np.append(self.multiplier, np.int64(multiplier_of(symbol)))
+        self.tick = np.append(self.tick, tick)
+        self.symbol_index = np.append(self.symbol_index, np.int32(slot))
+        self.last_price = np.append(self.last_price, float(last_price) if last_price else np.nan)
+        self.long_profit = np.append(self.long_profit, float(row.get('long_profit') or 0))
+        self.short_profit = np.append(self.short_profit, float(row.get('short_profit') or 0))
+        self.dirty = np.append(self.dirty, False)
+        self.written_at = np.append(self.written_at, -np.inf)
+
+        self._row_of[position_id] = i
+        self._symbol_rows = None
+        return i
+
+    def remove_account(self, account_id: str) -> int:
+        """
+        移除账户的全部持仓行,合约表只保留仍有持仓的合约
+
+        Returns:
+            移除的行数
+        """
+        keep = np.array([owner != account_id for owner in self.account_ids], dtype=bool)
+        removed = len(keep) - int(keep.sum())
+        if not removed:
+            return 0
+
+        kept = np.flatnonzero(keep).tolist()
+        self.ids = [self.ids[i] for i in kept]
+        self.account_ids = [self.account_ids[i] for i in kept]
+        self.symbols = [self.symbols[i] for i in kept]
+        for name in self.ROW_ARRAYS:
+            setattr(self, name, getattr(self, name)[keep])
+
+        used, symbol_index = np.unique(self.symbol_index, return_inverse=True)
+        self.tq_symbols = [self.tq_symbols[slot] for slot in used.tolist()]
+        self._symbol_slots = {tq_symbol: slot for slot, tq_symbol in enumerate(self.tq_symbols)}
+        self.symbol_index = symbol_index.astype(np.int32)
+        self._row_of = {position_id: i for i, position_id in enumerate(self.ids)}
+        self._symbol_rows = None
+        return removed
+
+    def to_rows(self, rows: np.ndarray, timestamp: str) -> List[Dict]:
+        """
+        生成批量写库记录
+
+        带上account_id/symbol以满足非空约束,upsert按id命中已有持仓
+        """
+        last_price = self.last_price[rows].tolist()
+        long_profit = self.long_profit[rows].tolist()
+        short_profit = self.short_profit[rows].tolist()
+
+        return [
+            {
+                "id": self.ids[row],
+                "account_id": self.account_ids[row],
+                "symbol": self.symbols[row],
+                "last_price": last_price[i],
+                "long_profit": long_profit[i],
+                "short_profit": short_profit[i],
+                "last_update_time": timestamp,
+                "updated_at": timestamp
+            }
+            for i, row in enumerate(rows.tolist())
+        ]
@@ -0,0 +1,97 @@
+"""
+持仓检查点存储
+
+检查点 = 某一时刻的持仓状态 + 最后计入的成交(水位) + 已计入成交笔数。
+重建持仓时从最近的有效检查点开始,只重放水位之后的成交
+
+有效性校验: 水位之前(含)的成交笔数必须与检查点记录的一致,
+补录了更早的成交或删除过成交的检查点会被判定失效并删除
+"""
+import asyncio
+from typing import Dict, List, Optional
+
+from utils.db import AsyncDatabase, async_db
+from utils.logger import get_logger
+from utils.trade_reader import through_watermark
+
+logger = get_logger(__name__)
+
+
+class CheckpointStore:
+    """position_checkpoints表读写"""
+
+    # 查找有效检查点时最多尝试的数量
+    MAX_CANDIDATES = 3
+
+    def __init__(self, db: AsyncDatabase = async_db):
+        self.db = db
+
+    async def save(self, rows: List[Dict]) -> int:
+        """
+        批量写入检查点
+
+        同一水位的检查点已存在时覆盖: 补录成交后旧检查点的成交笔数已失效
+
+        Returns:
+            写入条数
+        """
+        if not rows:
+            return 0
+
+        saved = await self.db.insert(
+            "position_checkpoints", rows, on_conflict="account_id,symbol,last_trade_id"
+        )
+        return len(saved)
+
+    async def latest_valid(self, account_id: str, symbol: str, price_tick: float) -> Optional[Dict]:
+        """
+        获取最近的有效检查点
+
+        Args:
+            account_id: 账户ID(UUID)
+            symbol: 合约代码(极星格式)
+            price_tick: 当前最小变动价位,与检查点不一致时检查点不可用
+
+        Returns:
+            检查点记录,没有可用检查点时返回None
+        """
+        rows = await self.db.select(
+            "position_checkpoints",
+            filters={"account_id": account_id, "symbol": symbol},
+            order=("last_trade_time.desc", "last_trade_id.desc"),
+            limit=self.MAX_CANDIDATES
+        )
+
+        for row in rows:
+            if float(row['price_tick']) != float(price_tick):
+                continue
+
+            count = await self._count_through(
+                account_id, symbol, row['last_trade_time'], row['last_trade_id']
+            )
+            if count == row['trade_count']:
+                return row
+
+            logger.warning(
+                f"[持仓检查点] {symbol} 检查点失效(成交数 {count} != {row['trade_count']}),已删除"
+            )
+            await self.db.delete("position_checkpoints", {"id": row['id']})
+
+        return None
+
+    async def delete(self, account_id: str, symbol: str) -> int:
+        """删除(账户, 合约)的全部检查点"""
+        deleted = await self.db.delete(
+            "position_checkpoints", {"account_id": account_id, "symbol": symbol}
+        )
+        return len(deleted)
+
+    async def _count_through(self, account_id: str, symbol: str, trade_time: str, trade_id: str) -> int:
+        """水位之前(含)的成交笔数(精确计数只能走PostgREST,在线程池中执行)"""
+        query = self.db.client.table("trades")\
+            .select("id", count="exact", head=True)\
+            .eq("account_id", account_id)\
+            .eq("symbol", symbol)\
+            .or_(through_watermark(trade_time, trade_id))
+        result = await asyncio.wait_for(asyncio.to_thread(query.execute), self.db.timeout)
+        return result.count or 0
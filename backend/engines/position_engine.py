@@ -1,126 +1,720 @@
 """
 持仓计算引擎
 根据成交记录重建持仓明细
+
+三种计算方式:
+1. 重建(rebuild_position): 从最近的有效检查点开始重放之后的成交,
+   没有检查点或force_full时从第一笔成交开始,用于手动修复
+2. 增量更新(apply_trades): 在内存持仓状态上只叠加新成交,
+   通过水位(最后一笔成交ID/时间)校验,水位不一致时退回重建
+3. 账户重建(rebuild_account): 分页读取账户全部成交,按合约分区后
+   多进程并行重放,一次批量写入全部持仓
+
+重放过程中按交易日切换和每N笔成交生成检查点(position_checkpoints表)。
+单合约重放通过utils.trade_reader逐页读取成交,内存占用与成交历史长度无关
 """
-from decimal import Decimal
-from typing import Dict
-from utils.db import get_supabase_client
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from dateutil.parser import isoparse
+from config import settings
+from engines.position_checkpoints import CheckpointStore
+from utils import fixed_point as fp
+from utils.db import async_db, get_supabase_client
+from utils.logger import get_logger
+from utils.trade_reader import iter_trade_pages
+from utils.trading_calendar import trading_day
+from services.contract_registry import contract_registry
+
+logger = get_logger(__name__)
+
+
+class PositionState:
+    """
+    单个(账户, 合约)的持仓状态
+
+    均价以定点整数保存(见utils.fixed_point),按合约最小变动价位换算
+    """
+
+    def __init__(
+        self,
+        long_position: int = 0,
+        long_avg: int = 0,
+        short_position: int = 0,
+        short_avg: int = 0,
+        last_trade_id: Optional[str] = None,
+        last_trade_time: Optional[str] = None,
+        tick: float = fp.DEFAULT_TICK,
+        trade_count: int = 0
+    ):
+        self.long_position = long_position
+        self.long_avg = long_avg
+        self.short_position = short_position
+        self.short_avg = short_avg
+        # 水位: 已计入持仓的最后一笔成交
+        self.last_trade_id = last_trade_id
+        self.last_trade_time = last_trade_time
+        self.tick = tick
+        # 已计入的成交笔数
+        self.trade_count = trade_count
+
+    @property
+    def long_avg_price(self) -> float:
+        return fp.to_price(self.long_avg, self.tick)
+
+    @property
+    def short_avg_price(self) -> float:
+        return fp.to_price(self.short_avg, self.tick)
+
+    @classmethod
+    def from_row(cls, row: Dict, tick: float = fp.DEFAULT_TICK) -> 'PositionState':
+        """从positions表记录恢复持仓状态"""
+        return cls(
+            long_position=row.get('long_position') or 0,
+            long_avg=fp.to_fixed(row.get('long_avg_price') or 0, tick),
+            short_position=row.get('short_position') or 0,
+            short_avg=fp.to_fixed(row.get('short_avg_price') or 0, tick),
+            last_trade_id=row.get('last_trade_id'),
+            last_trade_time=row.get('last_trade_time'),
+            tick=tick,
+            trade_count=row.get('trade_count') or 0
+        )
+
+    @classmethod
+    def from_checkpoint(cls, row: Dict) -> 'PositionState':
+        """从position_checkpoints表记录恢复持仓状态"""
+        return cls(
+            long_position=row['long_position'],
+            long_avg=int(row['long_avg_fixed']),
+            short_position=row['short_position'],
+            short_avg=int(row['short_avg_fixed']),
+            last_trade_id=row['last_trade_id'],
+            last_trade_time=row['last_trade_time'],
+            tick=float(row['price_tick']),
+            trade_count=row['trade_count']
+        )
+
+    def to_checkpoint(self, account_id: str, symbol: str) -> Dict:
+        """生成position_checkpoints表记录"""
+        return {
+            "account_id": account_id,
+            "symbol": symbol,
+            "trading_day": trading_day(self.last_trade_time).isoformat(),
+            "long_position": self.long_position,
+            "long_avg_fixed": self.long_avg,
+            "short_position": self.short_position,
+            "short_avg_fixed": self.short_avg,
+            "price_tick": self.tick,
+            "last_trade_id": self.last_trade_id,
+            "last_trade_time": self.last_trade_time,
+            "trade_count": self.trade_count
+        }
+
+    def same_as(self, other: 'PositionState') -> bool:
+        """持仓和水位是否一致"""
+        return (
+            self.long_position == other.long_position
+            and self.long_avg == other.long_avg
+            and self.short_position == other.short_position
+            and self.short_avg == other.short_avg
+            and self.last_trade_id == other.last_trade_id
+            and self.trade_count == other.trade_count
+        )
+
+    def copy(self) -> 'PositionState':
+        return PositionState(
+            self.long_position,
+            self.long_avg,
+            self.short_position,
+            self.short_avg,
+            self.last_trade_id,
+            self.last_trade_time,
+            self.tick,
+            self.trade_count
+        )
+
+    def apply(self, trade: Dict):
+        """
+        叠加一笔成交(开仓加权平均,平仓减少仓位)
+
+        Args:
+            trade: 成交记录,需包含direction/offset/volume/price
+        """
+        self.apply_many((trade,))
+
+    def apply_many(self, trades: Iterable[Dict]):
+        """
+        按顺序叠加多笔成交
+
+        重放热点: 循环中持仓和均价保存在局部变量中(定点整数),结束后一次写回
+
+        Args:
+            trades: 成交记录,需包含direction/offset/volume/price
+        """
+        scale, tick = fp.SCALE, self.tick
+        long_position, long_avg = self.long_position, self.long_avg
+        short_position, short_avg = self.short_position, self.short_avg
+        last_trade_id, last_trade_time = self.last_trade_id, self.last_trade_time
+        count = 0
+
+        for trade in trades:
+            count += 1
+            volume = trade['volume']
+            direction = trade['direction']
+            if trade['offset'] == 'open':
+                # 平仓不影响均价,只有开仓需要换算价格(与fp.to_fixed相同的舍入)
+                price = int(round(float(trade['price']) * scale / tick))
+                if direction == 'buy':
+                    # 买开:增加多仓(加权平均,同fp.weighted_average)
+                    total = long_position + volume
+                    long_avg = (long_avg * long_position + price * volume + total // 2) // total \
+                        if total > 0 else 0
+                    long_position = total
+                elif direction == 'sell':
+                    # 卖开:增加空仓(加权平均)
+                    total = short_position + volume
+                    short_avg = (short_avg * short_position + price * volume + total // 2) // total \
+                        if total > 0 else 0
+                    short_position = total
+            elif direction == 'buy':
+                # 买平:减少空仓
+                short_position = max(0, short_position - volume)
+                if short_position == 0:
+                    short_avg = 0
+            elif direction == 'sell':
+                # 卖平:减少多仓
+                long_position = max(0, long_position - volume)
+                if long_position == 0:
+                    long_avg = 0
+
+            last_trade_id = trade.get('id', last_trade_id)
+            last_trade_time = trade.get('timestamp', last_trade_time)
+
+        self.long_position, self.long_avg = long_position, long_avg
+        self.short_position, self.short_avg = short_position, short_avg
+        self.last_trade_id, self.last_trade_time = last_trade_id, last_trade_time
+        self.trade_count += count
+
+    def can_append(self, trades: List[Dict]) -> bool:
+        """
+        判断新成交能否直接叠加在当前状态之上
+
+        新成交必须都排在水位之后(按时间, ID),且不能包含已计入的成交
+        """
+        if not self.last_trade_id or not self.last_trade_time:
+            return False
+
+        watermark_time = isoparse(self.last_trade_time)
+        for trade in trades:
+            trade_time = isoparse(trade['timestamp'])
+            if trade_time < watermark_time:
+                return False
+            if trade_time == watermark_time and trade.get('id', '') <= self.last_trade_id:
+                return False
+        return True
+
+
+def replay_trades(
+    trades: List[Dict],
+    state: Optional[PositionState] = None,
+    tick: float = fp.DEFAULT_TICK
+) -> PositionState:
+    """
+    按顺序重放成交,返回最终持仓状态
+
+    Args:
+        trades: 成交记录(按时间正序)
+        state: 起始状态,默认空仓
+        tick: 最小变动价位(state为空时使用)
+
+    Returns:
+        持仓状态
+    """
+    state = state.copy() if state else PositionState(tick=tick)
+    state.apply_many(trades)
+    return state
+
+
+class CheckpointReplayer:
+    """
+    分批重放成交并在以下时机生成检查点:
+    - 交易日切换: 新交易日第一笔成交之前(即上一交易日收盘时的状态)
+    - 累计成交笔数每满every笔
+
+    逐页调用feed,交易日和检查点间隔跨页延续
+    """
+
+    def __init__(
+        self,
+        state: Optional[PositionState] = None,
+        tick: float = fp.DEFAULT_TICK,
+        every: int = 500
+    ):
+        self.state = state.copy() if state else PositionState(tick=tick)
+        self.every = every
+        self.checkpoints: List[PositionState] = []
+        self.replayed = 0
+        self._checkpoint_count = self.state.trade_count
+        self._day = trading_day(self.state.last_trade_time) if self.state.last_trade_time else None
+
+    def feed(self, trades: List[Dict]):
+        """
+        叠加一批成交
+
+        Args:
+            trades: 成交记录(按时间, ID正序,且在已重放成交之后)
+        """
+        state = self.state
+        # 检查点之间的成交整段叠加
+        start = 0
+        for i, trade in enumerate(trades):
+            trade_day = trading_day(trade['timestamp'])
+            if self._day is not None and trade_day != self._day:
+                state.apply_many(trades[start:i])
+                start = i
+                if state.trade_count > self._checkpoint_count:
+                    self.checkpoints.append(state.copy())
+                    self._checkpoint_count = state.trade_count
+            self._day = trade_day
+
+            if (state.trade_count + i + 1 - start) % self.every == 0:
+                state.apply_many(trades[start:i + 1])
+                start = i + 1
+                self.checkpoints.append(state.copy())
+                self._checkpoint_count = state.trade_count
+        state.apply_many(trades[start:])
+
+        self.replayed += len(trades)
+
+    def take_checkpoints(self) -> List[PositionState]:
+        """取出已生成的检查点(取出后清空)"""
+        checkpoints, self.checkpoints = self.checkpoints, []
+        return checkpoints
+
+
+def replay_with_checkpoints(
+    trades: List[Dict],
+    state: Optional[PositionState] = None,
+    tick: float = fp.DEFAULT_TICK,
+    every: int = 500
+) -> Tuple[PositionState, List[PositionState]]:
+    """
+    重放成交并生成检查点(见CheckpointReplayer)
+
+    Args:
+        trades: 成交记录(按时间, ID正序)
+        state: 起始状态,默认空仓
+        tick: 最小变动价位(state为空时使用)
+        every: 检查点间隔(成交笔数)
+
+    Returns:
+        (最终持仓状态, 检查点状态列表)
+    """
+    replayer = CheckpointReplayer(state, tick, every)
+    replayer.feed(trades)
+    return replayer.state, replayer.checkpoints
 
 
 class PositionEngine:
     """持仓计算引擎"""
 
+    # 重放需要的成交字段
+    REPLAY_COLUMNS = "id, symbol, direction, offset, volume, price, timestamp"
+    # 分页读取成交的页大小(不超过PostgREST的max-rows)
+    PAGE_SIZE = 1000
+    # 成交数少于该值时在当前进程重放,避免进程间传输开销
+    PARALLEL_MIN_TRADES = 5000
+
     def __init__(self):
         self.db = get_supabase_client()
+        self.checkpoints = CheckpointStore()
+        # 增量模式的内存持仓状态 {(account_id, symbol): PositionState}
+        self._states: Dict[Tuple[str, str], PositionState] = {}
+        # 账户重建用的进程池(首次使用时创建)
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        # 持仓变更监听者(如盯市持仓簿记)
+        self._listeners: List[Callable[[List[Dict]], None]] = []
+
+    def subscribe(self, listener: Callable[[List[Dict]], None]):
+        """
+        注册持仓变更监听: 持仓写库后以positions表记录列表回调
 
-    async def rebuild_position(self, account_id: str, symbol: str) -> Dict:
+        Args:
+            listener: 回调函数,不应阻塞
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, positions: List[Dict]):
+        for listener in self._listeners:
+            try:
+                listener(positions)
+            except Exception as e:
+                logger.error(f"[持仓计算] 持仓变更回调失败: {e}")
+
+    async def rebuild_position(
+        self,
+        account_id: str,
+        symbol: str,
+        force_full: bool = False,
+        verify: bool = False
+    ) -> Dict:
         """
         根据成交记录重建持仓
 
         核心算法:
-        1. 获取所有成交记录(按时间正序)
-        2. 逐笔计算持仓(开仓加权平均,平仓减少仓位)
-        3. 获取最新价格(天勤)
-        4. 计算浮盈浮亏
-        5. 更新数据库
+        1. 加载最近的有效检查点(force_full时跳过)
+        2. 逐页读取检查点之后的成交记录(按时间, ID正序)
+        3. 逐笔计算持仓(开仓加权平均,平仓减少仓位),途中生成新的检查点
+        4. 校验模式下再从第一笔成交全量重放,结果不一致时以全量结果为准
+        5. 更新数据库(同时写入水位)
 
         Args:
             account_id: 账户ID(极星账户ID,如85178443)
             symbol: 合约代码(极星格式)
+            force_full: 忽略检查点,从第一笔成交开始重放
+            verify: 校验检查点重放结果与全量重放是否一致
+
+        Returns:
+            更新后的持仓信息,rebuild字段说明重放方式
+        """
+        tick = self._get_price_tick(symbol)
+
+        # 1. 加载检查点
+        start_state = None
+        if not force_full:
+            checkpoint = await self.checkpoints.latest_valid(account_id, symbol, tick)
+            if checkpoint:
+                start_state = PositionState.from_checkpoint(checkpoint)
+
+        # 2-3. 逐页重放检查点之后的成交,检查点随页写入
+        replayer = CheckpointReplayer(start_state, tick, settings.position_checkpoint_interval)
+        await self._replay_stream(account_id, symbol, replayer, save=True)
+        state = replayer.state
+
+        rebuild_info = {
+            "mode": "checkpoint" if start_state else "full",
+            "checkpoint_trade_id": start_state.last_trade_id if start_state else None,
+            "checkpoint_trade_count": start_state.trade_count if start_state else 0,
+            "replayed_trades": replayer.replayed
+        }
+
+        # 4. 校验
+        if verify and start_state:
+            full = CheckpointReplayer(None, tick, settings.position_checkpoint_interval)
+            await self._replay_stream(account_id, symbol, full, save=False)
+            matched = state.same_as(full.state)
+            rebuild_info["verification"] = {
+                "matched": matched,
+                "checkpoint_result": self._state_summary(state),
+                "full_result": self._state_summary(full.state)
+            }
+            if not matched:
+                logger.warning(f"[持仓重建] {symbol} 检查点重放结果与全量重放不一致,已重建检查点")
+                await self.checkpoints.delete(account_id, symbol)
+                await self._save_checkpoints(account_id, symbol, full.take_checkpoints())
+                state = full.state
+                rebuild_info["mode"] = "full"
+
+        # 5. 更新或插入持仓数据
+        position_data = await self._build_position_data(account_id, symbol, state)
+
+        rows = await async_db.insert("positions", position_data, on_conflict="account_id,symbol")
+
+        self._states[(account_id, symbol)] = state
+        self._notify(rows)
+
+        position = dict(rows[0]) if rows else position_data
+        position["rebuild"] = rebuild_info
+        return position
+
+    async def _replay_stream(
+        self,
+        account_id: str,
+        symbol: str,
+        replayer: CheckpointReplayer,
+        save: bool = True
+    ):
+        """
+        逐页读取重放器水位之后的成交并重放
+
+        Args:
+            save: 每页重放后写入新生成的检查点;为False时检查点留在重放器中
+        """
+        state = replayer.state
+        after = None
+        if state.last_trade_id:
+            after = {"timestamp": state.last_trade_time, "id": state.last_trade_id}
+
+        async for page in iter_trade_pages(
+            account_id, symbol, self.REPLAY_COLUMNS, after=after,
+            page_size=self.PAGE_SIZE, db=self.db
+        ):
+            replayer.feed(page)
+            if save:
+                await self._save_checkpoints(account_id, symbol, replayer.take_checkpoints())
+
+    async def _save_checkpoints(self, account_id: str, symbol: str, checkpoints: List[PositionState]):
+        await self.checkpoints.save([
+            checkpoint.to_checkpoint(account_id, symbol) for checkpoint in checkpoints
+        ])
+
+    @staticmethod
+    def _state_summary(state: PositionState) -> Dict:
+        return {
+            "long_position": state.long_position,
+            "long_avg_price": state.long_avg_price,
+            "short_position": state.short_position,
+            "short_avg_price": state.short_avg_price,
+            "last_trade_id": state.last_trade_id,
+            "trade_count": state.trade_count
+        }
+
+    async def apply_trades(self, account_id: str, symbol: str, trades: List[Dict]) -> Dict:
+        """
+        增量更新持仓: 只叠加新成交,不重读历史
+
+        以下情况退回重建:
+        - 内存和数据库中都没有带水位的持仓状态
+        - 新成交早于水位(乱序到达)
+        - 写库时水位与数据库不一致(其他进程已更新过该持仓)
+
+        Args:
+            account_id: 账户ID(UUID)
+            symbol: 合约代码(极星格式)
+            trades: 新写入的成交记录(需包含id和timestamp)
 
         Returns:
             更新后的持仓信息
         """
-        # 1. 获取该合约的所有成交记录(时间正序)
-        trades_response = self.db.table("trades")\
-            .select("*")\
-            .eq("account_id", account_id)\
-            .eq("symbol", symbol)\
-            .order("timestamp", desc=False)\
-            .execute()
+        if not trades:
+            return {}
 
-        trades = trades_response.data
+        key = (account_id, symbol)
+        state = self._states.get(key)
+        if state is None:
+            state = await self._load_state(account_id, symbol)
+
+        if state is None or not state.can_append(trades):
+            return await self.rebuild_position(account_id, symbol)
+
+        ordered = sorted(trades, key=lambda t: (isoparse(t['timestamp']), t['id']))
+        new_state, checkpoints = replay_with_checkpoints(
+            ordered, state, every=settings.position_checkpoint_interval
+        )
+
+        # 最新价和浮盈由天勤行情服务维护,增量更新时不覆盖
+        position_data = await self._build_position_data(
+            account_id, symbol, new_state, with_profit=False
+        )
+
+        # 以旧水位作为更新条件,保证不会覆盖其他进程写入的结果
+        rows = await async_db.update("positions", position_data, {
+            "account_id": account_id,
+            "symbol": symbol,
+            "last_trade_id": state.last_trade_id
+        })
+
+        if not rows:
+            # 水位不一致,丢弃内存状态并全量重建
+            self._states.pop(key, None)
+            return await self.rebuild_position(account_id, symbol)
+
+        self._states[key] = new_state
+        await self._save_checkpoints(account_id, symbol, checkpoints)
+        self._notify(rows)
+        return rows[0]
+
+    async def rebuild_account(self, account_id: str) -> Dict:
+        """
+        重建账户下全部合约的持仓
 
-        # 2. 初始化持仓
-        long_position = 0
-        long_avg_price = Decimal('0')
-        short_position = 0
-        short_avg_price = Decimal('0')
+        流程:
+        1. 按(时间, ID)分页读取账户全部成交,只取重放需要的字段
+        2. 按合约分区
+        3. 各合约分区并行重放(成交较多时使用多进程)
+        4. 一次批量写入全部持仓,替换各合约的检查点
 
-        # 3. 逐笔计算
+        Args:
+            account_id: 账户ID(UUID)
+
+        Returns:
+            {"positions": 持仓列表, "trades": 成交数, "symbols": 合约数, "timings_ms": 各阶段耗时}
+        """
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+
+        # 1. 分页读取
+        trades: List[Dict] = []
+        pages = 0
+        async for page in iter_trade_pages(
+            account_id, columns=self.REPLAY_COLUMNS, page_size=self.PAGE_SIZE, db=self.db
+        ):
+            pages += 1
+            trades.extend(page)
+        timings["fetch"] = time.perf_counter() - started
+
+        # 2. 按合约分区(保持时间顺序)
+        phase = time.perf_counter()
+        partitions: Dict[str, List[Dict]] = {}
         for trade in trades:
-            volume = trade['volume']
-            price = Decimal(str(trade['price']))
-
-            if trade['direction'] == 'buy':
-                if trade['offset'] == 'open':
-                    # 买开:增加多仓(加权平均)
-                    if long_position > 0:
-                        old_cost = long_avg_price * long_position
-                        new_cost = price * volume
-                        long_position += volume
-                        long_avg_price = (old_cost + new_cost) / long_position
-                    else:
-                        long_position = volume
-                        long_avg_price = price
-                else:
-                    # 买平:减少空仓
-                    short_position = max(0, short_position - volume)
-                    if short_position == 0:
-                        short_avg_price = Decimal('0')
-
-            elif trade['direction'] == 'sell':
-                if trade['offset'] == 'open':
-                    # 卖开:增加空仓(加权平均)
-                    if short_position > 0:
-                        old_cost = short_avg_price * short_position
-                        new_cost = price * volume
-                        short_position += volume
-                        short_avg_price = (old_cost + new_cost) / short_position
-                    else:
-                        short_position = volume
-                        short_avg_price = price
-                else:
-                    # 卖平:减少多仓
-                    long_position = max(0, long_position - volume)
-                    if long_position == 0:
-                        long_avg_price = Decimal('0')
-
-        # 4. 获取合约乘数
-        multiplier = await self._get_contract_multiplier(symbol)
+            partitions.setdefault(trade['symbol'], []).append(trade)
+        timings["partition"] = time.perf_counter() - phase
+
+        # 3. 并行重放
+        phase = time.perf_counter()
+        symbols = list(partitions)
+        if len(trades) >= self.PARALLEL_MIN_TRADES and len(symbols) > 1:
+            loop = asyncio.get_running_loop()
+            pool = self._get_process_pool()
+            results = await asyncio.gather(*[
+                loop.run_in_executor(
+                    pool, replay_with_checkpoints, partitions[symbol], None,
+                    self._get_price_tick(symbol), settings.position_checkpoint_interval
+                )
+                for symbol in symbols
+            ])
+        else:
+            results = [
+                replay_with_checkpoints(
+                    partitions[symbol], None, self._get_price_tick(symbol),
+                    settings.position_checkpoint_interval
+                )
+                for symbol in symbols
+            ]
+        states = [state for state, _ in results]
+        timings["replay"] = time.perf_counter() - phase
+
+        # 4. 批量写入
+        phase = time.perf_counter()
+        rows = [
+            await self._build_position_data(account_id, symbol, state)
+            for symbol, state in zip(symbols, states)
+        ]
+        positions = rows
+        if rows:
+            positions = await async_db.insert(
+                "positions", rows, on_conflict="account_id,symbol"
+            ) or rows
+            self._notify(positions)
+        # 旧检查点的水位可能已不在新的成交序列上(补录/删除成交后),先删除再写入
+        await asyncio.gather(*(self.checkpoints.delete(account_id, symbol) for symbol in symbols))
+        await self.checkpoints.save([
+            checkpoint.to_checkpoint(account_id, symbol)
+            for symbol, (_, checkpoints) in zip(symbols, results)
+            for checkpoint in checkpoints
+        ])
+        for symbol, state in zip(symbols, states):
+            self._states[(account_id, symbol)] = state
+        timings["write"] = time.perf_counter() - phase
+
+        timings["total"] = time.perf_counter() - started
+        return {
+            "positions": positions,
+            "trades": len(trades),
+            "symbols": len(symbols),
+            "pages": pages,
+            "timings_ms": {name: round(value * 1000, 2) for name, value in timings.items()}
+        }
 
-        # 5. 获取最新价格(后续由天勤服务更新,这里先用0)
-        last_price = Decimal('0')
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(max_workers=settings.rebuild_workers)
+        return self._process_pool
 
-        # 6. 计算浮盈
-        long_profit = Decimal('0')
-        short_profit = Decimal('0')
+    def shutdown(self):
+        """关闭进程池"""
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False)
+            self._process_pool = None
 
-        if long_position > 0 and last_price > 0:
-            long_profit = (last_price - long_avg_price) * long_position * multiplier
+    async def _load_state(self, account_id: str, symbol: str) -> Optional[PositionState]:
+        """
+        恢复持仓状态,没有水位时返回None
 
-        if short_position > 0 and last_price > 0:
-            short_profit = (short_avg_price - last_price) * short_position * multiplier
+        优先从最近的检查点重放到positions表的水位(均价精确);
+        没有检查点时直接使用positions表记录
+        """
+        rows = await async_db.select(
+            "positions",
+            "long_position, long_avg_price, short_position, short_avg_price, "
+            "last_trade_id, last_trade_time, trade_count",
+            {"account_id": account_id, "symbol": symbol}
+        )
+
+        if not rows or not rows[0].get('last_trade_id'):
+            return None
+        row = rows[0]
+        if row.get('trade_count') is None:
+            # 检查点功能上线前写入的持仓,重建一次补齐成交笔数
+            return None
+
+        tick = self._get_price_tick(symbol)
+        checkpoint = await self.checkpoints.latest_valid(account_id, symbol, tick)
+        if checkpoint is None:
+            return PositionState.from_row(row, tick)
+
+        replayer = CheckpointReplayer(PositionState.from_checkpoint(checkpoint))
+        await self._replay_stream(account_id, symbol, replayer, save=False)
+        state = replayer.state
+        if state.last_trade_id != row['last_trade_id']:
+            return None
+        return state
+
+    async def _build_position_data(
+        self,
+        account_id: str,
+        symbol: str,
+        state: PositionState,
+        with_profit: bool = True
+    ) -> Dict:
+        """
+        根据持仓状态生成positions表记录
 
-        # 7. 更新或插入持仓数据
+        Args:
+            with_profit: 是否包含最新价和浮盈字段
+        """
         position_data = {
             "account_id": account_id,
             "symbol": symbol,
-            "long_position": long_position,
-            "long_avg_price": float(long_avg_price) if long_avg_price > 0 else None,
-            "long_profit": float(long_profit),
-            "short_position": short_position,
-            "short_avg_price": float(short_avg_price) if short_avg_price > 0 else None,
-            "short_profit": float(short_profit),
-            "last_price": float(last_price) if last_price > 0 else None,
+            "long_position": state.long_position,
+            "long_avg_price": state.long_avg_price if state.long_avg > 0 else None,
+            "short_position": state.short_position,
+            "short_avg_price": state.short_avg_price if state.short_avg > 0 else None,
+            "last_trade_id": state.last_trade_id,
+            "last_trade_time": state.last_trade_time,
+            "trade_count": state.trade_count,
             "updated_at": "now()"
         }
 
-        result = self.db.table("positions")\
-            .upsert(position_data, on_conflict="account_id,symbol")\
-            .execute()
+        if not with_profit:
+            return position_data
+
+        # 获取合约乘数
+        multiplier = await self._get_contract_multiplier(symbol)
 
-        return result.data[0] if result.data else position_data
+        # 获取最新价格(后续由天勤服务更新,这里先用0)
+        last_price = 0.0
+
+        # 计算浮盈
+        long_profit = 0.0
+        short_profit = 0.0
+
+        if last_price > 0:
+            last = fp.to_fixed(last_price, state.tick)
+            if state.long_position > 0:
+                long_profit = fp.pnl(state.long_avg, last, state.long_position,
+                                     multiplier, state.tick, 1)
+            if state.short_position > 0:
+                short_profit = fp.pnl(state.short_avg, last, state.short_position,
+                                      multiplier, state.tick, -1)
+
+        position_data.update({
+            "long_profit": long_profit,
+            "short_profit": short_profit,
+            "last_price": last_price if last_price > 0 else None
+        })
+        return position_data
 
     async def _get_contract_multiplier(self, symbol: str) -> int:
         """
@@ -132,16 +726,11 @@ class PositionEngine:
         Returns:
             合约乘数,默认10
         """
-        try:
-            result = self.db.table("contracts")\
-                .select("multiplier")\
-                .eq("polar_symbol", symbol)\
-                .single()\
-                .execute()
+        return contract_registry.get_multiplier(symbol)
 
-            return result.data.get('multiplier', 10) if result.data else 10
-        except Exception:
-            return 10  # 默认乘数
+    def _get_price_tick(self, symbol: str) -> float:
+        """获取最小变动价位,未登记时使用默认值"""
+        return contract_registry.get_price_tick(symbol, fp.DEFAULT_TICK)
 
     async def get_all_positions(self, account_id: str) -> list:
         """
@@ -153,50 +742,56 @@ class PositionEngine:
         Returns:
             持仓列表
         """
-        result = self.db.table("v_positions_summary")\
-            .select("*")\
-            .eq("account_id", account_id)\
-            .execute()
-
-        return result.data
+        return await async_db.select("v_positions_summary", filters={"account_id": account_id})
 
     async def update_position_price(self, symbol: str, last_price: float):
         """
         更新持仓的最新价格(由天勤服务调用)
 
+        该合约的全部持仓重算浮盈后一次批量写入(按id upsert)
+
         Args:
             symbol: 合约代码(极星格式)
             last_price: 最新价格
         """
         # 获取所有该合约的持仓
-        positions_response = self.db.table("positions")\
-            .select("*")\
-            .eq("symbol", symbol)\
-            .execute()
+        positions = await async_db.select(
+            "positions",
+            "id, account_id, long_position, long_avg_price, short_position, short_avg_price",
+            {"symbol": symbol}
+        )
+        if not positions:
+            return
+
+        multiplier = await self._get_contract_multiplier(symbol)
+        tick = self._get_price_tick(symbol)
+        last = fp.to_fixed(last_price, tick)
 
-        for position in positions_response.data:
+        rows = []
+        for position in positions:
             # 重新计算浮盈
-            multiplier = await self._get_contract_multiplier(symbol)
 
             long_profit = 0
             short_profit = 0
 
             if position['long_position'] > 0 and position['long_avg_price']:
-                long_profit = (last_price - float(position['long_avg_price'])) * \
-                             position['long_position'] * multiplier
+                long_profit = fp.pnl(fp.to_fixed(position['long_avg_price'], tick), last,
+                                     position['long_position'], multiplier, tick, 1)
 
             if position['short_position'] > 0 and position['short_avg_price']:
-                short_profit = (float(position['short_avg_price']) - last_price) * \
-                              position['short_position'] * multiplier
-
-            # 更新
-            self.db.table("positions")\
-                .update({
-                    "last_price": last_price,
-                    "long_profit": long_profit,
-                    "short_profit": short_profit,
-                    "last_update_time": "now()",
-                    "updated_at": "now()"
-                })\
-                .eq("id", position['id'])\
-                .execute()
+                short_profit = fp.pnl(fp.to_fixed(position['short_avg_price'], tick), last,
+                                      position['short_position'], multiplier, tick, -1)
+
+            # account_id/symbol满足非空约束,按id命中已有持仓
+            rows.append({
+                "id": position['id'],
+                "account_id": position['account_id'],
+                "symbol": symbol,
+                "last_price": last_price,
+                "long_profit": long_profit,
+                "short_profit": short_profit,
+                "last_update_time": "now()",
+                "updated_at": "now()"
+            })
+
+        await async_db.insert("positions", rows, on_conflict="id")
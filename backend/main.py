@@ -4,7 +4,9 @@
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Dict, List, Optional
+import asyncio
+import uuid
 import uvicorn
 from datetime import datetime
 
@@ -14,16 +16,44 @@ from models.schemas import (
     PositionSnapshot,
     ResponseModel,
     Position,
-    PositionListResponse
+    PositionListResponse,
+    QuotesRequest
 )
 from engines.position_engine import PositionEngine
-from utils.db import get_supabase_client, test_connection
+from services.trade_ingest_service import TradeIngestService
+from services.trade_journal import TradeJournal
+from services.position_feed import PositionFeed
+from services.position_events import PositionPublisher
+from utils.db import async_db, get_supabase_client, test_connection
+from utils.account_resolver import account_resolver
+from utils.single_flight import single_flight
+from utils.quote_table import get_quote_table
+from services.contract_registry import contract_registry
 from utils.contract_mapper import ContractMapper
 
 
 # 全局实例
 position_engine = PositionEngine()
 supabase = get_supabase_client()
+trade_ingest_service = TradeIngestService(
+    position_engine, async_db, dedup_cache_size=settings.trade_dedup_cache_size
+)
+trade_journal = TradeJournal(
+    trade_ingest_service,
+    path=settings.trade_journal_path,
+    flush_interval=settings.trade_journal_flush_interval,
+    batch_size=settings.trade_journal_batch_size
+) if settings.trade_ingest_mode == "journal" else None
+# 持仓推送(/ws/positions)
+position_feed = PositionFeed(
+    async_db,
+    max_rate=settings.position_ws_max_rate,
+    mark_interval=settings.position_ws_mark_interval
+)
+position_engine.subscribe(position_feed.on_positions)
+# 持仓变更通知(独立运行的行情服务据此同步盯市持仓簿记)
+position_publisher = PositionPublisher(async_db)
+position_engine.subscribe(position_publisher)
 
 
 # 生命周期管理
@@ -39,15 +69,33 @@ async def lifespan(app: FastAPI):
     else:
         print("❌ Database connection failed")
 
+    # 建立异步连接池(不可用时回退PostgREST)
+    await async_db.connect()
+
+    # 加载合约注册表
+    await contract_registry.load()
+
+    # 启动成交日志(重放未入库的成交)
+    if trade_journal:
+        await trade_journal.start()
+
     # 初始化天勤连接（单例模式）
     from services.tqsdk_manager import tqsdk_manager
-    tqsdk_manager.get_api()  # 提前建立连接
+    tqsdk_manager.start()  # 行情线程中提前建立连接
+
+    # 持仓推送的盯市循环
+    position_feed.start()
 
     yield
 
     # 关闭时
     print("🛑 Shutting down...")
-    tqsdk_manager.close()  # 关闭天勤连接
+    if trade_journal:
+        await trade_journal.stop()
+    await position_feed.stop()
+    await tqsdk_manager.close()  # 关闭天勤连接
+    position_engine.shutdown()
+    await async_db.close()
 
 
 # 创建FastAPI应用
@@ -221,6 +269,57 @@ async def detailed_health_check():
     return health_data
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """
+    运行时指标 - 用于监控系统
+
+    返回各进程内缓存/组件的统计信息
+    """
+    from services.tqsdk_manager import tqsdk_manager
+    from services.kline_store import kline_store
+    from services.kline_resampler import resample_cache
+
+    quote_table = get_quote_table(allow_stale=True)
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "database": async_db.stats(),
+        "single_flight": single_flight.stats(),
+        "account_resolver": account_resolver.stats(),
+        "contract_registry": contract_registry.stats(),
+        "trade_ingest": trade_ingest_service.stats(),
+        "trade_journal": trade_journal.stats() if trade_journal else None,
+        "position_feed": position_feed.stats(),
+        "position_events": position_publisher.stats(),
+        "quote_table": quote_table.stats() if quote_table else None,
+        "tqsdk": tqsdk_manager.stats(),
+        "kline_store": kline_store.stats() if kline_store else None,
+        "kline_resample": resample_cache.stats()
+    }
+
+
+# ============================================
+# 账户缓存接口
+# ============================================
+
+@app.post("/api/accounts/cache/invalidate")
+async def invalidate_account_cache(polar_account_id: Optional[str] = None):
+    """
+    失效账户ID解析缓存
+
+    账户新增/修改/删除后调用;不调用时缓存最多在TTL(account_cache_ttl,不存在的账户为account_cache_negative_ttl)后更新
+
+    Query Parameters:
+        polar_account_id: 极星账户ID (可选,为空时清空全部)
+    """
+    removed = account_resolver.invalidate(polar_account_id)
+    return ResponseModel(
+        code=200,
+        message="Account cache invalidated",
+        data={"removed": removed}
+    )
+
+
 # ============================================
 # 极星数据接收接口
 # ============================================
@@ -231,46 +330,43 @@ async def receive_trade(trade: TradeEvent):
     接收极星推送的成交数据
 
     极星v12.py策略调用此接口推送每笔成交
+
+    journal模式下成交写入本地日志后立即返回,由后台批量入库
     """
     try:
         # 1. 查找账户ID(将极星账户ID转为UUID)
-        account_response = supabase.table("accounts")\
-            .select("id")\
-            .eq("polar_account_id", trade.account_id)\
-            .single()\
-            .execute()
+        account_uuid = await account_resolver.resolve(trade.account_id)
 
-        if not account_response.data:
+        if not account_uuid:
             raise HTTPException(
                 status_code=404,
                 detail=f"Account not found: {trade.account_id}"
             )
 
-        account_uuid = account_response.data['id']
-
-        # 2. 存储成交记录
-        trade_data = {
-            "account_id": account_uuid,
-            "symbol": trade.symbol,
-            "direction": trade.direction,
-            "offset": trade.offset,
-            "volume": trade.volume,
-            "price": trade.price,
-            "order_id": trade.order_id,
-            "timestamp": trade.timestamp.isoformat(),
-            "source": trade.source
-        }
+        # 2. 最近已入库的重复成交直接返回
+        if trade_ingest_service.is_recent_duplicate(account_uuid, trade):
+            return ResponseModel(
+                code=200,
+                message="Duplicate trade ignored",
+                data={"trade_id": trade.order_id, "duplicate": True}
+            )
 
-        supabase.table("trades").insert(trade_data).execute()
+        if trade_journal:
+            seq = await trade_journal.append(trade)
+            return ResponseModel(
+                code=200,
+                message="Trade accepted",
+                data={"trade_id": trade.order_id, "journal_seq": seq}
+            )
 
-        # 3. 触发持仓重建
-        await position_engine.rebuild_position(account_uuid, trade.symbol)
+        # 3. 存储成交记录并增量更新持仓(重复成交不写库、不重算)
+        result = await trade_ingest_service.ingest_trade(account_uuid, trade)
 
         # 4. 返回成功
         return ResponseModel(
             code=200,
-            message="Trade received successfully",
-            data={"trade_id": trade.order_id}
+            message="Duplicate trade ignored" if result["duplicate"] else "Trade received successfully",
+            data={"trade_id": trade.order_id, "duplicate": result["duplicate"]}
         )
 
     except HTTPException:
@@ -279,6 +375,43 @@ async def receive_trade(trade: TradeEvent):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/trades/batch", response_model=ResponseModel)
+async def receive_trades_batch(trades: List[TradeEvent]):
+    """
+    批量接收极星推送的成交数据
+
+    用于一次成交多手或断线重连后的补推:
+    账户只解析一次,成交一次性写入,每个(账户, 合约)只更新一次持仓
+
+    Body:
+        TradeEvent数组
+    """
+    if len(trades) > settings.trade_batch_max_size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch too large: {len(trades)} > {settings.trade_batch_max_size}"
+        )
+
+    try:
+        results = await trade_ingest_service.ingest_batch(trades)
+        # 重复成交视为已接收,调用方无需重推
+        accepted = sum(1 for r in results if r["status"] in ("ok", "duplicate"))
+
+        return ResponseModel(
+            code=200,
+            message=f"Received {accepted}/{len(trades)} trades",
+            data={
+                "total": len(trades),
+                "accepted": accepted,
+                "failed": len(trades) - accepted,
+                "results": results
+            }
+        )
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/api/position_snapshots", response_model=ResponseModel)
 async def receive_snapshot(snapshot: PositionSnapshot):
     """
@@ -288,17 +421,11 @@ async def receive_snapshot(snapshot: PositionSnapshot):
     """
     try:
         # 查找账户ID
-        account_response = supabase.table("accounts")\
-            .select("id")\
-            .eq("polar_account_id", snapshot.account_id)\
-            .single()\
-            .execute()
+        account_uuid = await account_resolver.resolve(snapshot.account_id)
 
-        if not account_response.data:
+        if not account_uuid:
             raise HTTPException(status_code=404, detail="Account not found")
 
-        account_uuid = account_response.data['id']
-
         # 获取计算的持仓
         calculated_response = supabase.table("positions")\
             .select("long_position, short_position")\
@@ -348,6 +475,8 @@ async def receive_snapshot(snapshot: PositionSnapshot):
             data={"matched": is_matched}
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -366,24 +495,18 @@ async def get_positions(account_polar_id: str):
     """
     try:
         # 查找账户
-        account_response = supabase.table("accounts")\
-            .select("id")\
-            .eq("polar_account_id", account_polar_id)\
-            .single()\
-            .execute()
+        account_uuid = await account_resolver.resolve(account_polar_id)
 
-        if not account_response.data:
+        if not account_uuid:
             raise HTTPException(status_code=404, detail="Account not found")
 
-        account_uuid = account_response.data['id']
-
-        # 获取持仓
-        positions_response = supabase.table("v_positions_summary")\
-            .select("*")\
-            .eq("account_id", account_uuid)\
-            .execute()
+        # 获取持仓(并发的相同请求共享一次查询)
+        rows = await single_flight.do(
+            "/api/positions/{account_polar_id}", account_uuid,
+            lambda: async_db.select("v_positions_summary", filters={"account_id": account_uuid})
+        )
 
-        positions = [Position(**pos) for pos in positions_response.data]
+        positions = [Position(**pos) for pos in rows]
 
         return PositionListResponse(
             total=len(positions),
@@ -397,27 +520,32 @@ async def get_positions(account_polar_id: str):
 
 
 @app.post("/api/positions/rebuild/{account_polar_id}/{symbol}")
-async def rebuild_position(account_polar_id: str, symbol: str):
+async def rebuild_position(
+    account_polar_id: str,
+    symbol: str,
+    force_full: bool = False,
+    verify: bool = False
+):
     """
     手动触发持仓重建
 
-    用于数据不一致时的修复
+    用于数据不一致时的修复。默认从最近的有效检查点开始重放
+
+    Query Parameters:
+        force_full: 忽略检查点,从第一笔成交开始重放
+        verify: 同时全量重放,校验检查点结果(不一致时以全量结果为准)
     """
     try:
         # 查找账户
-        account_response = supabase.table("accounts")\
-            .select("id")\
-            .eq("polar_account_id", account_polar_id)\
-            .single()\
-            .execute()
+        account_uuid = await account_resolver.resolve(account_polar_id)
 
-        if not account_response.data:
+        if not account_uuid:
             raise HTTPException(status_code=404, detail="Account not found")
 
-        account_uuid = account_response.data['id']
-
         # 重建持仓
-        result = await position_engine.rebuild_position(account_uuid, symbol)
+        result = await position_engine.rebuild_position(
+            account_uuid, symbol, force_full=force_full, verify=verify
+        )
 
         return ResponseModel(
             code=200,
@@ -425,6 +553,36 @@ async def rebuild_position(account_polar_id: str, symbol: str):
             data=result
         )
 
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/positions/rebuild-all/{account_polar_id}")
+async def rebuild_account_positions(account_polar_id: str):
+    """
+    重建账户下全部合约的持仓
+
+    对账不一致时使用: 账户成交只读取一次,按合约并行重放,
+    全部持仓一次写入。返回各阶段耗时(fetch/partition/replay/write)
+    """
+    try:
+        account_uuid = await account_resolver.resolve(account_polar_id)
+
+        if not account_uuid:
+            raise HTTPException(status_code=404, detail="Account not found")
+
+        result = await position_engine.rebuild_account(account_uuid)
+
+        return ResponseModel(
+            code=200,
+            message=f"Rebuilt {result['symbols']} positions from {result['trades']} trades",
+            data=result
+        )
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -436,8 +594,21 @@ async def rebuild_position(account_polar_id: str, symbol: str):
 @app.get("/api/contracts")
 async def get_contracts():
     """获取所有合约"""
-    result = supabase.table("contracts").select("*").execute()
-    return {"total": len(result.data), "contracts": result.data}
+    contracts = await single_flight.do(
+        "/api/contracts", None, lambda: async_db.select("contracts")
+    )
+    return {"total": len(contracts), "contracts": contracts}
+
+
+@app.post("/api/contracts/registry/reload")
+async def reload_contract_registry():
+    """重新加载合约注册表(直接修改contracts表后调用)"""
+    count = await contract_registry.load()
+    return ResponseModel(
+        code=200,
+        message="Contract registry reloaded",
+        data={"total": count}
+    )
 
 
 @app.get("/api/contracts/convert/polar-to-tqsdk")
@@ -458,13 +629,14 @@ async def convert_polar_to_tqsdk(polar_symbol: str):
 async def get_lock_configs(account_id: str = None):
     """获取锁仓配置列表"""
     try:
-        query = supabase.table("v_active_lock_configs").select("*")
-
-        if account_id:
-            query = query.eq("account_id", account_id)
-
-        result = query.execute()
-        return {"total": len(result.data), "configs": result.data}
+        configs = await single_flight.do(
+            "/api/lock/configs", account_id,
+            lambda: async_db.select(
+                "v_active_lock_configs",
+                filters={"account_id": account_id} if account_id else None
+            )
+        )
+        return {"total": len(configs), "configs": configs}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -601,7 +773,8 @@ async def get_lock_executions(
 async def get_kline(
     symbol: str,
     duration: int = 300,
-    length: int = 500
+    length: int = 500,
+    format: str = "rows"
 ):
     """
     获取K线数据
@@ -610,18 +783,21 @@ async def get_kline(
         symbol: 合约代码(TqSDK格式,如 CZCE.TA2505)
         duration: K线周期(秒) - 60=1分钟, 300=5分钟, 3600=1小时, 86400=日线
         length: 获取的K线数量(默认500)
+        format: rows=逐条K线(默认), columnar=列式 {time: [...], open: [...], ...}
     """
     try:
         from services.kline_service import KlineService
 
+        columnar = format == "columnar"
         service = KlineService()
-        klines = service.get_klines(symbol, duration, length)
+        klines = await service.get_klines(symbol, duration, length, columnar=columnar)
         # 使用单例模式,不需要手动关闭连接
 
         return {
             "symbol": symbol,
             "duration": duration,
-            "total": len(klines),
+            "format": "columnar" if columnar else "rows",
+            "total": len(klines["time"]) if columnar else len(klines),
             "klines": klines
         }
     except Exception as e:
@@ -633,7 +809,8 @@ async def get_kline_with_positions(
     symbol: str,
     account_id: str,
     duration: int = 300,
-    length: int = 500
+    length: int = 500,
+    format: str = "rows"
 ):
     """
     获取K线数据并叠加持仓标记
@@ -643,18 +820,24 @@ async def get_kline_with_positions(
         account_id: 账户ID
         duration: K线周期(秒)
         length: K线数量
+        format: rows=逐条K线(默认), columnar=列式
     """
     try:
         from services.kline_service import KlineService
 
+        columnar = format == "columnar"
         service = KlineService()
-        data = service.get_klines_with_positions(symbol, account_id, duration, length)
+        data = await service.get_klines_with_positions(
+            symbol, account_id, duration, length, columnar=columnar
+        )
         # 使用单例模式,不需要手动关闭连接
 
+        klines = data['klines']
         return {
             "symbol": symbol,
             "duration": duration,
-            "total": len(data['klines']),
+            "format": "columnar" if columnar else "rows",
+            "total": len(klines['time']) if columnar else len(klines),
             "klines": data['klines'],
             "markers": data['markers'],
             "position": data['position']
@@ -663,22 +846,137 @@ async def get_kline_with_positions(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# 行情接口返回字段 → 行情共享表字段
+QUOTE_RESPONSE_FIELDS = {
+    "last_price": "last_price",
+    "open": "open",
+    "high": "highest",
+    "low": "lowest",
+    "volume": "volume",
+    "open_interest": "open_interest",
+    "bid_price": "bid_price1",
+    "ask_price": "ask_price1",
+    "datetime": "datetime",
+    "updated_at": "updated_at",
+}
+
+# 批量行情查询的最大合约数
+MAX_QUOTE_SYMBOLS = 500
+
+
 @app.get("/api/quote/{symbol}")
 async def get_quote(symbol: str):
-    """获取实时行情"""
-    try:
+    """
+    获取实时行情
+
+    优先读取行情进程写入的共享表(不依赖本进程的TqApi,也不会触发新订阅);
+    共享表不存在、心跳超时或未收录该合约时回退到天勤API,
+    天勤API也取不到时才返回心跳超时的共享表中的行情,此时stale为true
+
+    Path Parameters:
+        symbol: 天勤格式合约代码,如"CZCE.TA2505"
+    """
+    table = get_quote_table()
+    if table is not None:
+        quote = table.get(symbol)
+        if quote is not None:
+            return _table_quote(symbol, quote, stale=False)
+
+    from services.kline_service import KlineService
+
+    quote = await KlineService().get_quote(symbol)
+    if quote:
+        return {**quote, "stale": False}
+
+    table = get_quote_table(allow_stale=True)
+    quote = table.get(symbol) if table is not None else None
+    if quote is not None:
+        return _table_quote(symbol, quote, stale=True)
+    raise HTTPException(status_code=404, detail="Quote not found")
+
+
+def _table_quote(symbol: str, quote: Dict, stale: bool) -> dict:
+    """共享表中的行情转为接口返回格式"""
+    return {
+        "symbol": symbol,
+        **{name: quote[field] for name, field in QUOTE_RESPONSE_FIELDS.items()},
+        "stale": stale
+    }
+
+
+@app.get("/api/quotes")
+async def get_quotes(symbols: str, fields: Optional[str] = None):
+    """
+    批量获取实时行情
+
+    Query Parameters:
+        symbols: 逗号分隔的天勤格式合约代码,如"SHFE.rb2505,CZCE.TA2505"
+        fields: 逗号分隔的返回字段(可选,默认全部),如"last_price,bid_price,ask_price"
+    """
+    return await _quote_snapshot(
+        symbols.split(","),
+        fields.split(",") if fields else None
+    )
+
+
+@app.post("/api/quotes")
+async def post_quotes(request: QuotesRequest):
+    """批量获取实时行情(合约较多时使用),参数同GET /api/quotes"""
+    return await _quote_snapshot(request.symbols, request.fields)
+
+
+async def _quote_snapshot(symbols: List[str], fields: Optional[List[str]]) -> dict:
+    """
+    一次读取一组合约的最新行情,返回紧凑的数组格式:
+    {"fields": ["symbol", ...], "quotes": [["SHFE.rb2505", ...], ...], "missing": [...], "stale": [...]}
+
+    共享表不存在、心跳超时或未收录的合约回退到天勤API(各合约的读取在行情线程的同一轮中执行);
+    天勤API也取不到时使用心跳超时的共享表,这些合约列在stale中
+    """
+    symbols = list(dict.fromkeys(symbol.strip() for symbol in symbols if symbol.strip()))
+    if not symbols:
+        raise HTTPException(status_code=400, detail="symbols is required")
+    if len(symbols) > MAX_QUOTE_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_QUOTE_SYMBOLS} symbols per request")
+
+    names = [name.strip() for name in fields if name.strip()] if fields else list(QUOTE_RESPONSE_FIELDS)
+    unknown = [name for name in names if name not in QUOTE_RESPONSE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {','.join(unknown)}")
+
+    table_fields = [QUOTE_RESPONSE_FIELDS[name] for name in names]
+    quotes: List[Optional[List]] = [None] * len(symbols)
+    table = get_quote_table()
+    if table is not None:
+        for i, quote in enumerate(table.get_many(symbols)):
+            if quote is not None:
+                quotes[i] = [quote[field] for field in table_fields]
+
+    misses = [i for i, values in enumerate(quotes) if values is None]
+    if misses:
         from services.kline_service import KlineService
 
         service = KlineService()
-        quote = service.get_quote(symbol)
-        # 使用单例模式,不需要手动关闭连接
+        results = await asyncio.gather(*(service.get_quote(symbols[i]) for i in misses))
+        for i, quote in zip(misses, results):
+            if quote:
+                quotes[i] = [quote.get(name) for name in names]
+
+    stale: List[str] = []
+    misses = [i for i, values in enumerate(quotes) if values is None]
+    table = get_quote_table(allow_stale=True) if misses else None
+    if table is not None:
+        for i, quote in zip(misses, table.get_many([symbols[i] for i in misses])):
+            if quote is not None:
+                quotes[i] = [quote[field] for field in table_fields]
+                stale.append(symbols[i])
 
-        if quote:
-            return quote
-        else:
-            raise HTTPException(status_code=404, detail="Quote not found")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "fields": ["symbol"] + names,
+        "quotes": [[symbol] + values for symbol, values in zip(symbols, quotes) if values is not None],
+        "missing": [symbol for symbol, values in zip(symbols, quotes) if values is None],
+        "stale": stale
+    }
 
 
 # ============================================
@@ -728,12 +1026,14 @@ async def list_contracts(
 async def get_main_contracts():
     """获取所有主力合约"""
     try:
-        result = supabase.table("v_main_contracts").select("*").execute()
+        contracts = await single_flight.do(
+            "/api/contracts/main", None, lambda: async_db.select("v_main_contracts")
+        )
 
         return ResponseModel(
             code=200,
             message="Success",
-            data={"total": len(result.data), "contracts": result.data}
+            data={"total": len(contracts), "contracts": contracts}
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1156,15 +1456,14 @@ async def get_instance_params(instance_id: str):
         params = await service.get_params(instance_id)
 
         # 同时获取参数定义信息
-        result = supabase.table("v_current_strategy_params")\
-            .select("*")\
-            .eq("instance_id", instance_id)\
-            .execute()
+        details = await async_db.select(
+            "v_current_strategy_params", filters={"instance_id": instance_id}
+        )
 
         return ResponseModel(
             code=200,
             message="Success",
-            data={"params": params, "details": result.data}
+            data={"params": params, "details": details}
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1896,21 +2195,111 @@ async def get_resource_usage(group_id: str, hours: int = 24):
 
 
 # ============================================
-# WebSocket实时推送(后续实现)
+# WebSocket实时推送
 # ============================================
 
+async def _serve_websocket(websocket: WebSocket, push):
+    """
+    运行推送协程直到连接结束
+
+    推送和接收(客户端消息忽略,只用于感知断开)各为一个任务,
+    任一结束(客户端断开、发送失败)时取消另一个并关闭连接
+    """
+    async def receive():
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(push()), asyncio.create_task(receive())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    for task in done:
+        error = None if task.cancelled() else task.exception()
+        if error is not None and not isinstance(error, WebSocketDisconnect):
+            print(f"⚠️  WebSocket推送中断: {error}")
+    try:
+        await websocket.close()
+    except Exception:
+        # 连接已关闭
+        pass
+
+
 @app.websocket("/ws/positions")
-async def websocket_positions(websocket: WebSocket):
-    """WebSocket实时推送持仓变化"""
+async def websocket_positions(websocket: WebSocket, account_id: str):
+    """
+    WebSocket实时推送持仓变化
+
+    连接后先推送账户当前持仓快照,之后只推送变化的字段:
+    {"type": "snapshot", "account_id": ..., "positions": {合约: {字段: 值}}}
+    {"type": "delta", "account_id": ..., "positions": {合约: {变化字段: 值}}}
+
+    客户端消费慢时,未发送的变化按持仓合并,推送频率不超过position_ws_max_rate
+
+    Query Parameters:
+        account_id: 账户ID(UUID或极星账户ID)
+    """
     await websocket.accept()
     try:
+        account_uuid = str(uuid.UUID(account_id))
+    except ValueError:
+        account_uuid = await account_resolver.resolve(account_id)
+    if not account_uuid:
+        await websocket.close(code=1008, reason="account not found")
+        return
+
+    try:
+        snapshot, subscription = await position_feed.subscribe(account_uuid)
+    except Exception as e:
+        await websocket.close(code=1011, reason=str(e)[:120])
+        return
+
+    async def push():
+        await websocket.send_json({"type": "snapshot", "account_id": account_uuid, "positions": snapshot})
         while True:
-            # 等待客户端消息
-            _ = await websocket.receive_text()
-            # 这里后续集成Supabase Realtime
-            await websocket.send_json({"message": "Connected"})
-    except WebSocketDisconnect:
-        print("WebSocket disconnected")
+            positions = await subscription.get()
+            await websocket.send_json({"type": "delta", "account_id": account_uuid, "positions": positions})
+
+    try:
+        await _serve_websocket(websocket, push)
+    finally:
+        position_feed.unsubscribe(subscription)
+
+
+@app.websocket("/ws/bars/{symbol}")
+async def websocket_bars(websocket: WebSocket, symbol: str):
+    """
+    WebSocket实时推送1分钟K线(由行情tick实时合成)
+
+    每根K线收线时推送一条:
+    {"type": "bar", "symbol": ..., "duration": 60,
+     "bar": {"time", "open", "high", "low", "close", "volume", "open_interest"}}
+
+    Args:
+        symbol: 合约代码(TqSDK格式,如 SHFE.rb2505)
+    """
+    from services.tqsdk_manager import tqsdk_manager
+
+    await websocket.accept()
+    bars = tqsdk_manager.bars
+    if bars is None:
+        await websocket.close(code=1013, reason="bar aggregator disabled")
+        return
+
+    subscription = bars.subscribe(symbol)
+
+    async def push():
+        while True:
+            await websocket.send_json(await subscription.get())
+
+    try:
+        await bars.watch(symbol)
+        await _serve_websocket(websocket, push)
+    finally:
+        bars.unsubscribe(subscription)
 
 
 # ============================================
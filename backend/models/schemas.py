@@ -2,7 +2,7 @@
 Pydantic数据模型定义
 """
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from decimal import Decimal
 
@@ -20,6 +20,7 @@ class TradeEvent(BaseModel):
     volume: int = Field(..., gt=0, description="成交手数")
     price: float = Field(..., gt=0, description="成交价格")
     order_id: Optional[str] = Field(None, description="订单ID")
+    fill_seq: Optional[int] = Field(None, ge=0, description="订单内成交序号(同一订单分多次成交时递增),为空时不去重")
     timestamp: datetime = Field(..., description="成交时间")
     source: str = Field(default="polar", description="数据来源")
 
@@ -33,6 +34,7 @@ class TradeEvent(BaseModel):
                 "volume": 2,
                 "price": 5500.0,
                 "order_id": "ORDER123456",
+                "fill_seq": 0,
                 "timestamp": "2025-01-15T10:30:00",
                 "source": "polar"
             }
@@ -124,6 +126,16 @@ class Contract(BaseModel):
         from_attributes = True
 
 
+# ============================================
+# 行情查询模型
+# ============================================
+
+class QuotesRequest(BaseModel):
+    """批量行情查询(合约较多时用POST)"""
+    symbols: List[str] = Field(..., min_length=1, description="合约代码(天勤格式)")
+    fields: Optional[List[str]] = Field(None, description="返回的行情字段,为空时返回全部")
+
+
 # ============================================
 # API响应模型
 # ============================================
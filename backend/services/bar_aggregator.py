@@ -0,0 +1,398 @@
+"""
+实时K线合成
+
+把天勤行情推送(最新价、累计成交量、持仓量)合成为1分钟K线,每个合约只保存进行中的一根:
+- 成交量取累计成交量的增量(交易日切换时累计量归零,增量取当前累计量);
+  没有成交的tick只推进时钟,不形成K线
+- K线按北京时间对齐到整分钟;收盘时刻的tick(如15:00:00)归入前一根K线并立即收线,
+  开盘前集合竞价的tick归入开盘第一根K线。交易时段取自合约的trading_time,未知时用常见时刻
+- 新的一分钟出现tick时收上一根;没有后续tick时(收盘、成交清淡),
+  交易所时钟越过K线结束时刻grace秒后收线
+- 服务启动后(或首次订阅后)每个合约的第一根K线不完整,不发布
+
+收线的K线按合约发布给订阅者(WebSocket),并写入本地K线存储的独立序列(source="tick"),
+不与天勤1分钟K线混存: 合成K线是近似值,不能占据天勤K线的位置
+"""
+import asyncio
+import math
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from services.kline_resampler import BASE_DURATION, NS, TZ_OFFSET
+from services.kline_store import KlineStore
+from services.market_event_pump import MarketEventPump, exchange_timestamp
+from utils.logger import get_logger
+from utils.pubsub import PubSub, Subscription
+
+logger = get_logger(__name__)
+
+DAY_NS = 86400 * NS
+# 开盘前此时间内(秒)的tick为集合竞价,归入开盘第一根K线
+AUCTION_WINDOW = 300
+
+# 交易时段未知时使用的开盘/收盘时刻(北京时间,当日秒数)
+DEFAULT_SESSION_STARTS = (9 * 3600, 21 * 3600)
+DEFAULT_SESSION_ENDS = frozenset({
+    10 * 3600 + 15 * 60, 11 * 3600 + 30 * 60, 15 * 3600, 15 * 3600 + 15 * 60,
+    23 * 3600, 1 * 3600, 2 * 3600 + 30 * 60
+})
+
+# K线字段(datetime为起始时间,纳秒)
+BAR_FIELDS = ("datetime", "open", "high", "low", "close", "volume", "open_interest")
+# 合成K线在本地K线存储中的来源标识
+STORE_SOURCE = "tick"
+
+
+def _seconds(value: str) -> int:
+    """交易时段时刻("25:00:00"表示次日01:00) → 当日秒数"""
+    hours, minutes, seconds = (int(part) for part in value.split(":"))
+    return (hours * 3600 + minutes * 60 + seconds) % 86400
+
+
+def session_bounds(trading_time: Dict[str, List[List[str]]]) -> Tuple[Tuple[int, ...], frozenset]:
+    """
+    合约交易时段 → (开盘时刻, 收盘时刻)
+
+    Args:
+        trading_time: {"day": [["09:00:00", "10:15:00"], ...], "night": [["21:00:00", "25:00:00"]]}
+    """
+    periods = list(trading_time.get("day") or []) + list(trading_time.get("night") or [])
+    starts = tuple(sorted({_seconds(start) for start, _ in periods}))
+    ends = frozenset(_seconds(end) for _, end in periods)
+    return starts, ends
+
+
+def _finite(value: Any) -> Optional[float]:
+    """NaN(天勤无数据)/非数值 → None"""
+    if value is None or isinstance(value, str):
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+class BarState:
+    """一个合约的合成状态"""
+
+    __slots__ = (
+        "start", "open", "high", "low", "close", "volume", "open_interest",
+        "last_price", "last_volume", "first_start", "last_closed"
+    )
+
+    def __init__(self):
+        # 进行中的K线(start为None表示没有)
+        self.start: Optional[int] = None
+        self.open = self.high = self.low = self.close = 0.0
+        self.volume = 0
+        self.open_interest = 0
+        # 最新行情
+        self.last_price: Optional[float] = None
+        self.last_volume: Optional[int] = None
+        # 首个tick所在K线(不完整),最近收线的K线
+        self.first_start: Optional[int] = None
+        self.last_closed: Optional[int] = None
+
+
+class BarAggregator:
+    """由行情事件合成1分钟K线"""
+
+    # 到期收线的检查间隔(秒)
+    SWEEP_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        pump: MarketEventPump,
+        store: Optional[KlineStore] = None,
+        grace: float = 3,
+        queue_size: int = 1000
+    ):
+        """
+        Args:
+            pump: 行情事件泵
+            store: 本地K线存储(None时不保存)
+            grace: K线结束后等待迟到tick的时间(秒)
+            queue_size: 每个订阅者最多积压的K线数
+        """
+        self.pump = pump
+        self.store = store
+        self.duration = BASE_DURATION
+        self.grace = int(grace * NS)
+        self.hub = PubSub(queue_size)
+
+        self._states: Dict[str, BarState] = {}
+        # {合约: (开盘时刻, 收盘时刻)}
+        self._sessions: Dict[str, Tuple[Tuple[int, ...], frozenset]] = {}
+        # 已请求交易时段的合约
+        self._session_requests: Set[str] = set()
+        # 交易所时钟: (最新tick时间, 收到时的monotonic_ns)
+        self._clock: Optional[Tuple[int, int]] = None
+        # 待保存的K线
+        self._unsaved: List[Tuple[str, Dict]] = []
+        self._tasks: List[asyncio.Task] = []
+        # 进行中的交易时段加载(保留引用,完成后移除)
+        self._session_tasks: Set[asyncio.Task] = set()
+
+        # 统计
+        self.ticks = 0
+        self.bars = 0
+        self.late = 0
+        self.saved = 0
+        self.save_errors = 0
+
+    def start(self):
+        """启动合成(需在事件循环中调用)"""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._consume()),
+            asyncio.create_task(self._sweep())
+        ]
+
+    async def stop(self):
+        """停止合成,保存已收线的K线"""
+        for task in self._tasks + list(self._session_tasks):
+            task.cancel()
+        self._tasks = []
+        self._session_tasks.clear()
+        await asyncio.to_thread(self._save, self._take_unsaved())
+
+    async def watch(self, symbol: str):
+        """订阅合约行情并加载交易时段"""
+        self.pump.subscribe([symbol])
+        await self._load_sessions(symbol)
+
+    def subscribe(self, symbol: str) -> Subscription:
+        """订阅合约收线的K线(消息见_message)"""
+        return self.hub.subscribe(symbol)
+
+    def unsubscribe(self, subscription: Subscription):
+        self.hub.unsubscribe(subscription)
+
+    # ---------- 合成 ----------
+
+    def on_quote(self, symbol: str, fields: Dict[str, Any]) -> List[Dict]:
+        """
+        处理一个合约的行情变化
+
+        Args:
+            fields: 本次变化的行情字段
+
+        Returns:
+            因此收线的K线
+        """
+        state = self._states.get(symbol)
+        if state is None:
+            state = self._states[symbol] = BarState()
+
+        price = _finite(fields.get("last_price"))
+        if price is not None:
+            state.last_price = price
+        open_interest = _finite(fields.get("open_interest"))
+        if open_interest is not None:
+            state.open_interest = int(open_interest)
+
+        delta = 0
+        volume = _finite(fields.get("volume"))
+        first = state.last_volume is None
+        if volume is not None:
+            volume = int(volume)
+            if not first:
+                delta = volume - state.last_volume if volume >= state.last_volume else volume
+            state.last_volume = volume
+
+        tick_time = exchange_timestamp(fields.get("datetime"))
+        if tick_time is None:
+            return []
+        tick_ns = int(round(tick_time * NS))
+        self._advance_clock(tick_ns)
+        self.ticks += 1
+
+        start, at_close = self._bar_start(symbol, tick_ns)
+        if first or state.first_start is None:
+            state.first_start = start
+
+        finished = []
+        if state.start is not None and start != state.start:
+            if start < state.start:
+                if delta > 0:
+                    self.late += 1
+                return []
+            finished.append(self._close(symbol, state))
+
+        if delta > 0 and state.last_price is not None:
+            if state.last_closed is not None and start <= state.last_closed:
+                # 所属K线已收线
+                self.late += 1
+            elif state.start is None:
+                state.start = start
+                state.open = state.high = state.low = state.close = state.last_price
+                state.volume = delta
+            else:
+                state.high = max(state.high, state.last_price)
+                state.low = min(state.low, state.last_price)
+                state.close = state.last_price
+                state.volume += delta
+
+        if at_close and state.start is not None:
+            finished.append(self._close(symbol, state))
+        return [bar for bar in finished if bar is not None]
+
+    def close_due(self) -> List[Tuple[str, Dict]]:
+        """收掉交易所时钟已越过结束时刻(含grace)的K线"""
+        now = self._now()
+        if now is None:
+            return []
+        deadline = now - self.duration * NS - self.grace
+        finished = []
+        for symbol, state in self._states.items():
+            if state.start is not None and state.start <= deadline:
+                bar = self._close(symbol, state)
+                if bar is not None:
+                    finished.append((symbol, bar))
+        return finished
+
+    def current(self, symbol: str) -> Optional[Dict]:
+        """进行中的K线"""
+        state = self._states.get(symbol)
+        if state is None or state.start is None:
+            return None
+        return self._bar(state)
+
+    def set_sessions(self, symbol: str, trading_time: Dict[str, List[List[str]]]):
+        """设置合约的交易时段"""
+        bounds = session_bounds(trading_time)
+        if bounds[0]:
+            self._sessions[symbol] = bounds
+
+    def _bar_start(self, symbol: str, tick_ns: int) -> Tuple[int, bool]:
+        """tick时间 → (所属K线起始时间, 是否收盘时刻的tick)"""
+        step = self.duration * NS
+        local = tick_ns + TZ_OFFSET
+        start = local // step * step
+        second = (local % DAY_NS) // NS
+        starts, ends = self._sessions.get(symbol, (DEFAULT_SESSION_STARTS, DEFAULT_SESSION_ENDS))
+
+        if local == start and second in ends:
+            return start - step - TZ_OFFSET, True
+        for open_at in starts:
+            if 0 < open_at - second <= AUCTION_WINDOW:
+                return local - local % DAY_NS + open_at * NS - TZ_OFFSET, False
+        return start - TZ_OFFSET, False
+
+    def _close(self, symbol: str, state: BarState) -> Optional[Dict]:
+        """收线,不完整的第一根K线返回None"""
+        bar = None if state.start == state.first_start else self._bar(state)
+        state.last_closed = state.start
+        state.start = None
+        return bar
+
+    @staticmethod
+    def _bar(state: BarState) -> Dict:
+        return {
+            "datetime": state.start,
+            "open": state.open,
+            "high": state.high,
+            "low": state.low,
+            "close": state.close,
+            "volume": state.volume,
+            "open_interest": state.open_interest
+        }
+
+    def _advance_clock(self, tick_ns: int):
+        if self._clock is None or tick_ns > self._clock[0]:
+            self._clock = (tick_ns, time.monotonic_ns())
+
+    def _now(self) -> Optional[int]:
+        """交易所当前时间(最新tick时间 + 此后经过的本地时间),不受本地时钟偏差影响"""
+        if self._clock is None:
+            return None
+        tick_ns, received = self._clock
+        return tick_ns + time.monotonic_ns() - received
+
+    # ---------- 发布与保存 ----------
+
+    def _publish(self, symbol: str, bar: Dict):
+        self.bars += 1
+        if self.hub.has_subscribers(symbol):
+            self.hub.publish(symbol, self._message(symbol, bar))
+        if self.store is not None:
+            self._unsaved.append((symbol, bar))
+
+    def _message(self, symbol: str, bar: Dict) -> Dict:
+        message_bar = {"time": bar["datetime"] // NS}
+        message_bar.update((field, bar[field]) for field in BAR_FIELDS[1:])
+        return {"type": "bar", "symbol": symbol, "duration": self.duration, "bar": message_bar}
+
+    def _take_unsaved(self) -> List[Tuple[str, Dict]]:
+        unsaved, self._unsaved = self._unsaved, []
+        return unsaved
+
+    def _save(self, unsaved: List[Tuple[str, Dict]]):
+        """写入本地K线存储(按合约批量,可在线程中执行)"""
+        by_symbol: Dict[str, List[Dict]] = {}
+        for symbol, bar in unsaved:
+            by_symbol.setdefault(symbol, []).append(bar)
+
+        for symbol, bars in by_symbol.items():
+            try:
+                self.saved += self.store.save(symbol, self.duration, {
+                    field: np.array([bar[field] for bar in bars]) for field in BAR_FIELDS
+                }, source=STORE_SOURCE)
+            except Exception as e:
+                self.save_errors += 1
+                logger.warning(f"[K线合成] 保存失败 {symbol}: {e}")
+
+    async def _load_sessions(self, symbol: str):
+        if symbol in self._session_requests:
+            return
+        self._session_requests.add(symbol)
+
+        def read(api: Any) -> Dict[str, List[List[str]]]:
+            trading_time = api.get_quote(symbol).trading_time
+            return {
+                "day": [list(period) for period in trading_time.day],
+                "night": [list(period) for period in trading_time.night]
+            }
+
+        try:
+            self.set_sessions(symbol, await self.pump.call(read))
+        except Exception as e:
+            if not self.pump.running:
+                # 行情线程未运行,下次订阅时重试;其他错误不再重试,使用默认时段
+                self._session_requests.discard(symbol)
+            logger.warning(f"[K线合成] 获取交易时段失败 {symbol}: {e}")
+
+    async def _consume(self):
+        async for event in self.pump.events():
+            for symbol, fields in event.changes.items():
+                if symbol not in self._session_requests:
+                    task = asyncio.create_task(self._load_sessions(symbol))
+                    self._session_tasks.add(task)
+                    task.add_done_callback(self._session_tasks.discard)
+                for bar in self.on_quote(symbol, fields):
+                    self._publish(symbol, bar)
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL)
+            try:
+                for symbol, bar in self.close_due():
+                    self._publish(symbol, bar)
+                if self._unsaved:
+                    await asyncio.to_thread(self._save, self._take_unsaved())
+            except Exception as e:
+                logger.error(f"[K线合成] 收线检查错误: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "symbols": len(self._states),
+            "open_bars": sum(1 for state in self._states.values() if state.start is not None),
+            "ticks": self.ticks,
+            "bars": self.bars,
+            "late": self.late,
+            "saved": self.saved,
+            "save_errors": self.save_errors,
+            "unsaved": len(self._unsaved),
+            "subscribers": self.hub.stats()
+        }
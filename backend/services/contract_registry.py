@@ -0,0 +1,275 @@
+"""
+合约元数据注册表
+
+启动时从contracts表一次性加载(await load()),进程内提供:
+- 合约乘数 / 最小变动价位 / 保证金比例
+- 极星格式 ↔ 天勤格式 双向映射
+
+合约同步(ContractService.sync_contract_info)写库后会刷新对应条目,
+各引擎和服务直接读取内存,不再逐条查询数据库。
+启动加载失败时,查询会在后台重新加载(不阻塞事件循环),加载完成前按未登记合约处理
+"""
+import asyncio
+import re
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from utils.contract_mapper import ContractMapper
+from utils.db import async_db, get_supabase_client
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ContractMeta:
+    """单个合约的元数据"""
+
+    def __init__(
+        self,
+        polar_symbol: Optional[str],
+        tqsdk_symbol: Optional[str],
+        multiplier: Optional[int] = None,
+        price_tick: Optional[float] = None,
+        margin_ratio: Optional[float] = None,
+        exchange: Optional[str] = None,
+        variety_code: Optional[str] = None
+    ):
+        self.polar_symbol = polar_symbol
+        self.tqsdk_symbol = tqsdk_symbol
+        self.multiplier = multiplier
+        self.price_tick = price_tick
+        self.margin_ratio = margin_ratio
+        self.exchange = exchange
+        self.variety_code = variety_code
+
+    @classmethod
+    def from_row(cls, row: Dict) -> Optional['ContractMeta']:
+        """
+        从contracts表记录构造
+
+        兼容两套表结构:
+        - 001: polar_symbol / tqsdk_symbol / multiplier
+        - 004: symbol(天勤格式) / contract_multiplier
+        """
+        tqsdk_symbol = row.get("tqsdk_symbol") or row.get("symbol")
+        polar_symbol = row.get("polar_symbol")
+
+        if not polar_symbol and tqsdk_symbol:
+            try:
+                polar_symbol = ContractMapper.tqsdk_to_polar(tqsdk_symbol)
+            except ValueError:
+                polar_symbol = None
+
+        if not polar_symbol and not tqsdk_symbol:
+            return None
+
+        multiplier = row.get("multiplier") or row.get("contract_multiplier")
+        price_tick = row.get("price_tick")
+        margin_ratio = row.get("margin_ratio")
+
+        return cls(
+            polar_symbol=polar_symbol,
+            tqsdk_symbol=tqsdk_symbol,
+            multiplier=int(multiplier) if multiplier else None,
+            price_tick=float(price_tick) if price_tick else None,
+            margin_ratio=float(margin_ratio) if margin_ratio else None,
+            exchange=row.get("exchange"),
+            variety_code=row.get("variety_code")
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "polar_symbol": self.polar_symbol,
+            "tqsdk_symbol": self.tqsdk_symbol,
+            "multiplier": self.multiplier,
+            "price_tick": self.price_tick,
+            "margin_ratio": self.margin_ratio,
+            "exchange": self.exchange,
+            "variety_code": self.variety_code
+        }
+
+
+class ContractRegistry:
+    """合约元数据注册表"""
+
+    DEFAULT_MULTIPLIER = 10
+    RETRY_INTERVAL = 30  # 加载失败后的重试间隔(秒)
+
+    def __init__(self):
+        # 统一索引: 归一化代码 → 元数据 (两种格式都能命中)
+        self._by_key: Dict[str, ContractMeta] = {}
+        self._loaded = False
+        self._loading: Optional[asyncio.Task] = None
+        self._last_attempt = 0.0
+        self.loaded_at: Optional[datetime] = None
+
+    @staticmethod
+    def _normalize(symbol: str) -> Optional[str]:
+        """
+        归一化合约代码,忽略格式差异和大小写
+
+        ZCE|F|TA|2505 / ZCE|Z|TA|505 / CZCE.TA505 → CZCE.TA2505
+        """
+        if not symbol:
+            return None
+        if '|' in symbol:
+            try:
+                symbol = ContractMapper.polar_to_tqsdk(symbol)
+            except ValueError:
+                return None
+
+        symbol = symbol.upper()
+
+        # 郑商所三位月份(TA505)补全为四位
+        match = re.match(r'^(CZCE\.[A-Z]+)(\d{3})$', symbol)
+        if match:
+            symbol = f"{match.group(1)}2{match.group(2)}"
+
+        return symbol
+
+    def _index(self, index: Dict[str, ContractMeta], meta: ContractMeta):
+        for symbol in (meta.polar_symbol, meta.tqsdk_symbol):
+            key = self._normalize(symbol)
+            if key:
+                index[key] = meta
+
+    async def load(self) -> int:
+        """
+        从数据库全量加载
+
+        Returns:
+            加载的合约数量
+        """
+        self._last_attempt = time.monotonic()
+        try:
+            rows = await async_db.select("contracts")
+        except Exception as e:
+            logger.error(f"加载合约注册表失败: {e}")
+            return 0
+        return self._replace(rows)
+
+    def _load_sync(self) -> int:
+        """同步加载(只用于没有事件循环的场景,如脚本和子进程)"""
+        self._last_attempt = time.monotonic()
+        try:
+            rows = get_supabase_client().table("contracts").select("*").execute().data
+        except Exception as e:
+            logger.error(f"加载合约注册表失败: {e}")
+            return 0
+        return self._replace(rows)
+
+    def _replace(self, rows: List[Dict]) -> int:
+        index: Dict[str, ContractMeta] = {}
+        for row in rows:
+            meta = ContractMeta.from_row(row)
+            if meta:
+                self._index(index, meta)
+
+        # 整体替换,读取方不会看到半成品
+        self._by_key = index
+        self._loaded = True
+        self.loaded_at = datetime.now()
+
+        count = len({id(meta) for meta in index.values()})
+        logger.info(f"合约注册表加载完成: {count}个合约")
+        return count
+
+    def ensure_loaded(self):
+        """
+        未加载时加载(失败后按间隔重试)
+
+        在事件循环中调用时在后台加载、立即返回;没有事件循环时同步加载
+        """
+        if self._loaded or self._loading is not None:
+            return
+        if self._last_attempt and time.monotonic() - self._last_attempt < self.RETRY_INTERVAL:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._load_sync()
+            return
+
+        self._loading = loop.create_task(self.load())
+        self._loading.add_done_callback(self._loaded_in_background)
+
+    def _loaded_in_background(self, _task: asyncio.Task):
+        self._loading = None
+
+    def upsert(self, row: Dict) -> Optional[ContractMeta]:
+        """用合约记录刷新注册表(合约同步后调用)"""
+        meta = ContractMeta.from_row(row)
+        if not meta:
+            return None
+
+        # 合并已有元数据,同步记录可能缺少部分字段
+        existing = self.get(meta.polar_symbol or meta.tqsdk_symbol)
+        if existing:
+            if not row.get("polar_symbol"):
+                # 推导出的极星代码不如已登记的准确
+                meta.polar_symbol = existing.polar_symbol or meta.polar_symbol
+            for field, value in meta.to_dict().items():
+                if value is None:
+                    setattr(meta, field, getattr(existing, field))
+
+        index = dict(self._by_key)
+        self._index(index, meta)
+        self._by_key = index
+        return meta
+
+    def get(self, symbol: str) -> Optional[ContractMeta]:
+        """
+        查询合约元数据
+
+        Args:
+            symbol: 极星格式或天勤格式合约代码
+        """
+        self.ensure_loaded()
+        key = self._normalize(symbol)
+        return self._by_key.get(key) if key else None
+
+    def get_multiplier(self, symbol: str, default: int = DEFAULT_MULTIPLIER) -> int:
+        """获取合约乘数,未知合约返回默认值"""
+        meta = self.get(symbol)
+        return meta.multiplier if meta and meta.multiplier else default
+
+    def get_price_tick(self, symbol: str, default: Optional[float] = None) -> Optional[float]:
+        """获取最小变动价位"""
+        meta = self.get(symbol)
+        return meta.price_tick if meta and meta.price_tick else default
+
+    def get_margin_ratio(self, symbol: str, default: Optional[float] = None) -> Optional[float]:
+        """获取保证金比例"""
+        meta = self.get(symbol)
+        return meta.margin_ratio if meta and meta.margin_ratio else default
+
+    def polar_to_tqsdk(self, polar_symbol: str) -> Optional[str]:
+        """极星格式 → 天勤格式,未登记的合约返回None"""
+        meta = self.get(polar_symbol)
+        return meta.tqsdk_symbol if meta else None
+
+    def to_tqsdk(self, polar_symbol: str) -> Optional[str]:
+        """极星格式 → 天勤格式,未登记的合约按命名规则转换,无法转换时返回None"""
+        try:
+            return self.polar_to_tqsdk(polar_symbol) or ContractMapper.polar_to_tqsdk(polar_symbol)
+        except ValueError:
+            return None
+
+    def tqsdk_to_polar(self, tqsdk_symbol: str) -> Optional[str]:
+        """天勤格式 → 极星格式,未登记的合约返回None"""
+        meta = self.get(tqsdk_symbol)
+        return meta.polar_symbol if meta else None
+
+    def stats(self) -> Dict:
+        """注册表统计"""
+        return {
+            "loaded": self._loaded,
+            "contracts": len({id(meta) for meta in self._by_key.values()}),
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None
+        }
+
+
+# 全局实例
+contract_registry = ContractRegistry()
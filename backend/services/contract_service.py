@@ -16,6 +16,7 @@ from tqsdk import TqApi
 from supabase import Client
 
 from backend.utils.notification import send_notification
+from services.contract_registry import contract_registry
 
 logger = logging.getLogger(__name__)
 
@@ -166,7 +167,13 @@ class ContractService:
             )
 
             self.logger.info(f"同步合约信息成功: {symbol}")
-            return result.data[0] if result.data else None
+
+            # 刷新内存注册表
+            contract = result.data[0] if result.data else None
+            if contract:
+                contract_registry.upsert(contract)
+
+            return contract
 
         except Exception as e:
             self.logger.error(f"同步合约信息失败 {symbol}: {e}")
@@ -0,0 +1,265 @@
+"""
+K线序列缓存
+
+按(合约, 周期, 长度档位)缓存天勤K线序列:
+- 序列在行情线程中登记订阅(不等待数据),数据到齐后生成首个快照并通知等待的请求,
+  之后每次wait_update后只刷新有变化的序列
+- 请求只读取快照(按请求长度截取尾部),不再每次调用get_kline_serial
+- 长度向上取整到档位(2的幂),相近长度的请求共用一个序列
+- 订阅数超过预算时淘汰最久未使用的序列,并通知天勤释放对应图表(依赖tqsdk内部结构,见_release)
+
+快照是只读的numpy数组,行情线程整体替换快照引用,读取方无需加锁
+"""
+import asyncio
+import math
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from services.market_event_pump import MarketEventPump
+from utils.logger import get_logger
+from utils.single_flight import single_flight
+
+logger = get_logger(__name__)
+
+# 快照保留的K线字段
+COLUMNS = ("datetime", "open", "high", "low", "close", "volume")
+
+# 长度档位范围(天勤单个序列最长10000根)
+MIN_LENGTH_BUCKET = 256
+MAX_LENGTH = 10000
+
+# 等待新订阅序列数据到齐的最长时间(秒),与天勤get_kline_serial的超时相当
+READY_TIMEOUT = 30
+
+SeriesKey = Tuple[str, int, int]
+
+
+def length_bucket(length: int) -> int:
+    """请求长度 → 订阅长度档位(不小于请求长度的2的幂)"""
+    length = min(max(int(length), 1), MAX_LENGTH)
+    return min(max(MIN_LENGTH_BUCKET, 1 << (length - 1).bit_length()), MAX_LENGTH)
+
+
+class KlineSeries:
+    """一个已订阅的K线序列"""
+
+    def __init__(self, key: SeriesKey, ready: asyncio.Future):
+        self.key = key
+        # 天勤K线DataFrame(只在行情线程中访问,登记订阅后才有)
+        self.df: Any = None
+        # 首个快照生成后完成(订阅失败时为异常),事件循环中等待
+        self.ready = ready
+        # 最新快照 {字段: numpy数组}
+        self.snapshot: Dict[str, np.ndarray] = {}
+        # 快照版本,每次刷新加1
+        self.version = 0
+
+    @property
+    def loaded(self) -> bool:
+        """数据是否已到达(行情线程): 最后一根K线已有时间"""
+        return self.df is not None and len(self.df) > 0 \
+            and not math.isnan(self.df["datetime"].iloc[-1])
+
+    def refresh(self):
+        """复制DataFrame为新快照(行情线程)"""
+        self.snapshot = {column: self.df[column].to_numpy(copy=True) for column in COLUMNS}
+        self.version += 1
+
+    def settle(self, error: Optional[Exception] = None):
+        """通知等待方已就绪或订阅失败(行情线程)"""
+        def resolve():
+            if self.ready.done():
+                return
+            if error is not None:
+                self.ready.set_exception(error)
+            else:
+                self.ready.set_result(None)
+
+        try:
+            self.ready.get_loop().call_soon_threadsafe(resolve)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+
+class KlineCache:
+    """K线序列缓存(LRU淘汰)"""
+
+    def __init__(self, pump: MarketEventPump, budget: int = 32):
+        """
+        Args:
+            pump: 持有TqApi的行情事件泵
+            budget: 最多同时订阅的序列数
+        """
+        self.pump = pump
+        self.budget = budget
+        # 事件循环线程维护的LRU顺序
+        self._entries: "OrderedDict[SeriesKey, KlineSeries]" = OrderedDict()
+        # 行情线程维护的订阅中序列
+        self._live: Dict[SeriesKey, KlineSeries] = {}
+        # tqsdk内部结构不符,无法释放序列(只提示一次)
+        self._release_unsupported = False
+        pump.add_update_hook(self._on_update)
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+
+    async def get(self, symbol: str, duration: int, length: int) -> Dict[str, np.ndarray]:
+        """
+        获取K线快照
+
+        Args:
+            symbol: 天勤格式合约代码
+            duration: K线周期(秒)
+            length: K线数量
+
+        Returns:
+            {字段: 最近length根K线的numpy数组}
+        """
+        key = (symbol, int(duration), length_bucket(length))
+        series = self._entries.get(key)
+        if series is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        else:
+            self.misses += 1
+            # 并发的相同请求只订阅一次
+            series = await single_flight.do("kline_cache", key, lambda: self._open(key))
+
+        return {column: values[-length:] for column, values in series.snapshot.items()}
+
+    def version(self, symbol: str, duration: int, length: int) -> Optional[int]:
+        """已订阅序列的快照版本(不影响LRU顺序),未订阅时返回None"""
+        series = self._entries.get((symbol, int(duration), length_bucket(length)))
+        return series.version if series is not None else None
+
+    async def discard(self, symbol: str, duration: int, length: int):
+        """立即取消订阅(数据已另行保存,不再需要实时更新时)"""
+        series = self._entries.pop((symbol, int(duration), length_bucket(length)), None)
+        if series is not None:
+            await self.pump.call(lambda api: self._release(api, series))
+
+    async def _open(self, key: SeriesKey) -> KlineSeries:
+        ready = asyncio.get_running_loop().create_future()
+        series = await self.pump.call(lambda api: self._subscribe(api, key, ready))
+        try:
+            await asyncio.wait_for(asyncio.shield(series.ready), READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            await self.pump.call(lambda api: self._release(api, series))
+            raise asyncio.TimeoutError(f"K线数据等待超时: {key}")
+
+        self._entries[key] = series
+        while len(self._entries) > self.budget:
+            _, evicted = self._entries.popitem(last=False)
+            self.evictions += 1
+            try:
+                await self.pump.call(lambda api, series=evicted: self._release(api, series))
+            except Exception as e:
+                logger.warning(f"[K线缓存] 释放序列失败 {evicted.key}: {e}")
+        return series
+
+    # ---------- 行情线程 ----------
+
+    def _subscribe(self, api: Any, key: SeriesKey, ready: asyncio.Future) -> KlineSeries:
+        """
+        登记订阅,不等待数据
+
+        get_kline_serial在TqApi事件循环之外调用时会在内部wait_update直到数据就绪,
+        这里放到TqApi的task中执行(下一次wait_update时运行,立即返回未就绪的序列),
+        行情线程不被阻塞;数据到齐后由_on_update生成首个快照
+        """
+        series = self._live.get(key)
+        if series is not None:
+            return series
+
+        symbol, duration, bucket = key
+        series = KlineSeries(key, ready)
+        self._live[key] = series
+
+        async def register():
+            try:
+                series.df = api.get_kline_serial(symbol, duration, bucket)
+            except Exception as e:
+                self._release(api, series)
+                series.settle(e)
+                return
+            if self._live.get(key) is not series:
+                # 登记前已被释放(如等待超时)
+                self._release(api, series)
+
+        api.create_task(register())
+        logger.info(f"[K线缓存] 订阅K线 {symbol} {duration}秒 {bucket}根")
+        return series
+
+    def _release(self, api: Any, series: KlineSeries):
+        """
+        取消订阅
+
+        TqApi没有取消K线订阅的公开接口,这里移除其内部登记的序列
+        (不再随行情更新),并发送空ins_list的set_chart释放服务端图表。
+        依赖的内部结构按requirements.txt锁定的tqsdk版本实现,结构不符时只停止跟踪,
+        天勤侧保持订阅
+        """
+        if self._live.get(series.key) is series:
+            del self._live[series.key]
+        if series.df is None:
+            # 尚未登记,登记后会再次释放
+            return
+
+        serials = getattr(api, "_serials", None)
+        requests = getattr(api, "_requests", None)
+        requests = requests.get("klines") if isinstance(requests, dict) else None
+        send_pack = getattr(api, "_send_pack", None)
+        serial = serials.get(id(series.df)) if isinstance(serials, dict) else None
+        chart = serial.get("chart") if isinstance(serial, dict) else None
+        if not isinstance(requests, dict) or not callable(send_pack) or not isinstance(chart, dict) \
+                or not all(field in chart for field in ("chart_id", "duration", "view_width")):
+            if not self._release_unsupported:
+                self._release_unsupported = True
+                logger.warning("[K线缓存] 当前tqsdk版本不支持释放K线,淘汰的序列将保持订阅")
+            return
+
+        del serials[id(series.df)]
+        for request in [request for request, value in requests.items() if value is serial]:
+            del requests[request]
+        send_pack({
+            "aid": "set_chart",
+            "chart_id": chart["chart_id"],
+            "ins_list": "",
+            "duration": chart["duration"],
+            "view_width": chart["view_width"],
+        })
+        logger.info(f"[K线缓存] 释放K线 {series.key}")
+
+    def _on_update(self, api: Any):
+        for series in self._live.values():
+            if series.df is None:
+                continue
+            if series.version == 0:
+                # 新订阅的序列: 数据到达后生成首个快照
+                if not series.loaded:
+                    continue
+                series.refresh()
+                series.settle()
+            elif api.is_changing(series.df):
+                series.refresh()
+            else:
+                continue
+            self.refreshes += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "budget": self.budget,
+            "subscribed": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,141 @@
+"""
+K线本地重采样
+
+由1分钟K线向量化合成更大周期的K线(开=首根开, 高=最高, 低=最低, 收=末根收, 量=求和):
+- 日内周期(整分钟且能整除一天): 按北京时间对齐到周期整数倍,与天勤的K线起始时间一致
+- 日线: 按交易日分组,起始时间为交易日0点(北京时间)
+  有夜盘的交易所(上期所/能源中心/大商所/郑商所)夜盘属于下一个交易日,
+  周五夜盘(含凌晨部分)属于下周一;节假日前交易所不开夜盘,无需交易日历
+
+重采样结果按(合约, 周期, 长度)缓存,数据版本不变时直接返回
+"""
+from typing import Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from utils.trading_calendar import NIGHT_SESSION_START
+
+# 重采样的基础周期(秒)
+BASE_DURATION = 60
+DAY = 86400
+
+NS = 1_000_000_000
+# 北京时间相对UTC的偏移(纳秒)
+TZ_OFFSET = 8 * 3600 * NS
+
+# 有夜盘的交易所
+NIGHT_SESSION_EXCHANGES = {"SHFE", "INE", "DCE", "CZCE"}
+# 北京时间NIGHT_SESSION_START点之后为夜盘(属于下一交易日),凌晨此时刻之前为夜盘后半段
+NIGHT_END_HOUR = 6
+
+
+def can_resample(duration: int) -> bool:
+    """周期能否由1分钟K线合成"""
+    duration = int(duration)
+    if duration == DAY:
+        return True
+    return duration > BASE_DURATION and duration % BASE_DURATION == 0 and DAY % duration == 0
+
+
+def exchange_of(symbol: str) -> str:
+    """天勤合约代码 → 交易所代码(主连"KQ.m@SHFE.rb"取@之后)"""
+    return symbol.rsplit("@", 1)[-1].split(".", 1)[0]
+
+
+def trading_days(times: np.ndarray, exchange: str) -> np.ndarray:
+    """
+    K线时间 → 所属交易日0点(北京时间,纳秒)
+
+    Args:
+        times: K线起始时间(纳秒)
+        exchange: 交易所代码
+    """
+    local = times.astype(np.int64) + TZ_OFFSET
+    days = local // (DAY * NS)
+    if exchange in NIGHT_SESSION_EXCHANGES:
+        hours = (local % (DAY * NS)) // (3600 * NS)
+        # 夜盘开始的自然日: 凌晨部分属于前一天开始的夜盘
+        session_day = np.where(hours < NIGHT_END_HOUR, days - 1, days)
+        night = (hours >= NIGHT_SESSION_START) | (hours < NIGHT_END_HOUR)
+        # 夜盘开始日的下一个工作日(1970-01-01为周四,(days + 3) % 7: 周一=0 ... 周日=6)
+        weekday = (session_day + 3) % 7
+        next_workday = session_day + np.where(weekday == 4, 3, np.where(weekday == 5, 2, 1))
+        days = np.where(night, next_workday, days)
+    return days * (DAY * NS) - TZ_OFFSET
+
+
+def bar_starts(times: np.ndarray, duration: int, exchange: str) -> np.ndarray:
+    """1分钟K线时间 → 所属目标周期K线的起始时间(纳秒)"""
+    if int(duration) == DAY:
+        return trading_days(times, exchange)
+    step = int(duration) * NS
+    local = times.astype(np.int64) + TZ_OFFSET
+    return local // step * step - TZ_OFFSET
+
+
+def resample(klines: Dict[str, np.ndarray], duration: int, exchange: str) -> Dict[str, np.ndarray]:
+    """
+    1分钟K线 → 目标周期K线
+
+    Args:
+        klines: {字段: numpy数组},按时间升序,只含有效K线
+        duration: 目标周期(秒)
+        exchange: 交易所代码
+
+    Returns:
+        {字段: numpy数组}
+    """
+    times = np.asarray(klines["datetime"])
+    if not len(times):
+        return {column: np.asarray(values)[:0] for column, values in klines.items()}
+
+    starts_of = bar_starts(times, duration, exchange)
+    first = np.concatenate([[0], np.flatnonzero(np.diff(starts_of)) + 1])
+    last = np.concatenate([first[1:], [len(times)]]) - 1
+    return {
+        "datetime": starts_of[first],
+        "open": np.asarray(klines["open"])[first],
+        "high": np.maximum.reduceat(np.asarray(klines["high"]), first),
+        "low": np.minimum.reduceat(np.asarray(klines["low"]), first),
+        "close": np.asarray(klines["close"])[last],
+        "volume": np.add.reduceat(np.asarray(klines["volume"]), first),
+    }
+
+
+class ResampleCache:
+    """重采样结果缓存(版本不变时复用)"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: Dict[Tuple, Tuple[Hashable, Dict[str, np.ndarray]]] = {}
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple, version: Hashable) -> Optional[Dict[str, np.ndarray]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, key: Tuple, version: Hashable, klines: Dict[str, np.ndarray]):
+        if key not in self._entries and len(self._entries) >= self.max_entries:
+            # 淘汰最早加入的
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (version, klines)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# 全局实例
+resample_cache = ResampleCache()
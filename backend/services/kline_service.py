@@ -1,116 +1,410 @@
 """
 K线数据服务
 使用TqSDK获取历史K线数据
+
+已完成的K线保存在本地K线存储(services/kline_store.py),
+请求优先从本地读取,只向天勤获取本地最后一根之后的K线
+
+5分钟/15分钟/1小时/日线等周期由1分钟K线本地重采样(services/kline_resampler.py),
+每个合约只订阅一个1分钟序列
 """
-from typing import List, Dict, Any, Optional
+import logging
+import time
+import warnings
+from typing import List, Dict, Any, Optional, Union
 from datetime import datetime
 
+import numpy as np
+from dateutil.parser import isoparse
+
 from utils.logger import get_logger
-from utils.db import get_supabase_client
+from utils.db import async_db, get_supabase_client
+from utils.trade_reader import iter_trades
 from services.tqsdk_manager import tqsdk_manager
+from services.kline_store import kline_store, valid_bars
+from services.market_event_pump import EXCHANGE_TZ
+from services.kline_resampler import (
+    BASE_DURATION, DAY, NS, TZ_OFFSET, can_resample, exchange_of, resample,
+    resample_cache, trading_days
+)
+from config import settings
+from services.contract_registry import contract_registry
 
 logger = get_logger(__name__)
 
+# K线输出字段
+KLINE_FIELDS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+
+def kline_columns(klines: Optional[Dict[str, np.ndarray]]) -> Dict[str, List]:
+    """
+    K线快照 → 列式数据(整列运算)
+
+    跳过成交量为0的无效K线,纳秒时间戳转为秒
+
+    Args:
+        klines: {字段: numpy数组},None时返回空列
+    """
+    if klines is None:
+        return {field: [] for field in KLINE_FIELDS}
+
+    valid = klines['volume'] != 0
+    return {
+        'time': (klines['datetime'][valid] / 1e9).astype(np.int64).tolist(),
+        'open': klines['open'][valid].astype(np.float64).tolist(),
+        'high': klines['high'][valid].astype(np.float64).tolist(),
+        'low': klines['low'][valid].astype(np.float64).tolist(),
+        'close': klines['close'][valid].astype(np.float64).tolist(),
+        'volume': klines['volume'][valid].astype(np.int64).tolist(),
+    }
+
+
+def kline_rows(columns: Dict[str, List]) -> List[Dict[str, Any]]:
+    """列式数据 → 逐条K线字典"""
+    return [
+        dict(zip(KLINE_FIELDS, values))
+        for values in zip(*(columns[field] for field in KLINE_FIELDS))
+    ]
+
+
+# 成交标记样式: 方向 → (位置, 颜色, 形状)
+MARKER_STYLES = {
+    'buy': ('aboveBar', '#26a69a', 'arrowUp'),
+    'sell': ('belowBar', '#ef5350', 'arrowDown'),
+    # 同一根K线内买卖相抵
+    'flat': ('inBar', '#9e9e9e', 'circle'),
+}
+
+
+def exchange_datetime(seconds: int) -> datetime:
+    """epoch秒 → 交易所本地时间(北京时间,不带时区,与trades.timestamp一致)"""
+    return datetime.fromtimestamp(seconds, EXCHANGE_TZ).replace(tzinfo=None)
+
+
+def trade_times(values: List[str]) -> np.ndarray:
+    """成交时间(交易所本地时间ISO字符串) → epoch纳秒"""
+    try:
+        with warnings.catch_warnings():
+            # 带时区偏移的字符串numpy只告警并按UTC解析,改为逐条解析
+            warnings.simplefilter("error")
+            local = np.array(values, dtype="datetime64[ns]").astype(np.int64)
+    except (ValueError, UserWarning):
+        local = np.array([
+            np.datetime64(_local_time(value), "ns").astype(np.int64) for value in values
+        ], dtype=np.int64)
+    return local - TZ_OFFSET
+
+
+def _local_time(value: str) -> datetime:
+    ts = isoparse(value)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(EXCHANGE_TZ).replace(tzinfo=None)
+    return ts
+
+
+def trade_markers(
+    times: List[int],
+    trades: List[Dict[str, Any]],
+    duration: int,
+    exchange: str
+) -> List[Dict[str, Any]]:
+    """
+    成交 → K线标记
+
+    每笔成交按二分查找吸附到所属K线的起始时间(日线按交易日),
+    同一根K线内的成交合并为一个标记: 净手数(买为正)和成交均价(VWAP)
+
+    Args:
+        times: K线起始时间(epoch秒,升序)
+        trades: 成交记录(timestamp, direction, volume, price)
+        duration: K线周期(秒)
+        exchange: 交易所代码
+
+    Returns:
+        按时间升序的标记
+    """
+    if not times or not trades:
+        return []
+
+    bar_times = np.asarray(times, dtype=np.int64) * NS
+    at = trade_times([trade['timestamp'] for trade in trades])
+    if int(duration) == DAY:
+        days = trading_days(at, exchange)
+        bars = np.searchsorted(bar_times, days, side='left')
+        valid = bars < len(bar_times)
+        valid[valid] = bar_times[bars[valid]] == days[valid]
+    else:
+        bars = np.searchsorted(bar_times, at, side='right') - 1
+        valid = (bars >= 0) & (at < bar_times[-1] + int(duration) * NS)
+    if not valid.any():
+        return []
+
+    volume = np.array([trade['volume'] for trade in trades], dtype=np.float64)[valid]
+    price = np.array([trade['price'] for trade in trades], dtype=np.float64)[valid]
+    buy = np.array([trade['direction'] == 'buy' for trade in trades], dtype=bool)[valid]
+
+    index, group = np.unique(bars[valid], return_inverse=True)
+    bought = np.bincount(group, weights=np.where(buy, volume, 0))
+    sold = np.bincount(group, weights=np.where(buy, 0, volume))
+    notional = np.bincount(group, weights=volume * price)
+    fills = np.bincount(group)
+
+    markers = []
+    for i, bar in enumerate(index.tolist()):
+        buy_volume, sell_volume = int(bought[i]), int(sold[i])
+        net = buy_volume - sell_volume
+        total = buy_volume + sell_volume
+        vwap = round(float(notional[i] / total), 4) if total else 0.0
+
+        direction = 'buy' if net > 0 else 'sell' if net < 0 else 'flat'
+        if direction == 'flat':
+            text = f"buy {buy_volume}手 / sell {sell_volume}手 @{vwap}"
+        else:
+            text = f"{direction} {abs(net)}手 @{vwap}"
+        if fills[i] > 1:
+            text += f" ({int(fills[i])}笔)"
+
+        position, color, shape = MARKER_STYLES[direction]
+        markers.append({
+            'time': times[bar],
+            'position': position,
+            'color': color,
+            'shape': shape,
+            'text': text,
+            'size': 1,
+        })
+    return markers
+
 
 class KlineService:
     """K线数据服务"""
 
+    # 持仓标记需要的成交字段
+    MARKER_COLUMNS = "id, timestamp, direction, volume, price"
+
     def __init__(self):
         self.db = get_supabase_client()
 
-    @property
-    def api(self):
-        """获取天勤API实例（单例）"""
-        return tqsdk_manager.get_api()
-
-    def get_klines(
+    async def get_klines(
         self,
         symbol: str,
         duration: int = 60,
-        data_length: int = 500
-    ) -> List[Dict[str, Any]]:
+        data_length: int = 500,
+        columnar: bool = False
+    ) -> Union[List[Dict[str, Any]], Dict[str, List]]:
         """
-        获取K线数据
+        获取K线数据(读取K线缓存,序列由行情线程持续更新)
 
         Args:
             symbol: 合约代码(TqSDK格式,如 CZCE.TA2505)
             duration: K线周期(秒),60=1分钟,300=5分钟,3600=1小时,86400=日线
             data_length: 获取的K线数量
+            columnar: 返回列式数据 {time: [...], open: [...], ...}
 
         Returns:
-            K线数据列表
+            K线数据列表(columnar时为列式数据)
         """
+        columns = await self.get_kline_columns(symbol, duration, data_length)
+        return columns if columnar else kline_rows(columns)
+
+    async def get_kline_columns(
+        self,
+        symbol: str,
+        duration: int = 60,
+        data_length: int = 500
+    ) -> Dict[str, List]:
+        """获取列式K线数据,失败时各列为空"""
         try:
-            if not self.api:
-                logger.error("天勤服务未连接")
-                return []
+            klines = await self._load_klines(symbol, duration, data_length)
+            columns = kline_columns(klines)
 
-            # 获取K线数据（使用单例连接）
-            klines = self.api.get_kline_serial(symbol, duration, data_length)
+            logger.info(f"获取K线成功: {symbol} {duration}秒 {len(columns['time'])}条")
 
-            # 转换为标准格式
-            result = []
-            for i in range(len(klines)):
-                if klines.iloc[i]['volume'] == 0:  # 跳过无效数据
-                    continue
+            # 打印前5条数据用于调试
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, kline in enumerate(kline_rows(columns)[:5], 1):
+                    logger.debug(f"  [{i}] {datetime.fromtimestamp(kline['time']).strftime('%Y-%m-%d %H:%M:%S')} - "
+                                 f"开:{kline['open']:.2f} 高:{kline['high']:.2f} "
+                                 f"低:{kline['low']:.2f} 收:{kline['close']:.2f} 量:{kline['volume']}")
 
-                result.append({
-                    'time': int(klines.iloc[i]['datetime'] / 1e9),  # 转换为秒级时间戳
-                    'open': float(klines.iloc[i]['open']),
-                    'high': float(klines.iloc[i]['high']),
-                    'low': float(klines.iloc[i]['low']),
-                    'close': float(klines.iloc[i]['close']),
-                    'volume': int(klines.iloc[i]['volume']),
-                })
+            return columns
 
-            logger.info(f"获取K线成功: {symbol} {duration}秒 {len(result)}条")
+        except Exception as e:
+            logger.error(f"获取K线失败: {e}")
+            return kline_columns(None)
 
-            # 打印前5条数据用于调试
-            if result:
-                logger.info(f"前5条K线数据:")
-                for i, kline in enumerate(result[:5], 1):
-                    logger.info(f"  [{i}] {datetime.fromtimestamp(kline['time']).strftime('%Y-%m-%d %H:%M:%S')} - "
-                              f"开:{kline['open']:.2f} 高:{kline['high']:.2f} "
-                              f"低:{kline['low']:.2f} 收:{kline['close']:.2f} 量:{kline['volume']}")
+    async def _load_klines(
+        self,
+        symbol: str,
+        duration: int,
+        data_length: int
+    ) -> Optional[Dict[str, np.ndarray]]:
+        """
+        读取K线: 本地存储 + 天勤补齐最新部分(可重采样的周期由1分钟K线合成)
+
+        1. 从本地存储读取最近data_length根
+        2. 本地足够时按最后一根的时间估算缺少的根数,只向天勤获取这部分;
+           本地不足时向天勤获取全部data_length根
+        3. 天勤序列中已完成的K线(最后一根仍在变化)保存到本地存储
+        4. 天勤不可用时只返回本地数据
+
+        Returns:
+            {字段: numpy数组},没有任何数据时返回None
+        """
+        duration = int(duration)
+        if settings.kline_resample_enabled and can_resample(duration):
+            return await self._load_resampled(symbol, duration, data_length)
+
+        stored = kline_store.tail(symbol, duration, data_length) if kline_store else None
+        last = int(stored['datetime'][-1]) if stored is not None and len(stored['datetime']) else None
+
+        if not tqsdk_manager.is_connected():
+            if last is not None:
+                return stored
+            logger.error("天勤服务未连接")
+            return None
 
-            return result
+        missing = data_length
+        if last is not None and len(stored['datetime']) >= data_length:
+            elapsed = time.time_ns() - last
+            missing = min(data_length, max(2, elapsed // (int(duration) * 1_000_000_000) + 1))
 
+        fetch = missing
+        if duration == BASE_DURATION and settings.kline_resample_enabled:
+            # 1分钟序列固定长度订阅,各周期、各长度的请求共用(更早的部分来自本地存储)
+            fetch = settings.kline_base_length
+
+        try:
+            live = await tqsdk_manager.klines.get(symbol, duration, fetch)
         except Exception as e:
-            logger.error(f"获取K线失败: {e}")
-            return []
+            if last is not None:
+                logger.warning(f"天勤K线获取失败,使用本地K线: {symbol} {duration}秒: {e}")
+                return stored
+            raise
+
+        valid = valid_bars(live)
+        live = {column: values[valid] for column, values in live.items()}
+        if kline_store:
+            # 最后一根K线尚未完成,不保存
+            kline_store.save(symbol, duration, {column: values[:-1] for column, values in live.items()})
+
+        if last is None or not len(live['datetime']):
+            return {column: values[-data_length:] for column, values in live.items()} \
+                if last is None else stored
+
+        # 本地早于天勤序列的部分 + 天勤序列
+        older = stored['datetime'] < live['datetime'][0]
+        return {
+            column: np.concatenate([stored[column][older], live[column]])[-data_length:]
+            for column in stored
+        }
+
+    async def _load_resampled(
+        self,
+        symbol: str,
+        duration: int,
+        data_length: int
+    ) -> Optional[Dict[str, np.ndarray]]:
+        """
+        由1分钟K线重采样
+
+        1. 本地存储有足够的该周期K线时,只重采样本地最后一根之后的1分钟K线
+        2. 本地不足时重采样全部可用的1分钟K线
+        3. 1分钟K线覆盖不了请求的长度时,直接向天勤获取一次该周期K线保存到本地,
+           随后取消该序列的订阅,之后的请求由本地存储 + 重采样提供
+        4. 重采样出的已完成K线保存到本地存储
+        """
+        exchange = exchange_of(symbol)
+        cache_key = (symbol, duration, data_length)
+        base_version = tqsdk_manager.klines.version(symbol, BASE_DURATION, settings.kline_base_length)
+        if base_version is not None:
+            version = (base_version, kline_store.version(symbol, duration) if kline_store else None)
+            cached = resample_cache.get(cache_key, version)
+            if cached is not None:
+                return cached
+
+        empty = {column: np.empty(0) for column in ('datetime', 'open', 'high', 'low', 'close', 'volume')}
+        stored = kline_store.tail(symbol, duration, data_length) if kline_store else empty
+        enough = len(stored['datetime']) >= data_length
+
+        # 需要的1分钟K线根数(按自然时间估算,多于实际交易分钟数)
+        bar_minutes = duration // BASE_DURATION
+        if enough:
+            elapsed = time.time_ns() - int(stored['datetime'][-1])
+            minutes = elapsed // (BASE_DURATION * 1_000_000_000) + bar_minutes
+        else:
+            minutes = data_length * bar_minutes
+        base = await self._load_klines(symbol, BASE_DURATION, max(1, minutes))
+
+        bars = resample(base, duration, exchange) if base is not None else empty
+        if len(bars['datetime']) and int(bars['datetime'][0]) != int(base['datetime'][0]):
+            # 1分钟K线不是从第一根K线的起点开始,第一根不完整
+            bars = {column: values[1:] for column, values in bars.items()}
+
+        if len(bars['datetime']):
+            older = stored['datetime'] < bars['datetime'][0]
+            klines = {
+                column: np.concatenate([stored[column][older], bars[column]])[-data_length:]
+                for column in stored
+            }
+        else:
+            klines = stored
+
+        if not enough and len(klines['datetime']) < data_length and tqsdk_manager.is_connected():
+            logger.info(f"1分钟K线不足以合成 {symbol} {duration}秒 {data_length}根,直接获取")
+            direct = await self._direct_klines(symbol, duration, data_length)
+            if direct is not None:
+                return direct
+
+        if kline_store and len(bars['datetime']) > 1:
+            # 最后一根K线尚未完成,不保存
+            kline_store.save(symbol, duration, {column: values[:-1] for column, values in bars.items()})
+
+        base_version = tqsdk_manager.klines.version(symbol, BASE_DURATION, settings.kline_base_length)
+        if base_version is not None:
+            version = (base_version, kline_store.version(symbol, duration) if kline_store else None)
+            resample_cache.put(cache_key, version, klines)
+        return klines if len(klines['datetime']) else None
+
+    async def _direct_klines(
+        self,
+        symbol: str,
+        duration: int,
+        data_length: int
+    ) -> Optional[Dict[str, np.ndarray]]:
+        """直接获取该周期K线(保存到本地存储后取消订阅)"""
+        try:
+            live = await tqsdk_manager.klines.get(symbol, duration, data_length)
+        except Exception as e:
+            logger.warning(f"天勤K线获取失败: {symbol} {duration}秒: {e}")
+            return None
+
+        live = {column: values[valid_bars(live)] for column, values in live.items()}
+        if kline_store:
+            kline_store.save(symbol, duration, {column: values[:-1] for column, values in live.items()})
+            await tqsdk_manager.klines.discard(symbol, duration, data_length)
+        return live
 
-    def get_quote(self, symbol: str) -> Optional[Dict[str, Any]]:
+    async def get_quote(self, symbol: str) -> Optional[Dict[str, Any]]:
         """获取实时行情"""
         try:
-            if not self.api:
+            if not tqsdk_manager.is_connected():
                 logger.error("天勤服务未连接")
                 return None
 
-            quote = self.api.get_quote(symbol)
-
-            return {
-                'symbol': symbol,
-                'last_price': float(quote.last_price),
-                'open': float(quote.open),
-                'high': float(quote.highest),
-                'low': float(quote.lowest),
-                'volume': int(quote.volume),
-                'open_interest': int(quote.open_interest),
-                'bid_price': float(quote.bid_price1),
-                'ask_price': float(quote.ask_price1),
-                'datetime': quote.datetime,
-            }
+            return await tqsdk_manager.get_quote(symbol)
 
         except Exception as e:
             logger.error(f"获取行情失败: {e}")
             return None
 
-    def get_klines_with_positions(
+    async def get_klines_with_positions(
         self,
         symbol: str,
         account_id: str,
         duration: int = 60,
-        data_length: int = 500
+        data_length: int = 500,
+        columnar: bool = False
     ) -> Dict[str, Any]:
         """
         获取K线数据并叠加持仓标记
@@ -120,10 +414,12 @@ class KlineService:
             account_id: 账户ID (UUID格式)
             duration: K线周期
             data_length: K线数量
+            columnar: K线返回列式数据
 
         Returns:
             包含K线和持仓标记的数据
         """
+        empty = kline_columns(None) if columnar else []
         try:
             # 0. 判断symbol格式并转换
             # Polar格式包含 |, TqSDK格式包含 .
@@ -139,12 +435,14 @@ class KlineService:
 
             if not tqsdk_symbol:
                 logger.error(f"无法转换合约代码: {symbol}")
-                return {'klines': [], 'markers': [], 'position': None}
+                return {'klines': empty, 'markers': [], 'position': None}
 
             # 1. 获取K线数据(使用TqSDK格式)
-            klines = self.get_klines(tqsdk_symbol, duration, data_length)
-            if not klines:
-                return {'klines': [], 'markers': [], 'position': None}
+            columns = await self.get_kline_columns(tqsdk_symbol, duration, data_length)
+            times = columns['time']
+            if not times:
+                return {'klines': empty, 'markers': [], 'position': None}
+            klines = columns if columnar else kline_rows(columns)
 
             # 2. 验证 account_id 是否为有效的 UUID 格式
             import uuid
@@ -156,48 +454,32 @@ class KlineService:
 
             # 3. 获取持仓信息(使用Polar格式)
 
-            position_result = (
-                self.db.table("positions")
-                .select("*")
-                .eq("account_id", account_id)
-                .eq("symbol", polar_symbol)
-                .execute()
+            positions = await async_db.select(
+                "positions",
+                filters={"account_id": account_id, "symbol": polar_symbol},
+                limit=1
             )
 
-            # 4. 获取成交记录(用于标记开仓/平仓点)
-            trades_result = (
-                self.db.table("trades")
-                .select("*")
-                .eq("account_id", account_id)
-                .eq("symbol", polar_symbol)
-                .order("timestamp", desc=False)
-                .execute()
-            )
-
-            # 5. 生成持仓标记
-            markers = []
-            if trades_result.data:
-                for trade in trades_result.data:
-                    timestamp = int(datetime.fromisoformat(trade['timestamp']).timestamp())
-
-                    # 确保时间戳在K线范围内
-                    if timestamp < klines[0]['time'] or timestamp > klines[-1]['time']:
-                        continue
-
-                    marker = {
-                        'time': timestamp,
-                        'position': 'aboveBar' if trade['direction'] == 'buy' else 'belowBar',
-                        'color': '#26a69a' if trade['direction'] == 'buy' else '#ef5350',
-                        'shape': 'arrowUp' if trade['direction'] == 'buy' else 'arrowDown',
-                        'text': f"{trade['direction']} {trade['volume']}手 @{trade['price']}",
-                        'size': 1,
-                    }
-                    markers.append(marker)
+            # 4-5. 读取K线时间窗口内的成交,按K线合并为开仓/平仓标记
+            # 日线按交易日归属,窗口向前覆盖首个交易日的夜盘(周一的夜盘在上周五)
+            window_start = times[0] - 3 * DAY if int(duration) == DAY else times[0]
+            window_end = times[-1] + int(duration)
+            trades = [
+                trade async for trade in iter_trades(
+                    account_id,
+                    polar_symbol,
+                    columns=self.MARKER_COLUMNS,
+                    start=exchange_datetime(window_start),
+                    end=exchange_datetime(window_end),
+                    db=self.db
+                )
+            ]
+            markers = trade_markers(times, trades, duration, exchange_of(tqsdk_symbol))
 
             # 6. 当前持仓信息
             current_position = None
-            if position_result.data:
-                pos = position_result.data[0]
+            if positions:
+                pos = positions[0]
                 current_position = {
                     'long_position': pos.get('long_position', 0),
                     'long_avg_price': pos.get('long_avg_price', 0),
@@ -216,41 +498,23 @@ class KlineService:
 
         except Exception as e:
             logger.error(f"获取K线和持仓失败: {e}")
-            return {'klines': [], 'markers': [], 'position': None}
+            return {'klines': empty, 'markers': [], 'position': None}
 
     def _polar_to_tqsdk(self, polar_symbol: str) -> str:
         """Polar格式转TqSDK格式"""
-        # 查询数据库
-        result = (
-            self.db.table("contracts")
-            .select("tqsdk_symbol")
-            .eq("polar_symbol", polar_symbol)
-            .execute()
-        )
-
-        if result.data:
-            logger.info(f"从数据库查询到 tqsdk_symbol: {result.data[0]['tqsdk_symbol']}")
-            return result.data[0]['tqsdk_symbol']
-
-        # 数据库查不到,返回None
-        logger.warning(f"数据库中未找到 polar_symbol: {polar_symbol}")
+        # 查询合约注册表
+        tqsdk_symbol = contract_registry.polar_to_tqsdk(polar_symbol)
+        if tqsdk_symbol:
+            return tqsdk_symbol
+
+        # 注册表查不到,返回None
+        logger.warning(f"合约注册表中未找到 polar_symbol: {polar_symbol}")
         return None
 
     def _tqsdk_to_polar(self, tqsdk_symbol: str) -> str:
         """TqSDK格式转Polar格式"""
-        # 查询数据库
-        result = (
-            self.db.table("contracts")
-            .select("polar_symbol")
-            .eq("tqsdk_symbol", tqsdk_symbol)
-            .execute()
-        )
-
-        if result.data:
-            return result.data[0]['polar_symbol']
-
-        # 简单转换(如果数据库查不到)
-        return tqsdk_symbol
+        # 查询合约注册表,查不到时原样返回
+        return contract_registry.tqsdk_to_polar(tqsdk_symbol) or tqsdk_symbol
 
     def close(self):
         """关闭连接（已弃用，使用单例模式）"""
@@ -260,13 +524,19 @@ class KlineService:
 
 # 测试运行
 if __name__ == "__main__":
-    service = KlineService()
+    import asyncio
+
+    async def main():
+        tqsdk_manager.start()
+        service = KlineService()
+
+        # 测试获取K线
+        klines = await service.get_klines("CZCE.TA2505", duration=300, data_length=100)
+        print(f"获取到 {len(klines)} 条K线数据")
 
-    # 测试获取K线
-    klines = service.get_klines("CZCE.TA2505", duration=300, data_length=100)
-    print(f"获取到 {len(klines)} 条K线数据")
+        if klines:
+            print(f"最新K线: {klines[-1]}")
 
-    if klines:
-        print(f"最新K线: {klines[-1]}")
+        await tqsdk_manager.close()
 
-    service.close()
+    asyncio.run(main())
@@ -0,0 +1,266 @@
+"""
+本地K线存储
+
+按(合约, 周期)持久化已完成的K线,历史数据和非交易时段的请求不再依赖天勤:
+- 每个序列一个目录,每个字段一个只追加的二进制列文件({字段}.bin)
+- 读取时内存映射各列,时间列严格递增,区间查询用二分查找定位
+- 比已存最后一根更新的K线直接追加;比第一根更早或落在已存K线空缺处的K线
+  按时间合并后写入新目录再整体替换,已映射旧文件的读取方不受影响;
+  已存时间的K线不覆盖
+- 天勤K线与由行情tick合成的K线(services/bar_aggregator.py)分开存放(source="tick"),
+  合成K线是近似值,不会占据或遮挡天勤K线的位置
+- 写入在文件锁内进行,多个进程可同时写入
+
+进程异常退出可能导致各列长度不一致,以最短的列为准,下次写入前截齐
+"""
+import os
+import re
+import shutil
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import numpy as np
+
+from config import settings
+from utils.logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # 非Unix平台不加文件锁,只允许单进程写入
+    fcntl = None
+
+logger = get_logger(__name__)
+
+# 列文件字段与类型(datetime为K线起始时间,纳秒)
+COLUMN_DTYPES = {
+    "datetime": np.dtype("<i8"),
+    "open": np.dtype("<f8"),
+    "high": np.dtype("<f8"),
+    "low": np.dtype("<f8"),
+    "close": np.dtype("<f8"),
+    "volume": np.dtype("<i8"),
+}
+
+_SYMBOL = re.compile(r"^[A-Za-z0-9_.@-]+$")
+_SOURCE = re.compile(r"^[a-z]+$")
+
+
+def _empty() -> Dict[str, np.ndarray]:
+    return {column: np.empty(0, dtype=dtype) for column, dtype in COLUMN_DTYPES.items()}
+
+
+def valid_bars(klines: Dict[str, np.ndarray]) -> np.ndarray:
+    """有效K线掩码(天勤序列中尚无数据的K线datetime为NaN,成交量为0的K线不保存)"""
+    datetime = np.asarray(klines["datetime"], dtype=np.float64)
+    volume = np.asarray(klines["volume"], dtype=np.float64)
+    return np.isfinite(datetime) & np.isfinite(volume) & (volume != 0)
+
+
+class KlineFile:
+    """一个(合约, 周期)序列的列文件"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._length = -1
+        self._maps: Dict[str, np.ndarray] = {}
+
+    def _path(self, column: str) -> str:
+        return os.path.join(self.directory, f"{column}.bin")
+
+    def __len__(self) -> int:
+        lengths = []
+        for column, dtype in COLUMN_DTYPES.items():
+            try:
+                lengths.append(os.path.getsize(self._path(column)) // dtype.itemsize)
+            except OSError:
+                return 0
+        return min(lengths)
+
+    def _columns(self) -> Dict[str, np.ndarray]:
+        """内存映射各列(长度变化时重新映射)"""
+        length = len(self)
+        if length != self._length:
+            self._maps = _empty() if length == 0 else {
+                column: np.memmap(self._path(column), dtype=dtype, mode="r", shape=(length,))
+                for column, dtype in COLUMN_DTYPES.items()
+            }
+            self._length = length
+        return self._maps
+
+    def last_time(self) -> Optional[int]:
+        """最后一根K线的时间(纳秒),没有数据时返回None"""
+        times = self._columns()["datetime"]
+        return int(times[-1]) if len(times) else None
+
+    def range(
+        self,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        按时间区间读取
+
+        Args:
+            start: 起始时间(纳秒,含)
+            end: 结束时间(纳秒,含)
+            limit: 最多返回区间内最近的limit根
+
+        Returns:
+            {字段: numpy数组}(复制,不引用映射)
+        """
+        columns = self._columns()
+        times = columns["datetime"]
+        i = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        j = len(times) if end is None else int(np.searchsorted(times, end, side="right"))
+        if limit is not None:
+            i = max(i, j - limit)
+        return {column: np.array(values[i:j]) for column, values in columns.items()}
+
+    def save(self, klines: Dict[str, np.ndarray]) -> int:
+        """
+        保存已完成的K线(与已存K线时间相同的忽略,空缺处的补入)
+
+        Args:
+            klines: {字段: numpy数组},按时间升序
+
+        Returns:
+            新保存的K线数
+        """
+        valid = valid_bars(klines)
+        if not valid.any():
+            return 0
+        bars = {
+            column: np.asarray(klines[column])[valid].astype(dtype)
+            for column, dtype in COLUMN_DTYPES.items()
+        }
+
+        with self._locked():
+            self._truncate()
+            times = self._columns()["datetime"]
+            if not len(times):
+                return self._append(bars)
+
+            newer = bars["datetime"] > times[-1]
+            # 早于最后一根且尚未保存的K线(更早的历史或中间的空缺)
+            missing = ~newer & ~np.isin(bars["datetime"], times)
+            if not missing.any():
+                return self._append({column: values[newer] for column, values in bars.items()})
+            stored = self.range()
+            merged = {
+                column: np.concatenate([stored[column], bars[column][missing], bars[column][newer]])
+                for column in COLUMN_DTYPES
+            }
+            order = np.argsort(merged["datetime"], kind="stable")
+            return self._rewrite({column: values[order] for column, values in merged.items()})
+
+    @contextmanager
+    def _locked(self):
+        """跨进程写锁(锁文件在序列目录之外,目录整体替换时仍然有效)"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f"{self.directory}.lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _append(self, bars: Dict[str, np.ndarray]) -> int:
+        count = len(bars["datetime"])
+        if count:
+            for column in COLUMN_DTYPES:
+                with open(self._path(column), "ab") as f:
+                    f.write(bars[column].tobytes())
+        return count
+
+    def _rewrite(self, bars: Dict[str, np.ndarray]) -> int:
+        """写入新目录后替换原目录,返回新增的K线数"""
+        added = len(bars["datetime"]) - len(self)
+        tmp_dir = f"{self.directory}.tmp"
+        old_dir = f"{self.directory}.old"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for column in COLUMN_DTYPES:
+            with open(os.path.join(tmp_dir, f"{column}.bin"), "wb") as f:
+                f.write(bars[column].tobytes())
+
+        # 两次改名之间读取方看到空序列(回退天勤),不会读到错位的列
+        os.rename(self.directory, old_dir)
+        os.rename(tmp_dir, self.directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return added
+
+    def _truncate(self) -> int:
+        """把各列截到最短列的长度(写入中断后修复),返回长度"""
+        length = len(self)
+        for column, dtype in COLUMN_DTYPES.items():
+            path = self._path(column)
+            if os.path.exists(path) and os.path.getsize(path) != length * dtype.itemsize:
+                logger.warning(f"[K线存储] 列长度不一致,截断 {path} → {length}")
+                with open(path, "r+b") as f:
+                    f.truncate(length * dtype.itemsize)
+        return length
+
+
+class KlineStore:
+    """本地K线存储"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._files: Dict[tuple, KlineFile] = {}
+
+        # 统计
+        self.reads = 0
+        self.saved = 0
+
+    def file(self, symbol: str, duration: int, source: str = "") -> KlineFile:
+        """
+        获取序列的列文件
+
+        Args:
+            source: 数据来源,空为天勤K线;其他来源(如"tick")存放在独立的序列中
+        """
+        key = (symbol, int(duration), source)
+        kline_file = self._files.get(key)
+        if kline_file is None:
+            if not _SYMBOL.match(symbol) or not symbol.strip("."):
+                raise ValueError(f"非法合约代码: {symbol}")
+            if source and not _SOURCE.match(source):
+                raise ValueError(f"非法数据来源: {source}")
+            name = f"{int(duration)}.{source}" if source else str(int(duration))
+            kline_file = KlineFile(os.path.join(self.root, symbol, name))
+            self._files[key] = kline_file
+        return kline_file
+
+    def version(self, symbol: str, duration: int, source: str = "") -> tuple:
+        """序列版本(K线数, 最后一根时间),内容变化时改变"""
+        kline_file = self.file(symbol, duration, source)
+        return len(kline_file), kline_file.last_time()
+
+    def tail(self, symbol: str, duration: int, length: int, source: str = "") -> Dict[str, np.ndarray]:
+        """读取最近length根K线"""
+        self.reads += 1
+        return self.file(symbol, duration, source).range(limit=length)
+
+    def save(
+        self,
+        symbol: str,
+        duration: int,
+        klines: Dict[str, np.ndarray],
+        source: str = ""
+    ) -> int:
+        """保存已完成的K线,返回新保存的K线数"""
+        count = self.file(symbol, duration, source).save(klines)
+        self.saved += count
+        return count
+
+    def stats(self) -> Dict:
+        return {
+            "root": self.root,
+            "series": len(self._files),
+            "reads": self.reads,
+            "saved": self.saved
+        }
+
+
+# 全局实例(未启用时为None)
+kline_store = KlineStore(settings.kline_store_dir) if settings.kline_store_enabled else None
@@ -8,7 +8,7 @@ from typing import Dict, Any
 import uuid
 
 from supabase import Client
-from utils.db import get_supabase_client
+from utils.db import async_db, get_supabase_client
 from utils.logger import get_logger
 from engines.lock_engine import LockEngine
 from utils.notification import send_notification
@@ -47,13 +47,7 @@ class LockTriggerService:
         """检查所有活跃的锁仓配置"""
         try:
             # 获取所有活跃配置(通过视图)
-            result = (
-                self.db.table("v_active_lock_configs")
-                .select("*")
-                .execute()
-            )
-
-            configs = result.data
+            configs = await async_db.select("v_active_lock_configs")
             if not configs:
                 return
 
@@ -0,0 +1,213 @@
+"""
+行情快照记录
+
+消费行情事件,把各合约的行情状态批量写入market_data表(换月监控等按合约读取最新一条):
+- 降采样: 每个合约每个采样间隔最多记录一条,取记录时刻的最新状态;
+  间隔内有变化但未记录的合约,由后台任务在间隔到期时补记,最后的状态不会丢失
+- 批量写入: 缓冲行数达到batch_size立即写,否则每flush_interval秒写一次
+- 写入失败时保留缓冲(超过上限丢弃最早的行),逐次翻倍等待后重试
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, Optional
+
+from utils.db import AsyncDatabase, async_db
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# market_data列 ← 行情字段
+COLUMN_FIELDS = {
+    "last_price": "last_price",
+    "bid_price": "bid_price1",
+    "ask_price": "ask_price1",
+    "volume": "volume",
+    "open_interest": "open_interest",
+    "high_price": "highest",
+    "low_price": "lowest",
+    "open_price": "open",
+    "pre_settle": "pre_settlement",
+}
+
+
+def _value(value: Any) -> Any:
+    """NaN(天勤无数据) → None"""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class MarketDataRecorder:
+    """行情快照记录(降采样 + 批量写入)"""
+
+    # 写入失败后的重试等待(秒),逐次翻倍
+    RETRY_MIN = 1.0
+    RETRY_MAX = 30.0
+
+    def __init__(
+        self,
+        quotes: Dict[str, Dict[str, Any]],
+        db: AsyncDatabase = async_db,
+        sample_interval: float = 60,
+        batch_size: int = 500,
+        flush_interval: float = 5,
+        max_buffer: int = 50000
+    ):
+        """
+        Args:
+            quotes: {天勤合约代码: 最新行情字段}(行情事件泵的快照)
+            db: 数据访问层
+            sample_interval: 同一合约两条记录的最小间隔(秒)
+            batch_size: 单次写入的最大行数
+            flush_interval: 定时写入间隔(秒)
+            max_buffer: 缓冲上限(行),写入持续失败时丢弃最早的行
+        """
+        self.quotes = quotes
+        self.db = db
+        self.sample_interval = sample_interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._buffer: Deque[Dict] = deque(maxlen=max_buffer)
+        # {合约: 上次记录时间(monotonic)}
+        self._sampled_at: Dict[str, float] = {}
+        # 有变化但尚未记录的合约
+        self._dirty: set = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._retry_delay = self.RETRY_MIN
+
+        # 统计
+        self.observed = 0
+        self.sampled = 0
+        self.written = 0
+        self.dropped = 0
+        self.flush_batches = 0
+        self.flush_failures = 0
+        self.last_error: Optional[str] = None
+
+    async def start(self):
+        """启动后台写入"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止后台写入,补记未记录的状态并尽量写完缓冲"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        self.sample(force=True)
+        try:
+            while self._buffer:
+                if not await self._flush_once():
+                    break
+        except Exception as e:
+            logger.error(f"关闭时写入行情记录失败,丢弃{len(self._buffer)}行: {e}")
+
+    def observe(self, symbols: Iterable[str]):
+        """
+        行情变化(事件循环中调用)
+
+        Args:
+            symbols: 本次有变化的天勤合约代码
+        """
+        for symbol in symbols:
+            self._dirty.add(symbol)
+            self.observed += 1
+        self.sample()
+
+    def sample(self, force: bool = False):
+        """记录采样间隔已到期的变化合约"""
+        if not self._dirty:
+            return
+        now = time.monotonic()
+        for symbol in list(self._dirty):
+            if not force and now - self._sampled_at.get(symbol, -math.inf) < self.sample_interval:
+                continue
+            self._dirty.discard(symbol)
+            row = self._row(symbol)
+            if row is None:
+                continue
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append(row)
+            self._sampled_at[symbol] = now
+            self.sampled += 1
+
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _row(self, symbol: str) -> Optional[Dict]:
+        quote = self.quotes.get(symbol)
+        if not quote:
+            return None
+        row = {column: _value(quote.get(field)) for column, field in COLUMN_FIELDS.items()}
+        if row["last_price"] is None:
+            return None
+        row["symbol"] = symbol
+        # 交易所行情时间(北京时间),无效时用本地时间
+        row["timestamp"] = quote.get("datetime") or datetime.now().isoformat()
+        return row
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self.sample()
+
+            while self._buffer:
+                try:
+                    flushed = await self._flush_once()
+                except Exception as e:
+                    flushed = False
+                    self.last_error = str(e)
+                    logger.error(f"行情记录写入异常: {e}")
+
+                if not flushed:
+                    self.flush_failures += 1
+                    await asyncio.sleep(self._retry_delay)
+                    self._retry_delay = min(self._retry_delay * 2, self.RETRY_MAX)
+                    break
+
+                self._retry_delay = self.RETRY_MIN
+
+    async def _flush_once(self) -> bool:
+        """写入缓冲最前的一批(失败时保留在缓冲中)"""
+        batch = [self._buffer[i] for i in range(min(self.batch_size, len(self._buffer)))]
+        if not batch:
+            return True
+
+        await self.db.insert("market_data", batch)
+
+        for row in batch:
+            # 写入期间缓冲满时最早的行可能已被丢弃
+            if self._buffer and self._buffer[0] is row:
+                self._buffer.popleft()
+        self.written += len(batch)
+        self.flush_batches += 1
+        self.last_error = None
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "buffered": len(self._buffer),
+            "pending_symbols": len(self._dirty),
+            "observed": self.observed,
+            "sampled": self.sampled,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flush_batches": self.flush_batches,
+            "flush_failures": self.flush_failures,
+            "last_error": self.last_error
+        }
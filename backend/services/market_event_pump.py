@@ -0,0 +1,388 @@
+"""
+天勤行情事件泵
+
+TqApi由独立线程持有(TqApi不能跨线程使用,在哪个线程创建就只能在哪个线程调用):
+1. 线程内循环wait_update,每次更新检查全部已订阅合约
+2. 汇总本次所有变化的合约和字段,生成一个行情变化事件
+3. 通过call_soon_threadsafe投递到事件循环,分发给各订阅队列
+
+订阅队列满时与队尾事件合并(字段取最新值),消费慢不会阻塞行情线程,也不会丢失合约
+
+其他需要使用TqApi的组件(如K线缓存)通过call在行情线程中执行,
+或通过add_update_hook在每次wait_update后检查自己关心的数据
+
+延迟统计:
+- tick: 交易所行情时间 → 消费者取到事件(端到端,含本地与交易所的时钟偏差)
+- pump: wait_update返回 → 消费者取到事件(进程内延迟)
+"""
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.latency import LatencyStats
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 交易所行情时间为北京时间
+EXCHANGE_TZ = timezone(timedelta(hours=8))
+
+
+def exchange_timestamp(value: Any) -> Optional[float]:
+    """行情datetime字段("2024-01-02 09:00:00.500000") → epoch秒,无效时返回None"""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value).replace(tzinfo=EXCHANGE_TZ).timestamp()
+    except ValueError:
+        return None
+
+
+class MarketEvent:
+    """一次wait_update中的全部行情变化"""
+
+    def __init__(
+        self,
+        seq: int,
+        changes: Dict[str, Dict[str, Any]],
+        received_at: float,
+        tick_times: Dict[str, float]
+    ):
+        self.seq = seq
+        # {天勤合约代码: {变化字段: 最新值}}
+        self.changes = changes
+        # wait_update返回时刻(perf_counter)
+        self.received_at = received_at
+        # {天勤合约代码: 交易所行情时间(epoch秒)}
+        self.tick_times = tick_times
+
+    def symbols_changed(self, field: str) -> List[str]:
+        """指定字段发生变化的合约"""
+        return [symbol for symbol, fields in self.changes.items() if field in fields]
+
+    def merge(self, newer: 'MarketEvent') -> 'MarketEvent':
+        """与更新的事件合并(字段取新值,延迟从较早的事件算起)"""
+        changes = {symbol: dict(fields) for symbol, fields in self.changes.items()}
+        for symbol, fields in newer.changes.items():
+            changes.setdefault(symbol, {}).update(fields)
+        tick_times = dict(self.tick_times)
+        tick_times.update(newer.tick_times)
+        return MarketEvent(newer.seq, changes, self.received_at, tick_times)
+
+
+class EventQueue:
+    """有界事件队列,满时新事件与队尾事件合并"""
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self._events: "deque[MarketEvent]" = deque()
+        self._available = asyncio.Event()
+        self.conflated = 0
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def put(self, event: MarketEvent):
+        if len(self._events) >= self.max_size:
+            self._events.append(self._events.pop().merge(event))
+            self.conflated += 1
+        else:
+            self._events.append(event)
+        self._available.set()
+
+    async def get(self) -> MarketEvent:
+        while not self._events:
+            self._available.clear()
+            await self._available.wait()
+        return self._events.popleft()
+
+
+class MarketEventPump:
+    """行情事件泵(独立线程持有TqApi)"""
+
+    # 默认关注的行情字段
+    FIELDS = (
+        "last_price", "bid_price1", "ask_price1", "bid_volume1", "ask_volume1",
+        "volume", "open_interest", "highest", "lowest", "open",
+        "pre_settlement", "datetime"
+    )
+
+    def __init__(
+        self,
+        api_factory: Callable[[], Any],
+        fields: Iterable[str] = FIELDS,
+        queue_size: int = 1000,
+        wait_timeout: float = 0.05
+    ):
+        """
+        Args:
+            api_factory: 在行情线程中创建TqApi的函数
+            fields: 关注的行情字段
+            queue_size: 每个订阅队列的最大事件数
+            wait_timeout: wait_update最长等待(秒),决定处理调用/订阅/停止请求的及时性
+                (没有行情时pump.call最多延迟这么久;空闲时每秒约1/wait_timeout次空轮询)
+        """
+        self.api_factory = api_factory
+        self.fields = tuple(fields)
+        self.queue_size = queue_size
+        self.wait_timeout = wait_timeout
+
+        # 各合约最新行情字段(事件循环线程维护)
+        self.snapshots: Dict[str, Dict[str, Any]] = {}
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # 待订阅合约(其他线程 → 行情线程)
+        self._pending: "queue.Queue[str]" = queue.Queue()
+        # 待执行的调用(事件循环 → 行情线程)
+        self._calls: "queue.Queue[Tuple[Callable[[Any], Any], asyncio.Future]]" = queue.Queue()
+        # 每次wait_update后在行情线程中执行的回调
+        self._hooks: List[Callable[[Any], None]] = []
+        self._listeners: List[EventQueue] = []
+        self._seq = 0
+
+        # 统计
+        self.updates = 0      # wait_update返回次数
+        self.published = 0    # 生成的事件数
+        self.errors = 0
+        self.tick_latency = LatencyStats()
+        self.pump_latency = LatencyStats()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, symbols: Iterable[str] = ()):
+        """
+        启动行情线程(需在事件循环中调用)
+
+        Args:
+            symbols: 初始订阅的天勤合约代码
+        """
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._stop.clear()
+        self.subscribe(symbols)
+        self._thread = threading.Thread(target=self._run, name="tqsdk-pump", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """停止行情线程(TqApi在线程内关闭)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def subscribe(self, symbols: Iterable[str]):
+        """订阅合约(线程安全,下一轮wait_update前生效)"""
+        for symbol in symbols:
+            self._pending.put(symbol)
+
+    def call(self, fn: Callable[[Any], Any]) -> Awaitable[Any]:
+        """
+        在行情线程中执行fn(api)(需在事件循环中调用)
+
+        下一轮wait_update前执行,最长等待wait_timeout秒
+
+        Returns:
+            可等待的执行结果(异常同样传回)
+
+        Raises:
+            RuntimeError: 行情线程未运行
+        """
+        if not self.running:
+            raise RuntimeError("行情线程未运行")
+        future = self._loop.create_future()
+        self._calls.put((fn, future))
+        return future
+
+    def add_update_hook(self, hook: Callable[[Any], None]):
+        """注册wait_update后的回调hook(api)(在行情线程中执行,不能阻塞)"""
+        self._hooks.append(hook)
+
+    def listen(self) -> EventQueue:
+        """注册一个事件订阅队列"""
+        listener = EventQueue(self.queue_size)
+        self._listeners.append(listener)
+        return listener
+
+    def unlisten(self, listener: EventQueue):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    async def events(self) -> AsyncIterator[MarketEvent]:
+        """逐个获取行情事件(同时记录延迟)"""
+        listener = self.listen()
+        try:
+            while True:
+                event = await listener.get()
+                self._record_latency(event)
+                yield event
+        finally:
+            self.unlisten(listener)
+
+    def _record_latency(self, event: MarketEvent):
+        self.pump_latency.record(time.perf_counter() - event.received_at)
+        now = time.time()
+        for tick_time in event.tick_times.values():
+            self.tick_latency.record(max(0.0, now - tick_time))
+
+    # ---------- 行情线程 ----------
+
+    def _run(self):
+        try:
+            api = self.api_factory()
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"[行情线程] 创建天勤API失败: {e}")
+            return
+
+        quotes: Dict[str, Any] = {}
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._drain_subscriptions(api, quotes)
+                    if self._drain_calls(api):
+                        # 调用中可能执行了wait_update(如get_quote等待行情),
+                        # 期间的变化已无法通过is_changing判断,全量发布一次
+                        self._collect(api, quotes, full=True)
+                    if not api.wait_update(deadline=time.time() + self.wait_timeout):
+                        continue
+                    self.updates += 1
+                    self._run_hooks(api)
+                    self._collect(api, quotes)
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"[行情线程] 行情循环错误: {e}")
+                    self._stop.wait(5)
+        finally:
+            self._fail_calls(RuntimeError("行情线程已停止"))
+            try:
+                api.close()
+            except Exception as e:
+                logger.warning(f"[行情线程] 关闭天勤API失败: {e}")
+
+    def _drain_subscriptions(self, api: Any, quotes: Dict[str, Any]):
+        while True:
+            try:
+                symbol = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            if symbol not in quotes:
+                try:
+                    quotes[symbol] = api.get_quote(symbol)
+                    logger.info(f"[行情线程] 订阅行情: {symbol}")
+                except Exception as e:
+                    logger.warning(f"[行情线程] 订阅失败 {symbol}: {e}")
+
+    def _drain_calls(self, api: Any) -> bool:
+        """执行待执行的调用,返回是否执行过"""
+        ran = False
+        while True:
+            try:
+                fn, future = self._calls.get_nowait()
+            except queue.Empty:
+                return ran
+            ran = True
+            try:
+                result, error = fn(api), None
+            except Exception as e:
+                result, error = None, e
+            self._resolve(future, result, error)
+
+    def _fail_calls(self, error: Exception):
+        while True:
+            try:
+                _, future = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            self._resolve(future, None, error)
+
+    def _resolve(self, future: asyncio.Future, result: Any, error: Optional[Exception]):
+        def settle():
+            if future.done():  # 调用方已取消
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        try:
+            self._loop.call_soon_threadsafe(settle)
+        except RuntimeError:
+            # 事件循环已关闭
+            self._stop.set()
+
+    def _run_hooks(self, api: Any):
+        for hook in self._hooks:
+            try:
+                hook(api)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"[行情线程] 更新回调错误: {e}")
+
+    def _collect(self, api: Any, quotes: Dict[str, Any], full: bool = False):
+        """
+        检查全部合约,生成本次更新的变化事件
+
+        Args:
+            full: 不判断is_changing,发布全部合约的全部字段
+        """
+        received_at = time.perf_counter()
+        changes: Dict[str, Dict[str, Any]] = {}
+        tick_times: Dict[str, float] = {}
+        for symbol, quote in quotes.items():
+            if not full and not api.is_changing(quote):
+                continue
+            fields = {
+                field: getattr(quote, field) for field in self.fields
+                if full or api.is_changing(quote, field)
+            }
+            if not fields:
+                continue
+            changes[symbol] = fields
+            tick_time = exchange_timestamp(fields.get("datetime"))
+            if tick_time is not None:
+                tick_times[symbol] = tick_time
+
+        if not changes:
+            return
+
+        self._seq += 1
+        event = MarketEvent(self._seq, changes, received_at, tick_times)
+        try:
+            self._loop.call_soon_threadsafe(self._publish, event)
+        except RuntimeError:
+            # 事件循环已关闭
+            self._stop.set()
+
+    # ---------- 事件循环线程 ----------
+
+    def _publish(self, event: MarketEvent):
+        self.published += 1
+        for symbol, fields in event.changes.items():
+            self.snapshots.setdefault(symbol, {}).update(fields)
+
+        for listener in self._listeners:
+            listener.put(event)
+
+    def stats(self) -> Dict:
+        """运行统计与延迟分布"""
+        return {
+            "running": self.running,
+            "symbols": len(self.snapshots),
+            "updates": self.updates,
+            "published": self.published,
+            "conflated": sum(listener.conflated for listener in self._listeners),
+            "errors": self.errors,
+            "listeners": len(self._listeners),
+            "queued": sum(len(listener) for listener in self._listeners),
+            "tick_latency": self.tick_latency.summary(),
+            "pump_latency": self.pump_latency.summary()
+        }
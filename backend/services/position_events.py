@@ -0,0 +1,92 @@
+"""
+持仓变更通知(跨进程)
+
+持仓引擎写库后(成交入库/重建),把变更的持仓通过PostgreSQL NOTIFY发到POSITIONS_CHANNEL;
+独立运行的行情服务(services/tqsdk_service.py)LISTEN该通道,实时同步盯市持仓簿记
+
+- payload为持仓簿记所需字段(PositionBook.COLUMNS)的JSON数组,
+  NOTIFY的payload上限8000字节,变更较多时拆成多条
+- 连接池不可用时无法发送,接收方按间隔从数据库全量重载兜底
+"""
+import asyncio
+import json
+from typing import Dict, List, Set
+
+from engines.position_book import PositionBook
+from utils.db import AsyncDatabase
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+POSITIONS_CHANNEL = "quantfu_positions"
+
+# 单条payload的最大字节数(低于PostgreSQL的8000字节上限)
+MAX_PAYLOAD_BYTES = 7000
+
+FIELDS = tuple(name.strip() for name in PositionBook.COLUMNS.split(","))
+
+
+def encode(positions: List[Dict]) -> List[str]:
+    """持仓记录编码为一条或多条payload"""
+    payloads: List[str] = []
+    items: List[str] = []
+    size = 2
+    for position in positions:
+        item = json.dumps(
+            {field: position.get(field) for field in FIELDS},
+            separators=(",", ":"), default=str
+        )
+        if items and size + len(item) + 1 > MAX_PAYLOAD_BYTES:
+            payloads.append("[" + ",".join(items) + "]")
+            items, size = [], 2
+        items.append(item)
+        size += len(item) + 1
+    if items:
+        payloads.append("[" + ",".join(items) + "]")
+    return payloads
+
+
+def decode(payload: str) -> List[Dict]:
+    """payload解码为持仓记录"""
+    return json.loads(payload)
+
+
+class PositionPublisher:
+    """持仓变更发布者(注册为持仓引擎的变更监听)"""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        # 进行中的发送任务(持有引用,避免被回收)
+        self._tasks: Set[asyncio.Task] = set()
+
+        # 统计
+        self.published = 0
+        self.unsent = 0
+
+    def __call__(self, positions: List[Dict]):
+        """持仓引擎回调(在事件循环中),发送不阻塞回调方"""
+        payloads = encode(positions)
+        if not payloads:
+            return
+        task = asyncio.get_running_loop().create_task(self._send(payloads))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, payloads: List[str]):
+        for payload in payloads:
+            try:
+                sent = await self.db.notify(POSITIONS_CHANNEL, payload)
+            except Exception as e:
+                logger.error(f"[持仓通知] 发送失败: {e}")
+                sent = False
+            if sent:
+                self.published += 1
+            else:
+                self.unsent += 1
+
+    def stats(self) -> Dict:
+        return {
+            "published": self.published,
+            "unsent": self.unsent,
+            "pending": len(self._tasks)
+        }
@@ -0,0 +1,224 @@
+"""
+持仓实时推送
+
+/ws/positions的数据源,按账户把持仓变化推送给订阅的连接:
+- 持仓量、均价等来自持仓引擎的变更回调(成交入库/重建后)
+- 最新价和浮盈由本模块的盯市循环计算: 按间隔从行情共享表一次读取全部持仓合约的最新价,
+  用持仓列式簿记(engines/position_book.py)向量化重算(只推送,不写库)
+- 每个持仓记录已推送的字段值,只推送变化的字段
+- 每个连接的未发送变化按持仓合并(字段取最新值),按最大频率发送(见utils/pubsub.py)
+
+只加载有连接订阅的账户;账户的最后一个连接断开后不再推送该账户,并从盯市簿记中移除。
+账户加载期间收到的持仓变化先缓存,加载完成后重放,快照不会漏掉这段时间的成交
+"""
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from engines.position_book import PositionBook
+from services.contract_registry import contract_registry
+from utils import fixed_point as fp
+from utils.db import AsyncDatabase, async_db
+from utils.logger import get_logger
+from utils.pubsub import ConflatedSubscription, PubSub
+from utils.quote_table import get_quote_table
+from utils.single_flight import single_flight
+
+logger = get_logger(__name__)
+
+# 持仓引擎维护的字段
+POSITION_FIELDS = (
+    "long_position", "long_avg_price", "short_position", "short_avg_price",
+    "trade_count", "last_trade_time"
+)
+# 盯市计算的字段
+MARK_FIELDS = ("last_price", "long_profit", "short_profit")
+# 订阅账户时加载的持仓字段
+LOAD_COLUMNS = PositionBook.COLUMNS + ", trade_count, last_trade_time"
+
+
+class PositionFeed:
+    """持仓变化推送"""
+
+    def __init__(
+        self,
+        db: AsyncDatabase = async_db,
+        max_rate: float = 4,
+        mark_interval: float = 0.5
+    ):
+        """
+        Args:
+            db: 数据访问层
+            max_rate: 每个连接每秒最多推送的消息数
+            mark_interval: 盯市计算间隔(秒)
+        """
+        self.db = db
+        self.min_interval = 1 / max_rate if max_rate > 0 else 0.0
+        self.mark_interval = mark_interval
+        self.hub = PubSub()
+
+        # 盯市簿记(订阅过的账户的持仓)
+        self.book = PositionBook()
+        self.book.load(
+            [],
+            to_tqsdk=contract_registry.to_tqsdk,
+            multiplier_of=contract_registry.get_multiplier,
+            tick_of=lambda symbol: contract_registry.get_price_tick(symbol, fp.DEFAULT_TICK)
+        )
+        # 已推送的持仓状态 {账户: {合约(极星格式): {字段: 值}}},只含有订阅的账户
+        self._accounts: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # 加载中账户收到的持仓变化 {账户: [positions表记录]}
+        self._loading: Dict[str, List[Dict]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        # 统计
+        self.marks = 0
+        self.deltas = 0
+
+    def start(self):
+        """启动盯市循环(需在事件循环中调用)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._mark_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def subscribe(self, account_id: str) -> Tuple[Dict[str, Dict], ConflatedSubscription]:
+        """
+        订阅账户的持仓变化
+
+        Args:
+            account_id: 账户ID(UUID)
+
+        Returns:
+            (当前持仓快照 {合约: {字段: 值}}, 订阅),此后订阅中的变化相对快照
+        """
+        subscription = self.hub.subscribe(account_id, min_interval=self.min_interval)
+        try:
+            if account_id not in self._accounts:
+                await single_flight.do("position_feed", account_id, lambda: self._load(account_id))
+        except Exception:
+            self.unsubscribe(subscription)
+            raise
+        snapshot = {symbol: dict(fields) for symbol, fields in self._accounts[account_id].items()}
+        return snapshot, subscription
+
+    def unsubscribe(self, subscription: ConflatedSubscription):
+        self.hub.unsubscribe(subscription)
+        if not self.hub.has_subscribers(subscription.topic):
+            if self._accounts.pop(subscription.topic, None) is not None:
+                self.book.remove_account(subscription.topic)
+
+    async def _load(self, account_id: str):
+        self._loading[account_id] = []
+        try:
+            rows = await self.db.select(
+                "positions",
+                columns=LOAD_COLUMNS,
+                filters={"account_id": account_id}
+            )
+            # 加载期间连接已全部断开
+            if not self.hub.has_subscribers(account_id):
+                return
+            state = {
+                row["symbol"]: {field: row.get(field) for field in POSITION_FIELDS + MARK_FIELDS}
+                for row in rows
+            }
+            for row in rows:
+                self.book.upsert(row)
+            # 重放加载期间的变化(按到达顺序,最后的值为准)
+            for position in self._loading[account_id]:
+                self.book.upsert(position)
+                state.setdefault(position["symbol"], {}).update(
+                    {field: position[field] for field in POSITION_FIELDS if field in position}
+                )
+            self._accounts[account_id] = state
+        finally:
+            del self._loading[account_id]
+
+    def on_positions(self, positions: List[Dict]):
+        """持仓引擎的变更回调(持仓写库后)"""
+        changes: Dict[str, Dict[str, Dict]] = {}
+        for position in positions:
+            account_id = position.get("account_id")
+            if account_id not in self._accounts:
+                if account_id in self._loading:
+                    self._loading[account_id].append(position)
+                continue
+            self.book.upsert(position)
+            fields = {field: position[field] for field in POSITION_FIELDS if field in position}
+            self._diff(account_id, position["symbol"], fields, changes)
+        self._publish(changes)
+
+    def mark(self):
+        """按行情共享表的最新价重算订阅账户的浮盈,推送变化"""
+        book = self.book
+        table = get_quote_table()
+        if table is None or not self._accounts or not len(book):
+            return
+
+        rows = np.array(
+            [i for i, account_id in enumerate(book.account_ids) if account_id in self._accounts],
+            dtype=np.intp
+        )
+        if not len(rows):
+            return
+
+        prices = np.array([
+            np.nan if quote is None or quote["last_price"] is None else quote["last_price"]
+            for quote in table.get_many(book.tq_symbols)
+        ], dtype=np.float64)
+        changed = book.mark(prices, rows)
+        self.marks += 1
+        if not len(changed):
+            return
+
+        last_price = book.last_price[changed].tolist()
+        long_profit = book.long_profit[changed].tolist()
+        short_profit = book.short_profit[changed].tolist()
+        changes: Dict[str, Dict[str, Dict]] = {}
+        for i, row in enumerate(changed.tolist()):
+            self._diff(book.account_ids[row], book.symbols[row], {
+                "last_price": last_price[i],
+                "long_profit": long_profit[i],
+                "short_profit": short_profit[i]
+            }, changes)
+        self._publish(changes)
+
+    def _diff(self, account_id: str, symbol: str, fields: Dict[str, Any], changes: Dict):
+        """与已推送状态比较,变化的字段记入changes {账户: {合约: {字段: 值}}}"""
+        state = self._accounts[account_id].setdefault(symbol, {})
+        changed = {field: value for field, value in fields.items() if state.get(field) != value}
+        if changed:
+            state.update(changed)
+            changes.setdefault(account_id, {}).setdefault(symbol, {}).update(changed)
+
+    def _publish(self, changes: Dict[str, Dict[str, Dict]]):
+        for account_id, positions in changes.items():
+            self.deltas += len(positions)
+            self.hub.publish(account_id, positions)
+
+    async def _mark_loop(self):
+        while True:
+            await asyncio.sleep(self.mark_interval)
+            try:
+                self.mark()
+            except Exception as e:
+                logger.error(f"[持仓推送] 盯市计算错误: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "accounts": len(self._accounts),
+            "loading": len(self._loading),
+            "positions": len(self.book),
+            "marks": self.marks,
+            "deltas": self.deltas,
+            "subscribers": self.hub.stats()
+        }
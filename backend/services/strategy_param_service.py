@@ -15,6 +15,7 @@ from typing import Dict, List, Any
 from supabase import Client
 
 from backend.utils.notification import send_notification
+from utils.db import async_db
 
 logger = logging.getLogger(__name__)
 
@@ -203,15 +204,14 @@ class StrategyParamService:
         返回 {param_key: param_value} 的字典
         """
         try:
-            result = (
-                self.db.table("v_current_strategy_params")
-                .select("param_key, param_value")
-                .eq("instance_id", instance_id)
-                .execute()
+            rows = await async_db.select(
+                "v_current_strategy_params",
+                "param_key, param_value",
+                {"instance_id": instance_id}
             )
 
             params = {}
-            for row in result.data:
+            for row in rows:
                 try:
                     params[row["param_key"]] = json.loads(row["param_value"])
                 except json.JSONDecodeError:
@@ -1,10 +1,18 @@
 """
 天勤SDK单例管理器
 保持全局唯一的TqApi连接，避免每次请求都重新连接
+
+TqApi由行情事件泵的线程持有(见services/market_event_pump.py),
+K线通过K线缓存读取(见services/kline_cache.py),其他调用通过pump.call在行情线程中执行
+已订阅合约的行情实时合成1分钟K线(见services/bar_aggregator.py)
 """
-from typing import Optional
+from typing import Any, Dict, Optional
 from tqsdk import TqApi, TqAuth
 from config import settings
+from services.bar_aggregator import BarAggregator
+from services.kline_cache import KlineCache
+from services.kline_store import kline_store
+from services.market_event_pump import MarketEventPump
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -14,58 +22,83 @@ class TqSdkManager:
     """天勤SDK单例管理器"""
 
     _instance: Optional['TqSdkManager'] = None
-    _api: Optional[TqApi] = None
-    _is_connected: bool = False
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
+            instance = super().__new__(cls)
+            instance.pump = MarketEventPump(cls._connect, wait_timeout=settings.market_pump_wait_timeout)
+            instance.klines = KlineCache(instance.pump, budget=settings.kline_cache_budget)
+            instance.bars = BarAggregator(
+                instance.pump,
+                store=kline_store,
+                grace=settings.bar_close_grace,
+                queue_size=settings.bar_ws_queue_size
+            ) if settings.bar_aggregator_enabled else None
+            cls._instance = instance
         return cls._instance
 
-    def get_api(self) -> Optional[TqApi]:
-        """获取TqApi实例，如果未连接则自动连接"""
-        if self._api is None or not self._is_connected:
-            self._connect()
-        return self._api
-
-    def _connect(self):
-        """连接天勤服务"""
+    @staticmethod
+    def _connect() -> TqApi:
+        """连接天勤服务(在行情线程中调用)"""
         try:
-            if self._api is not None:
-                # 如果已有连接，先关闭
-                try:
-                    self._api.close()
-                except Exception as e:
-                    logger.warning(f"关闭旧连接失败: {e}")
-
             logger.info("正在连接天勤服务...")
-            self._api = TqApi(
+            api = TqApi(
                 auth=TqAuth(settings.tqsdk_account, settings.tqsdk_password),
                 web_gui=False
             )
-            self._is_connected = True
             logger.info("✅ 天勤服务连接成功（单例模式）")
-
+            return api
         except Exception as e:
             logger.error(f"❌ 天勤服务连接失败: {e}")
-            self._is_connected = False
-            self._api = None
+            raise
+
+    def start(self):
+        """启动行情线程并连接天勤(需在事件循环中调用)"""
+        self.pump.start()
+        if self.bars:
+            self.bars.start()
 
     def is_connected(self) -> bool:
         """检查是否已连接"""
-        return self._is_connected and self._api is not None
+        return self.pump.running
+
+    async def get_quote(self, symbol: str) -> Optional[Dict[str, Any]]:
+        """
+        获取合约行情(首次获取时订阅)
+
+        Args:
+            symbol: 天勤格式合约代码
+        """
+        def read(api: TqApi) -> Dict[str, Any]:
+            quote = api.get_quote(symbol)
+            return {
+                'symbol': symbol,
+                'last_price': float(quote.last_price),
+                'open': float(quote.open),
+                'high': float(quote.highest),
+                'low': float(quote.lowest),
+                'volume': int(quote.volume),
+                'open_interest': int(quote.open_interest),
+                'bid_price': float(quote.bid_price1),
+                'ask_price': float(quote.ask_price1),
+                'datetime': quote.datetime,
+            }
+
+        return await self.pump.call(read)
+
+    def stats(self) -> Dict:
+        return {
+            "connected": self.is_connected(),
+            "kline_cache": self.klines.stats(),
+            "bar_aggregator": self.bars.stats() if self.bars else None
+        }
 
-    def close(self):
+    async def close(self):
         """关闭连接（仅在应用退出时调用）"""
-        if self._api is not None:
-            try:
-                self._api.close()
-                logger.info("天勤服务连接已关闭")
-            except Exception as e:
-                logger.error(f"关闭天勤连接失败: {e}")
-            finally:
-                self._api = None
-                self._is_connected = False
+        if self.bars:
+            await self.bars.stop()
+        self.pump.stop()
+        logger.info("天勤服务连接已关闭")
 
 
 # 全局单例
@@ -6,6 +6,11 @@
 2. 自动更新持仓表的最新价格
 3. 触发浮盈重新计算
 4. 通过WebSocket推送给前端
+5. 最新行情写入共享表(utils/quote_table.py),供各API进程读取
+6. 降采样记录行情快照到market_data表(services/market_data_recorder.py)
+
+TqApi由行情事件泵的独立线程持有(见services/market_event_pump.py),
+本服务在事件循环中消费行情变化事件
 
 使用方式:
     service = TqSdkService()
@@ -13,33 +18,71 @@
 """
 
 from tqsdk import TqApi, TqAuth
-from typing import Dict, Optional
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
 import asyncio
+import time
 from datetime import datetime
 from config import settings
-from utils.db import get_supabase_client
-from utils.contract_mapper import ContractMapper
+from engines.position_book import PositionBook
+from services.market_data_recorder import MarketDataRecorder
+from services.market_event_pump import MarketEventPump
+from services.position_events import POSITIONS_CHANNEL, decode
+from utils import fixed_point as fp
+from utils.db import async_db, get_supabase_client
+from utils.quote_table import QuoteTable
+from services.contract_registry import contract_registry
+
+if TYPE_CHECKING:
+    # 仅用于类型标注(engines与services包互相导入)
+    from engines.position_engine import PositionEngine
 
 
 class TqSdkService:
     """天勤行情服务"""
 
-    def __init__(self):
-        """初始化服务"""
-        self.api: Optional[TqApi] = None
-        self.quotes: Dict[str, object] = {}  # {tqsdk_symbol: quote对象}
+    def __init__(self, position_engine: Optional['PositionEngine'] = None):
+        """
+        初始化服务
+
+        Args:
+            position_engine: 同进程的持仓引擎,传入时持仓变更实时同步到持仓簿记;
+                独立进程运行时LISTEN持仓变更通知(services/position_events.py)同步,
+                无法监听时按间隔从数据库重新加载
+        """
+        self.pump = MarketEventPump(self.connect, wait_timeout=settings.market_pump_wait_timeout)
+        # {tqsdk_symbol: 最新行情字段},由行情事件泵维护
+        self.quotes: Dict[str, Dict] = self.pump.snapshots
         self.db = get_supabase_client()
         self.running = False
+        # 盯市用的持仓簿记
+        self.position_book = PositionBook()
+        self._book_loaded_at: Optional[float] = None
+        # 重载期间收到的持仓变更(重载完成后重放,避免被旧数据覆盖)
+        self._book_changes: Optional[List[Dict]] = None
+        self._standalone = position_engine is None
+        # 最新行情共享表(启动时创建,本服务是唯一写入方)
+        self.quote_table: Optional[QuoteTable] = None
+        # market_data行情记录
+        self.recorder: Optional[MarketDataRecorder] = None
+        if settings.market_data_record_enabled:
+            self.recorder = MarketDataRecorder(
+                self.quotes,
+                sample_interval=settings.market_data_sample_interval,
+                batch_size=settings.market_data_batch_size,
+                flush_interval=settings.market_data_flush_interval
+            )
+        if position_engine is not None:
+            position_engine.subscribe(self.on_positions_changed)
 
-    def connect(self):
+    @staticmethod
+    def connect() -> TqApi:
         """
-        连接天勤API
+        创建天勤API(在行情线程中调用)
 
         注意:天勤免费版只能获取行情,不能交易
         """
         try:
-            # 创建天勤连接
-            self.api = TqApi(
+            api = TqApi(
                 auth=TqAuth(
                     settings.tqsdk_account,
                     settings.tqsdk_password
@@ -47,27 +90,19 @@ class TqSdkService:
                 web_gui=False  # 不启动Web界面
             )
             print("✅ 天勤API连接成功")
-            return True
+            return api
         except Exception as e:
             print(f"❌ 天勤API连接失败: {e}")
-            return False
+            raise
 
     def subscribe_contract(self, tqsdk_symbol: str):
         """
-        订阅合约行情
+        订阅合约行情(在行情线程中生效)
 
         Args:
             tqsdk_symbol: 天勤格式合约代码,如"CZCE.TA2505"
         """
-        if not self.api:
-            raise RuntimeError("天勤API未连接,请先调用connect()")
-
-        if tqsdk_symbol not in self.quotes:
-            quote = self.api.get_quote(tqsdk_symbol)
-            self.quotes[tqsdk_symbol] = quote
-            print(f"📊 订阅行情: {tqsdk_symbol}")
-
-        return self.quotes[tqsdk_symbol]
+        self.pump.subscribe([tqsdk_symbol])
 
     def subscribe_contracts_from_db(self):
         """
@@ -79,137 +114,181 @@ class TqSdkService:
             .select("tqsdk_symbol, polar_symbol")\
             .execute()
 
-        subscribed_count = 0
-        for contract in result.data:
-            try:
-                self.subscribe_contract(contract['tqsdk_symbol'])
-                subscribed_count += 1
-            except Exception as e:
-                print(f"订阅失败 {contract['tqsdk_symbol']}: {e}")
+        symbols = {contract['tqsdk_symbol'] for contract in result.data if contract['tqsdk_symbol']}
+        self.pump.subscribe(symbols)
+
+        print(f"✅ 提交订阅 {len(symbols)} 个合约行情")
+        return len(symbols)
 
-        print(f"✅ 成功订阅 {subscribed_count} 个合约行情")
-        return subscribed_count
+    async def reload_position_book(self) -> int:
+        """
+        从数据库重新加载持仓簿记
 
-    async def update_position_prices(self):
+        持仓变更通常由变更通知实时同步,全量重载用于启动和兜底
+        (未能监听通知时按position_book_refresh_interval,否则按position_book_resync_interval)
+        """
+        self._book_changes = []
+        try:
+            # 在线程池中执行,不阻塞行情循环
+            rows = await async_db.rest(
+                self.db.table("positions")
+                .select(PositionBook.COLUMNS)
+                .or_("long_position.gt.0,short_position.gt.0")
+            )
+            count = self.position_book.load(
+                rows,
+                to_tqsdk=contract_registry.to_tqsdk,
+                multiplier_of=contract_registry.get_multiplier,
+                tick_of=lambda symbol: contract_registry.get_price_tick(symbol, fp.DEFAULT_TICK)
+            )
+            for position in self._book_changes:
+                self.position_book.upsert(position)
+        finally:
+            self._book_changes = None
+        self._book_loaded_at = time.monotonic()
+        return count
+
+    def on_positions_changed(self, positions: List[Dict]):
+        """持仓变更回调(成交入库/重建后由持仓引擎调用,或来自变更通知),同步到持仓簿记"""
+        if self._book_changes is not None:
+            self._book_changes.extend(positions)
+        for position in positions:
+            self.position_book.upsert(position)
+
+    def _on_position_notify(self, payload: str):
+        """持仓变更通知回调"""
+        try:
+            positions = decode(payload)
+        except ValueError as e:
+            print(f"❌ 持仓变更通知解析失败: {e}")
+            return
+        self.on_positions_changed(positions)
+
+    def _book_refresh_interval(self) -> float:
+        """持仓簿记的全量重载间隔"""
+        if not self._standalone or async_db.listening(POSITIONS_CHANNEL):
+            return settings.position_book_resync_interval
+        return settings.position_book_refresh_interval
+
+    async def update_position_prices(self, symbols: Optional[Iterable[str]] = None):
         """
-        更新所有持仓的最新价格和浮盈
+        更新持仓的最新价格和浮盈
 
         流程:
-        1. 从positions表获取所有持仓
-        2. 获取对应合约的最新价格
-        3. 重新计算浮盈
-        4. 更新数据库
+        1. 持仓簿记到重载间隔时从positions表重新加载
+        2. 只取最新价变化合约的持仓,向量化计算浮盈
+        3. 到期的待写持仓一次批量写库(同一持仓每个写库间隔最多写一次)
+
+        Args:
+            symbols: 最新价变化的天勤合约代码,默认全部合约
+
+        Returns:
+            写库的持仓数
         """
-        # 获取所有持仓
-        positions_response = self.db.table("positions")\
-            .select("id, symbol, long_position, long_avg_price, short_position, short_avg_price")\
-            .or_("long_position.gt.0,short_position.gt.0")\
-            .execute()
+        if self._book_loaded_at is None or \
+                time.monotonic() - self._book_loaded_at >= self._book_refresh_interval():
+            if self._standalone:
+                # 监听连接断开后重新监听(先于重载,不漏掉重载后的变更)
+                await async_db.listen(POSITIONS_CHANNEL, self._on_position_notify)
+            # 重载前写出未落库的值,避免丢失
+            await self.flush_position_prices(force=True)
+            await self.reload_position_book()
+
+        book = self.position_book
+        rows = None if symbols is None else book.rows_for(symbols)
+        book.mark(book.price_vector(self.quotes), rows)
+        return await self.flush_position_prices()
+
+    async def flush_position_prices(self, force: bool = False) -> int:
+        """
+        批量写入到期的待写持仓
 
-        updated_count = 0
+        Args:
+            force: 忽略写库间隔,写出全部待写持仓
 
-        for position in positions_response.data:
-            try:
-                # 转换为天勤格式
-                tqsdk_symbol = ContractMapper.polar_to_tqsdk(position['symbol'])
-
-                # 获取最新价格
-                if tqsdk_symbol in self.quotes:
-                    quote = self.quotes[tqsdk_symbol]
-                    last_price = quote.last_price
-
-                    # 获取合约乘数
-                    multiplier = await self._get_multiplier(position['symbol'])
-
-                    # 计算浮盈
-                    long_profit = 0
-                    short_profit = 0
-
-                    if position['long_position'] > 0 and position['long_avg_price']:
-                        long_profit = (last_price - float(position['long_avg_price'])) * \
-                                     position['long_position'] * multiplier
-
-                    if position['short_position'] > 0 and position['short_avg_price']:
-                        short_profit = (float(position['short_avg_price']) - last_price) * \
-                                      position['short_position'] * multiplier
-
-                    # 更新数据库
-                    self.db.table("positions")\
-                        .update({
-                            "last_price": last_price,
-                            "long_profit": long_profit,
-                            "short_profit": short_profit,
-                            "last_update_time": datetime.now().isoformat(),
-                            "updated_at": datetime.now().isoformat()
-                        })\
-                        .eq("id", position['id'])\
-                        .execute()
-
-                    updated_count += 1
+        Returns:
+            写库的持仓数
+        """
+        book = self.position_book
+        now = time.monotonic()
+        due = book.due(now, 0 if force else settings.position_price_write_interval)
+        if not len(due):
+            return 0
 
-            except Exception as e:
-                print(f"更新持仓价格失败 {position['symbol']}: {e}")
+        rows = book.to_rows(due, datetime.now().isoformat())
+        try:
+            await async_db.insert("positions", rows, on_conflict="id")
+        except Exception as e:
+            # 保持待写标记,下次再写
+            print(f"批量更新持仓价格失败: {e}")
+            return 0
 
-        if updated_count > 0:
-            print(f"✅ 更新了 {updated_count} 个持仓的价格")
+        book.mark_written(due, now)
+        return len(rows)
 
-        return updated_count
+    async def _flush_loop(self):
+        """定时写出因写库间隔而暂缓的持仓"""
+        while self.running:
+            await asyncio.sleep(settings.position_price_write_interval)
+            if self.quote_table is not None:
+                self.quote_table.heartbeat()
+            try:
+                await self.flush_position_prices()
+            except Exception as e:
+                print(f"❌ 持仓价格写库错误: {e}")
+
+    def publish_quotes(self, changes: Dict[str, Dict]):
+        """把行情变化写入共享表"""
+        table = self.quote_table
+        if table is None:
+            return
+        for symbol, fields in changes.items():
+            try:
+                table.update(symbol, fields)
+            except RuntimeError as e:
+                print(f"❌ 行情共享表写入失败 {symbol}: {e}")
+        table.heartbeat()
 
     async def _get_multiplier(self, polar_symbol: str) -> int:
         """获取合约乘数"""
-        try:
-            result = self.db.table("contracts")\
-                .select("multiplier")\
-                .eq("polar_symbol", polar_symbol)\
-                .single()\
-                .execute()
-            return result.data.get('multiplier', 10) if result.data else 10
-        except Exception:
-            return 10
+        return contract_registry.get_multiplier(polar_symbol)
 
     async def market_data_loop(self):
         """
         行情数据循环(主循环)
 
-        持续运行,监听行情变化并更新数据库
+        消费行情事件泵的变化事件,有合约最新价变化时更新持仓。
+        消费慢时积压的事件在队列中合并,不会阻塞行情线程
         """
         self.running = True
         print("🚀 启动行情监听循环...")
 
         update_counter = 0
 
-        while self.running:
+        async for event in self.pump.events():
+            if not self.running:
+                break
+
             try:
-                # 等待行情更新
-                self.api.wait_update()
-
-                # 检查是否有价格变化
-                price_changed = False
-                for symbol, quote in self.quotes.items():
-                    if self.api.is_changing(quote, "last_price"):
-                        price_changed = True
-                        print(f"📈 {symbol} 价格: {quote.last_price}")
-                        break
-
-                # 如果有价格变化,更新持仓
-                if price_changed:
-                    await self.update_position_prices()
-                    update_counter += 1
+                self.publish_quotes(event.changes)
+                if self.recorder is not None:
+                    self.recorder.observe(event.changes)
 
-                # 每100次更新打印一次统计
-                if update_counter % 100 == 0 and update_counter > 0:
-                    print(f"📊 已更新 {update_counter} 次持仓价格")
+                changed = event.symbols_changed("last_price")
+                if not changed:
+                    continue
 
-                # 短暂休眠,避免CPU占用过高
-                await asyncio.sleep(0.5)
+                await self.update_position_prices(changed)
+                update_counter += 1
+
+                # 每100次更新打印一次统计
+                if update_counter % 100 == 0:
+                    stats = self.pump.stats()
+                    print(f"📊 已更新 {update_counter} 次持仓价格, "
+                          f"tick延迟 {stats['tick_latency']}, 进程内延迟 {stats['pump_latency']}")
 
-            except KeyboardInterrupt:
-                print("\n⏹️  收到停止信号,退出行情循环")
-                self.running = False
-                break
             except Exception as e:
                 print(f"❌ 行情循环错误: {e}")
-                await asyncio.sleep(5)  # 出错后等待5秒再继续
 
     def get_quote_info(self, tqsdk_symbol: str) -> Optional[Dict]:
         """
@@ -221,55 +300,76 @@ class TqSdkService:
         Returns:
             行情字典或None
         """
-        if tqsdk_symbol not in self.quotes:
+        quote = self.quotes.get(tqsdk_symbol)
+        if quote is None:
             return None
 
-        quote = self.quotes[tqsdk_symbol]
-
         return {
             "symbol": tqsdk_symbol,
-            "last_price": quote.last_price,
-            "bid_price": quote.bid_price1,
-            "ask_price": quote.ask_price1,
-            "volume": quote.volume,
-            "open_interest": quote.open_interest,
-            "high": quote.highest,
-            "low": quote.lowest,
-            "open": quote.open,
-            "pre_settlement": quote.pre_settlement,
-            "datetime": quote.datetime
+            "last_price": quote.get("last_price"),
+            "bid_price": quote.get("bid_price1"),
+            "ask_price": quote.get("ask_price1"),
+            "volume": quote.get("volume"),
+            "open_interest": quote.get("open_interest"),
+            "high": quote.get("highest"),
+            "low": quote.get("lowest"),
+            "open": quote.get("open"),
+            "pre_settlement": quote.get("pre_settlement"),
+            "datetime": quote.get("datetime")
         }
 
+    def stats(self) -> Dict:
+        """行情事件泵统计(含tick延迟分布)"""
+        stats = self.pump.stats()
+        if self.quote_table is not None:
+            stats["quote_table"] = self.quote_table.stats()
+        if self.recorder is not None:
+            stats["market_data_recorder"] = self.recorder.stats()
+        return stats
+
     async def start(self):
         """
         启动天勤服务
 
         完整流程:
-        1. 连接天勤API
-        2. 订阅数据库中所有合约
-        3. 启动行情循环
+        1. 提交数据库中所有合约的订阅
+        2. 启动行情线程(在线程内连接天勤API)
+        3. 打开行情共享表,启动行情循环
         """
         print("=" * 50)
         print("启动天勤行情服务")
         print("=" * 50)
 
-        # 1. 连接
-        if not self.connect():
-            raise RuntimeError("天勤连接失败")
+        await async_db.connect()
+        await contract_registry.load()
 
-        # 2. 订阅合约
+        # 1. 订阅合约
         count = self.subscribe_contracts_from_db()
         if count == 0:
             print("⚠️  警告: 未订阅任何合约,请检查contracts表")
 
+        # 2. 行情线程
+        self.pump.start()
+
         # 3. 启动循环
-        await self.market_data_loop()
+        self.quote_table = QuoteTable.create(
+            settings.quote_table_path, settings.quote_table_capacity
+        )
+        self.running = True
+        flush_task = asyncio.create_task(self._flush_loop())
+        if self.recorder is not None:
+            await self.recorder.start()
+        try:
+            await self.market_data_loop()
+        finally:
+            flush_task.cancel()
+            if self.recorder is not None:
+                await self.recorder.stop()
 
     def stop(self):
         """停止服务"""
         self.running = False
-        if self.api:
-            self.api.close()
+        self.pump.stop()
         print("✅ 天勤服务已停止")
 
 
@@ -0,0 +1,274 @@
+"""
+成交入库服务
+
+负责把极星推送的成交写入trades表并驱动持仓更新:
+- 单笔入库: /api/trades
+- 批量入库: /api/trades/batch, 账户只解析一次、成交一次性写入、
+  每个(账户, 合约)只做一次持仓更新
+
+去重: 成交以(账户, 订单号, 成交序号)唯一标识。
+最近入库的成交键保存在内存中,绝大多数重复推送不访问数据库;
+其余由trades表部分唯一索引兜底,重复成交不写库、不重算持仓。
+没有成交序号、没有订单号或订单号为"-1"(下单失败)的成交无法识别重复,不去重
+"""
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from engines.position_engine import PositionEngine
+from models.schemas import TradeEvent
+from utils.account_resolver import account_resolver
+from utils.db import AsyncDatabase, async_db
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+TradeKey = Tuple[str, str, int]
+
+# trades表去重索引对应的列及索引谓词(见009_trade_dedup.sql)
+DEDUP_CONFLICT = "account_id,order_id,fill_seq"
+DEDUP_PREDICATE = "fill_seq IS NOT NULL AND order_id <> '-1'"
+# 下单失败时极星推送的订单号
+INVALID_ORDER_ID = "-1"
+
+
+class RecentTradeKeys:
+    """最近入库成交键的有界集合(LRU淘汰)"""
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._keys: "OrderedDict[TradeKey, None]" = OrderedDict()
+
+    def __contains__(self, key: TradeKey) -> bool:
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: TradeKey):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+
+class TradeIngestService:
+    """成交入库服务"""
+
+    def __init__(
+        self,
+        position_engine: PositionEngine,
+        db: AsyncDatabase = None,
+        dedup_cache_size: int = 100000
+    ):
+        self.db = db or async_db
+        self.position_engine = position_engine
+        self.recent_keys = RecentTradeKeys(dedup_cache_size)
+
+        # 去重统计
+        self.duplicates_cached = 0  # 内存集合拦截
+        self.duplicates_db = 0      # 唯一索引拦截
+
+    @staticmethod
+    def build_trade_row(account_uuid: str, trade: TradeEvent) -> Dict[str, Any]:
+        """构造trades表记录"""
+        return {
+            "account_id": account_uuid,
+            "symbol": trade.symbol,
+            "direction": trade.direction,
+            "offset": trade.offset,
+            "volume": trade.volume,
+            "price": trade.price,
+            "order_id": trade.order_id,
+            "fill_seq": trade.fill_seq,
+            "timestamp": trade.timestamp.isoformat(),
+            "source": trade.source
+        }
+
+    @staticmethod
+    def row_key(row: Dict[str, Any]) -> Optional[TradeKey]:
+        """成交记录的去重键,无法识别重复的成交返回None"""
+        order_id, fill_seq = row.get("order_id"), row.get("fill_seq")
+        if not order_id or order_id == INVALID_ORDER_ID or fill_seq is None:
+            return None
+        return (row["account_id"], order_id, fill_seq)
+
+    @classmethod
+    def trade_key(cls, account_uuid: str, trade: TradeEvent) -> Optional[TradeKey]:
+        """成交去重键,无法识别重复的成交返回None"""
+        return cls.row_key({
+            "account_id": account_uuid,
+            "order_id": trade.order_id,
+            "fill_seq": trade.fill_seq
+        })
+
+    def is_recent_duplicate(self, account_uuid: str, trade: TradeEvent) -> bool:
+        """内存中判断是否为最近已入库的成交"""
+        key = self.trade_key(account_uuid, trade)
+        if key is not None and key in self.recent_keys:
+            self.duplicates_cached += 1
+            return True
+        return False
+
+    async def _insert_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        写入成交,与已入库成交重复的记录被忽略
+
+        Returns:
+            实际写入的记录
+        """
+        keyed = [row for row in rows if self.row_key(row) is not None]
+        unkeyed = [row for row in rows if self.row_key(row) is None]
+        inserted: List[Dict[str, Any]] = []
+        if keyed:
+            inserted += await self.db.insert(
+                "trades", keyed, on_conflict=DEDUP_CONFLICT,
+                ignore_duplicates=True, conflict_where=DEDUP_PREDICATE
+            )
+        if unkeyed:
+            # 调用方指定ID时,同一ID重复写入(重试)被忽略
+            inserted += await self.db.insert(
+                "trades", unkeyed, on_conflict="id", ignore_duplicates=True
+            )
+        return inserted
+
+    def _remember(self, row: Dict[str, Any]):
+        key = self.row_key(row)
+        if key is not None:
+            self.recent_keys.add(key)
+
+    async def ingest_trade(self, account_uuid: str, trade: TradeEvent) -> Dict[str, Any]:
+        """
+        写入单笔成交并增量更新持仓
+
+        Returns:
+            {"duplicate": 是否重复, "trade": 写入的记录}
+        """
+        if self.is_recent_duplicate(account_uuid, trade):
+            return {"duplicate": True, "trade": None}
+
+        row = self.build_trade_row(account_uuid, trade)
+        inserted = await self._insert_rows([row])
+        self._remember(row)
+
+        if not inserted:
+            if self.trade_key(account_uuid, trade) is not None:
+                self.duplicates_db += 1
+                return {"duplicate": True, "trade": None}
+            # 不去重的成交不会冲突,没有返回记录只能全量重建
+            await self.position_engine.rebuild_position(account_uuid, trade.symbol)
+            return {"duplicate": False, "trade": None}
+
+        # 增量更新持仓(水位不一致时自动全量重建)
+        await self.position_engine.apply_trades(account_uuid, trade.symbol, inserted)
+        return {"duplicate": False, "trade": inserted[0]}
+
+    def stats(self) -> Dict:
+        """去重统计"""
+        return {
+            "recent_keys": len(self.recent_keys),
+            "max_recent_keys": self.recent_keys.max_size,
+            "duplicates_cached": self.duplicates_cached,
+            "duplicates_db": self.duplicates_db
+        }
+
+    async def ingest_batch(
+        self,
+        trades: List[TradeEvent],
+        ids: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        批量写入成交并更新持仓
+
+        流程:
+        1. 一次查询解析所有账户
+        2. 剔除批内及最近已入库的重复成交
+        3. 一次性写入全部有效成交(与已入库成交重复的忽略)
+        4. 按(账户, 合约)分组,每组只做一次持仓更新
+
+        指定ids时可安全重试: 同一成交每次写入的ID相同,上次已写入的不会重复写入;
+        数据库中已存在的成交可能尚未计入持仓(上次写入后失败),其所在分组改为全量重建
+
+        Args:
+            trades: 成交列表(保持推送顺序)
+            ids: 每笔成交的记录ID(与trades等长),为空时随机生成
+
+        Returns:
+            逐笔处理结果,与输入顺序一致
+        """
+        results: List[Dict[str, Any]] = [
+            {"index": i, "order_id": trade.order_id, "status": "pending"}
+            for i, trade in enumerate(trades)
+        ]
+
+        # 1. 解析账户
+        account_map = await account_resolver.resolve_many(t.account_id for t in trades)
+
+        rows: List[Dict[str, Any]] = []
+        row_items: List[int] = []
+        batch_keys = set()
+        for i, trade in enumerate(trades):
+            account_uuid = account_map.get(trade.account_id)
+            if not account_uuid:
+                results[i].update(status="account_not_found",
+                                  error=f"Account not found: {trade.account_id}")
+                continue
+
+            # 2. 去重
+            key = self.trade_key(account_uuid, trade)
+            if key is not None and (key in batch_keys or self.is_recent_duplicate(account_uuid, trade)):
+                results[i]["status"] = "duplicate"
+                continue
+            if key is not None:
+                batch_keys.add(key)
+
+            row = self.build_trade_row(account_uuid, trade)
+            # 预先确定ID,用于把返回记录对应回请求项
+            row["id"] = ids[i] if ids is not None else str(uuid.uuid4())
+            rows.append(row)
+            row_items.append(i)
+
+        if not rows:
+            return results
+
+        # 3. 一次性写入
+        inserted = {row['id']: row for row in await self._insert_rows(rows)}
+
+        # 4. 按(账户, 合约)分组更新持仓
+        groups: Dict[Tuple[str, str], List[int]] = {}
+        rebuild = set()
+        for row, i in zip(rows, row_items):
+            self._remember(row)
+            group = (row["account_id"], row["symbol"])
+            if row["id"] not in inserted:
+                # 与已入库成交冲突
+                self.duplicates_db += 1
+                results[i]["status"] = "duplicate"
+                if ids is not None:
+                    rebuild.add(group)
+                    groups.setdefault(group, [])
+                continue
+            results[i]["trade_id"] = row["id"]
+            groups.setdefault(group, []).append(i)
+
+        for (account_uuid, symbol), items in groups.items():
+            group_rows = [inserted[results[i]["trade_id"]] for i in items]
+            try:
+                if (account_uuid, symbol) in rebuild:
+                    await self.position_engine.rebuild_position(account_uuid, symbol)
+                else:
+                    await self.position_engine.apply_trades(account_uuid, symbol, group_rows)
+                status, error = "ok", None
+            except Exception as e:
+                logger.error(f"[批量成交] 持仓更新失败 {symbol}: {e}")
+                status, error = "position_update_failed", str(e)
+
+            for i in items:
+                results[i]["status"] = status
+                if error:
+                    results[i]["error"] = error
+
+        return results
@@ -0,0 +1,315 @@
+"""
+成交预写日志(write-behind)
+
+journal模式下/api/trades只做两件事: 校验成交、追加到本地日志并fsync,
+随即返回。后台刷写任务把日志中的成交批量交给TradeIngestService
+写入trades表并更新持仓
+
+文件:
+- <path>:       JSON Lines追加日志,每行 {"seq": 序号, "ts": 追加时间, "trade": 成交}
+- <path>.ckpt:  已成功刷写到数据库的最大序号
+
+重启时重放序号大于检查点的成交;日志全部刷写后自动截断
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+from models.schemas import TradeEvent
+from services.trade_ingest_service import TradeIngestService
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 由日志记录生成成交ID的命名空间
+TRADE_ID_NAMESPACE = uuid.UUID("6f1c3b52-8d0e-4a57-9a35-2f4e8c1d7b90")
+
+
+class JournalEntry:
+    """日志中的一笔成交"""
+
+    def __init__(self, seq: int, appended_at: float, trade: TradeEvent):
+        self.seq = seq
+        self.appended_at = appended_at  # time.time()
+        self.trade = trade
+
+    @property
+    def trade_id(self) -> str:
+        """
+        成交记录ID,由序号和追加时间确定
+
+        刷写重试(包括超时后实际已提交的写入)使用同一ID,不会重复入库;
+        加入追加时间,日志文件被删除、序号从头开始后也不会与旧成交冲突
+        """
+        return str(uuid.uuid5(TRADE_ID_NAMESPACE, f"{self.seq}:{self.appended_at!r}"))
+
+
+class TradeJournal:
+    """成交预写日志 + 后台刷写"""
+
+    # 刷写失败后的重试等待(秒),逐次翻倍
+    RETRY_MIN = 1.0
+    RETRY_MAX = 30.0
+    # 日志全部刷写后超过该大小才截断,避免频繁重写文件
+    COMPACT_BYTES = 4 * 1024 * 1024
+
+    def __init__(
+        self,
+        ingest_service: TradeIngestService,
+        path: str,
+        flush_interval: float = 0.2,
+        batch_size: int = 500
+    ):
+        self.ingest_service = ingest_service
+        self.path = path
+        self.checkpoint_path = f"{path}.ckpt"
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._pending: Deque[JournalEntry] = deque()
+        self._next_seq = 1
+        self._checkpoint = 0
+        self._file = None
+        self._lock = threading.Lock()  # 保护文件追加、序号和入队顺序
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._retry_delay = self.RETRY_MIN
+
+        # 统计
+        self.appended = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.replayed = 0
+        self.flush_batches = 0
+        self.flush_failures = 0
+        self.last_flush_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+    # ------------------------------------------------------------
+    # 启停
+    # ------------------------------------------------------------
+
+    async def start(self):
+        """打开日志、恢复未刷写的成交并启动后台刷写"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._recover()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+
+        logger.info(
+            f"成交日志已启动: {self.path}, 检查点seq={self._checkpoint}, "
+            f"待重放{len(self._pending)}笔"
+        )
+
+    async def stop(self):
+        """停止后台刷写,尽量把剩余成交写入数据库"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            while self._pending:
+                if not await self._flush_once():
+                    break
+        except Exception as e:
+            logger.error(f"关闭时刷写成交日志失败,剩余{len(self._pending)}笔将在重启后重放: {e}")
+
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _recover(self):
+        """读取检查点和日志,未刷写的成交放回队列"""
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                content = f.read().strip()
+                self._checkpoint = int(content) if content else 0
+
+        last_seq = self._checkpoint
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line_no, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 只可能是崩溃时写了一半的最后一行
+                        logger.warning(f"成交日志第{line_no}行不完整,已忽略")
+                        continue
+
+                    seq = record["seq"]
+                    last_seq = max(last_seq, seq)
+                    if seq <= self._checkpoint:
+                        continue
+                    self._pending.append(JournalEntry(
+                        seq, record.get("ts", time.time()),
+                        TradeEvent.model_validate(record["trade"])
+                    ))
+
+        self._next_seq = last_seq + 1
+        self.replayed = len(self._pending)
+
+    # ------------------------------------------------------------
+    # 追加
+    # ------------------------------------------------------------
+
+    async def append(self, trade: TradeEvent) -> int:
+        """
+        追加一笔成交并落盘
+
+        fsync在线程中执行,不阻塞事件循环;
+        入队与分配序号在同一把锁内,队列始终按序号递增(检查点取队尾序号)
+
+        Returns:
+            日志序号
+        """
+        if self._file is None:
+            raise RuntimeError("成交日志未启动")
+
+        entry = await asyncio.to_thread(self._write, trade)
+        self.appended += 1
+
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return entry.seq
+
+    def _write(self, trade: TradeEvent) -> JournalEntry:
+        with self._lock:
+            entry = JournalEntry(self._next_seq, time.time(), trade)
+            record = {
+                "seq": entry.seq,
+                "ts": entry.appended_at,
+                "trade": trade.model_dump(mode="json")
+            }
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._next_seq += 1
+            self._pending.append(entry)
+            return entry
+
+    # ------------------------------------------------------------
+    # 刷写
+    # ------------------------------------------------------------
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            while self._pending:
+                try:
+                    flushed = await self._flush_once()
+                except Exception as e:
+                    flushed = False
+                    self.last_error = str(e)
+                    logger.error(f"成交日志刷写异常: {e}")
+
+                if not flushed:
+                    self.flush_failures += 1
+                    await asyncio.sleep(self._retry_delay)
+                    self._retry_delay = min(self._retry_delay * 2, self.RETRY_MAX)
+                    break
+
+                self._retry_delay = self.RETRY_MIN
+
+    async def _flush_once(self) -> bool:
+        """
+        刷写队首一批成交
+
+        Returns:
+            是否成功(失败时成交保留在队列中等待重试)
+        """
+        batch: List[JournalEntry] = [
+            self._pending[i] for i in range(min(self.batch_size, len(self._pending)))
+        ]
+        if not batch:
+            return True
+
+        results = await self.ingest_service.ingest_batch(
+            [entry.trade for entry in batch], ids=[entry.trade_id for entry in batch]
+        )
+
+        for entry, result in zip(batch, results):
+            status = result["status"]
+            if status == "account_not_found":
+                # 账户不存在,重试也不会成功
+                self.dropped += 1
+                logger.error(f"成交日志seq={entry.seq}账户不存在,已丢弃: {entry.trade.account_id}")
+            elif status not in ("ok", "duplicate"):
+                # 成交已入库,持仓可通过重建修复
+                logger.warning(
+                    f"成交日志seq={entry.seq}持仓更新失败: {result.get('error')}"
+                )
+
+        for _ in batch:
+            self._pending.popleft()
+        self.flushed += len(batch)
+        self.flush_batches += 1
+        self.last_flush_at = datetime.now()
+        self.last_error = None
+
+        await asyncio.to_thread(self._save_checkpoint, batch[-1].seq)
+        return True
+
+    def _save_checkpoint(self, seq: int):
+        """原子写入检查点,日志已全部刷写时截断"""
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        self._checkpoint = seq
+
+        with self._lock:
+            if self._pending or self._next_seq - 1 != seq:
+                return
+            if self._file.tell() < self.COMPACT_BYTES:
+                return
+            # 检查点已覆盖全部记录,截断后序号继续递增
+            self._file.truncate(0)
+            self._file.seek(0)
+            os.fsync(self._file.fileno())
+
+    # ------------------------------------------------------------
+    # 监控
+    # ------------------------------------------------------------
+
+    def stats(self) -> Dict:
+        """日志统计"""
+        oldest = self._pending[0].appended_at if self._pending else None
+        return {
+            "backlog": len(self._pending),
+            "lag_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+            "next_seq": self._next_seq,
+            "checkpoint_seq": self._checkpoint,
+            "appended": self.appended,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "replayed": self.replayed,
+            "flush_batches": self.flush_batches,
+            "flush_failures": self.flush_failures,
+            "last_flush_at": self.last_flush_at.isoformat() if self.last_flush_at else None,
+            "last_error": self.last_error,
+            "journal_bytes": self._file.tell() if self._file else 0
+        }
@@ -0,0 +1,97 @@
+"""
+实时K线合成测试(services/bar_aggregator.py)
+"""
+from datetime import datetime
+
+from services.bar_aggregator import BarAggregator, session_bounds
+from services.kline_resampler import NS
+from services.market_event_pump import EXCHANGE_TZ
+
+SYMBOL = "SHFE.rb2505"
+
+
+def ns(value: str) -> int:
+    """交易所本地时间 → epoch纳秒"""
+    return int(datetime.fromisoformat(value).replace(tzinfo=EXCHANGE_TZ).timestamp()) * NS
+
+
+def tick(aggregator, at, price, volume, symbol=SYMBOL):
+    return aggregator.on_quote(symbol, {
+        "datetime": f"2025-01-02 {at}", "last_price": price, "volume": volume
+    })
+
+
+def test_first_bar_is_not_published():
+    """启动后的第一根K线不完整,收线时不发布"""
+    aggregator = BarAggregator(pump=None)
+    tick(aggregator, "09:00:10.000000", 3500, 100)
+    tick(aggregator, "09:00:30.000000", 3501, 105)
+
+    assert tick(aggregator, "09:01:00.500000", 3502, 107) == []
+    assert aggregator.current(SYMBOL)["datetime"] == ns("2025-01-02T09:01:00")
+
+
+def test_bar_from_volume_deltas():
+    """成交量取累计量增量,开高低收取tick最新价"""
+    aggregator = BarAggregator(pump=None)
+    tick(aggregator, "09:00:59.000000", 3500, 100)
+    tick(aggregator, "09:01:00.500000", 3502, 102)
+    tick(aggregator, "09:01:20.000000", 3505, 110)
+    tick(aggregator, "09:01:40.000000", 3498, 111)
+
+    bars = tick(aggregator, "09:02:00.000000", 3499, 115)
+    assert bars == [{
+        "datetime": ns("2025-01-02T09:01:00"), "open": 3502, "high": 3505,
+        "low": 3498, "close": 3498, "volume": 11, "open_interest": 0
+    }]
+
+
+def test_tick_without_volume_does_not_open_bar():
+    """没有成交的tick只推进时钟,不形成K线"""
+    aggregator = BarAggregator(pump=None)
+    tick(aggregator, "09:00:59.000000", 3500, 100)
+    tick(aggregator, "09:01:10.000000", 3501, 100)
+
+    assert aggregator.current(SYMBOL) is None
+
+
+def test_close_tick_closes_previous_bar():
+    """收盘时刻的tick归入前一根K线并立即收线"""
+    aggregator = BarAggregator(pump=None)
+    tick(aggregator, "14:58:30.000000", 3500, 100)
+    tick(aggregator, "14:59:10.000000", 3501, 103)
+
+    bars = tick(aggregator, "15:00:00.000000", 3503, 106)
+    assert [(bar["datetime"], bar["close"], bar["volume"]) for bar in bars] == [
+        (ns("2025-01-02T14:59:00"), 3503, 6)
+    ]
+    assert aggregator.current(SYMBOL) is None
+
+
+def test_auction_tick_joins_opening_bar():
+    """开盘前集合竞价的tick归入开盘第一根K线"""
+    aggregator = BarAggregator(pump=None)
+    aggregator.set_sessions(SYMBOL, {"day": [["09:00:00", "10:15:00"]], "night": []})
+    tick(aggregator, "08:58:00.000000", 3500, 0)
+    tick(aggregator, "08:59:00.000000", 3500, 20)
+
+    assert aggregator.current(SYMBOL)["datetime"] == ns("2025-01-02T09:00:00")
+
+
+def test_late_tick_for_closed_bar_is_counted():
+    """落在已收线K线内的迟到成交计入late,不改写K线"""
+    aggregator = BarAggregator(pump=None)
+    tick(aggregator, "09:00:59.000000", 3500, 100)
+    tick(aggregator, "09:01:10.000000", 3501, 101)
+    tick(aggregator, "09:02:00.000000", 3502, 102)
+
+    assert tick(aggregator, "09:01:59.000000", 3490, 105) == []
+    assert aggregator.late == 1
+
+
+def test_session_bounds_wraps_after_midnight():
+    """"25:00:00"表示次日01:00"""
+    starts, ends = session_bounds({"day": [["09:00:00", "10:15:00"]], "night": [["21:00:00", "25:00:00"]]})
+
+    assert starts == (9 * 3600, 21 * 3600)
+    assert ends == {10 * 3600 + 15 * 60, 3600}
@@ -0,0 +1,67 @@
+"""
+定点数计算核心测试(utils/fixed_point.py)
+"""
+import numpy as np
+
+from utils import fixed_point as fp
+
+
+def test_to_fixed_rounds_float_noise():
+    """价格的浮点尾差按价位四舍五入到定点"""
+    assert fp.to_fixed(0.1 + 0.2, 0.1) == 3 * fp.SCALE
+    assert fp.to_fixed(3500.0000001, 1) == 3500 * fp.SCALE
+    assert fp.to_fixed(4567.8, 0.2) == 22839 * fp.SCALE
+
+
+def test_to_fixed_array_matches_scalar():
+    """数组路径与标量快速路径结果一致"""
+    prices = [3500.0, 4567.8, 0.30000000000000004]
+    ticks = [1.0, 0.2, 0.1]
+    fixed = fp.to_fixed(np.array(prices), np.array(ticks))
+
+    assert fixed.dtype == np.int64
+    assert fixed.tolist() == [fp.to_fixed(p, t) for p, t in zip(prices, ticks)]
+
+
+def test_to_price_round_trip():
+    """定点价格换算回价格"""
+    assert fp.to_price(fp.to_fixed(4567.8, 0.2), 0.2) == 4567.8
+
+
+def test_weighted_average_rounds_half_up():
+    """加权均价按整数四舍五入(不经过浮点)"""
+    # (100 * 1 + 101 * 1) / 2 = 100.5 → 101
+    assert fp.weighted_average(100, 1, 101, 1) == 101
+    # (100 * 2 + 101 * 1) / 3 = 100.33 → 100
+    assert fp.weighted_average(100, 2, 101, 1) == 100
+    # (100 * 1 + 102 * 2) / 3 = 101.33 → 101
+    assert fp.weighted_average(100, 1, 102, 2) == 101
+
+
+def test_weighted_average_empty_position():
+    """总持仓为0时均价为0,数组中的空持仓不影响其他行"""
+    assert fp.weighted_average(0, 0, 100, 0) == 0
+
+    result = fp.weighted_average(
+        np.array([100, 0]), np.array([1, 0]), np.array([101, 100]), np.array([1, 0])
+    )
+    assert result.tolist() == [101, 0]
+
+
+def test_pnl_long_and_short():
+    """多头价涨盈利、空头价涨亏损,金额按价位和乘数换算"""
+    tick = 0.2
+    avg = fp.to_fixed(4567.8, tick)
+    last = fp.to_fixed(4570.0, tick)
+
+    assert round(fp.pnl(avg, last, 3, 10, tick, 1), 6) == 66.0
+    assert round(fp.pnl(avg, last, 3, 10, tick, -1), 6) == -66.0
+
+
+def test_pnl_fractional_average():
+    """均价落在价位之间时浮盈不丢失精度"""
+    tick = 1.0
+    # 3500和3501各1手,均价3500.5
+    avg = fp.weighted_average(fp.to_fixed(3500, tick), 1, fp.to_fixed(3501, tick), 1)
+
+    assert fp.pnl(avg, fp.to_fixed(3502, tick), 2, 10, tick) == 30.0
@@ -0,0 +1,84 @@
+"""
+K线重采样测试(services/kline_resampler.py)
+"""
+from datetime import datetime
+
+import numpy as np
+
+from services.kline_resampler import (
+    DAY, NS, can_resample, exchange_of, resample, trading_days
+)
+from services.market_event_pump import EXCHANGE_TZ
+
+
+def ns(value: str) -> int:
+    """交易所本地时间 → epoch纳秒"""
+    return int(datetime.fromisoformat(value).replace(tzinfo=EXCHANGE_TZ).timestamp()) * NS
+
+
+def days_of(values, exchange="SHFE"):
+    return trading_days(np.array([ns(v) for v in values]), exchange).tolist()
+
+
+def test_day_session_same_day():
+    """日盘属于当天交易日"""
+    assert days_of(["2025-01-02T09:00:00", "2025-01-02T14:59:00"]) == [ns("2025-01-02T00:00:00")] * 2
+
+
+def test_night_session_next_day():
+    """夜盘(含跨零点部分)属于下一交易日"""
+    assert days_of(["2025-01-01T21:00:00", "2025-01-02T01:30:00"]) == [ns("2025-01-02T00:00:00")] * 2
+
+
+def test_friday_night_belongs_to_monday():
+    """周五夜盘及周六凌晨部分属于下周一"""
+    monday = ns("2025-01-06T00:00:00")
+    assert days_of(["2025-01-03T21:00:00", "2025-01-04T02:00:00"]) == [monday, monday]
+
+
+def test_exchange_without_night_session():
+    """无夜盘的交易所不做夜盘归属"""
+    assert days_of(["2025-01-03T21:00:00"], "CFFEX") == [ns("2025-01-03T00:00:00")]
+
+
+def test_resample_intraday_ohlcv():
+    """日内周期按北京时间整数倍对齐,开高低收量按规则聚合"""
+    times = np.array([ns(f"2025-01-02T09:{m:02d}:00") for m in range(7)])
+    klines = {
+        "datetime": times,
+        "open": np.arange(7, dtype=float) + 10,
+        "high": np.array([11, 15, 12, 13, 14, 16, 12], dtype=float),
+        "low": np.array([9, 8, 10, 7, 9, 11, 10], dtype=float),
+        "close": np.arange(7, dtype=float) + 20,
+        "volume": np.ones(7),
+    }
+    bars = resample(klines, 300, "SHFE")
+
+    assert bars["datetime"].tolist() == [ns("2025-01-02T09:00:00"), ns("2025-01-02T09:05:00")]
+    assert bars["open"].tolist() == [10, 15]
+    assert bars["high"].tolist() == [15, 16]
+    assert bars["low"].tolist() == [7, 10]
+    assert bars["close"].tolist() == [24, 26]
+    assert bars["volume"].tolist() == [5, 2]
+
+
+def test_resample_empty():
+    """空输入返回同字段的空数组"""
+    bars = resample({"datetime": np.array([], dtype=np.int64), "volume": np.array([])}, DAY, "SHFE")
+
+    assert {column: len(values) for column, values in bars.items()} == {"datetime": 0, "volume": 0}
+
+
+def test_can_resample():
+    """只有整分钟且能整除一天的周期和日线可以本地合成"""
+    assert can_resample(300)
+    assert can_resample(DAY)
+    assert not can_resample(60)
+    assert not can_resample(420)
+    assert not can_resample(90)
+
+
+def test_exchange_of():
+    """合约代码和主连代码都能取到交易所"""
+    assert exchange_of("SHFE.rb2505") == "SHFE"
+    assert exchange_of("KQ.m@CZCE.TA") == "CZCE"
@@ -0,0 +1,100 @@
+"""
+本地K线存储测试(services/kline_store.py)
+"""
+import numpy as np
+import pytest
+
+from services.kline_store import KlineStore
+
+SYMBOL = "SHFE.rb2505"
+
+
+def bars(times, volume=1):
+    times = np.asarray(times, dtype=np.float64)
+    return {
+        "datetime": times,
+        "open": times + 0.5,
+        "high": times + 1,
+        "low": times - 1,
+        "close": times + 0.25,
+        "volume": np.full(len(times), volume),
+    }
+
+
+def stored_times(store, source=""):
+    return store.tail(SYMBOL, 60, 100, source=source)["datetime"].tolist()
+
+
+def test_append_newer_and_ignore_stored(tmp_path):
+    """比最后一根新的K线追加,已存时间的K线不覆盖"""
+    store = KlineStore(str(tmp_path))
+    assert store.save(SYMBOL, 60, bars([1, 2, 3])) == 3
+    assert store.save(SYMBOL, 60, {**bars([3, 4]), "close": np.array([99.0, 4.25])}) == 1
+
+    assert stored_times(store) == [1, 2, 3, 4]
+    assert store.tail(SYMBOL, 60, 2)["close"].tolist() == [3.25, 4.25]
+
+
+def test_merge_older_history(tmp_path):
+    """比第一根更早的K线按时间合并"""
+    store = KlineStore(str(tmp_path))
+    store.save(SYMBOL, 60, bars([5, 6]))
+
+    assert store.save(SYMBOL, 60, bars([3, 4, 5])) == 2
+    assert stored_times(store) == [3, 4, 5, 6]
+    assert store.tail(SYMBOL, 60, 100)["open"].tolist() == [3.5, 4.5, 5.5, 6.5]
+
+
+def test_fill_gap_and_append_in_one_save(tmp_path):
+    """落在空缺处的K线补入,同一批中更新的K线一并保存"""
+    store = KlineStore(str(tmp_path))
+    store.save(SYMBOL, 60, bars([1, 2, 5, 6]))
+
+    assert store.save(SYMBOL, 60, bars([2, 3, 4, 7])) == 3
+    assert stored_times(store) == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_skips_empty_and_zero_volume_bars(tmp_path):
+    """时间为NaN和成交量为0的K线不保存"""
+    store = KlineStore(str(tmp_path))
+    klines = bars([1, np.nan, 3])
+    klines["volume"] = np.array([1, 1, 0])
+
+    assert store.save(SYMBOL, 60, klines) == 1
+    assert stored_times(store) == [1]
+
+
+def test_range_query(tmp_path):
+    """区间两端都包含,limit取区间内最近的K线"""
+    store = KlineStore(str(tmp_path))
+    store.save(SYMBOL, 60, bars([1, 2, 3, 4, 5]))
+    kline_file = store.file(SYMBOL, 60)
+
+    assert kline_file.range(start=2, end=4)["datetime"].tolist() == [2, 3, 4]
+    assert kline_file.range(start=2, end=4, limit=2)["datetime"].tolist() == [3, 4]
+    assert kline_file.last_time() == 5
+
+
+def test_sources_are_separate(tmp_path):
+    """合成K线与天勤K线分开存放,互不遮挡"""
+    store = KlineStore(str(tmp_path))
+    store.save(SYMBOL, 60, bars([1, 2]))
+    store.save(SYMBOL, 60, bars([2, 3]), source="tick")
+
+    assert stored_times(store) == [1, 2]
+    assert stored_times(store, "tick") == [2, 3]
+    with pytest.raises(ValueError):
+        store.file(SYMBOL, 60, source="../x")
+
+
+def test_truncates_torn_columns(tmp_path):
+    """写入中断导致列长度不一致时以最短列为准,下次写入前截齐"""
+    store = KlineStore(str(tmp_path))
+    store.save(SYMBOL, 60, bars([1, 2]))
+    kline_file = store.file(SYMBOL, 60)
+    with open(kline_file._path("close"), "ab") as f:
+        f.write(np.array([9.0]).tobytes())
+
+    assert len(kline_file) == 2
+    assert store.save(SYMBOL, 60, bars([3])) == 1
+    assert store.tail(SYMBOL, 60, 100)["close"].tolist() == [1.25, 2.25, 3.25]
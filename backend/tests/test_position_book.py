@@ -0,0 +1,108 @@
+"""
+持仓列式簿记测试(engines/position_book.py)
+"""
+import numpy as np
+
+from engines.position_book import PositionBook
+
+TQ = {"ZCE|F|TA|505": "CZCE.TA505", "SHFE|F|RB|2505": "SHFE.rb2505"}
+
+
+def position(position_id, account_id, symbol, long_position=0, long_avg_price=None,
+             short_position=0, short_avg_price=None, last_price=None):
+    return {
+        "id": position_id, "account_id": account_id, "symbol": symbol,
+        "long_position": long_position, "long_avg_price": long_avg_price,
+        "short_position": short_position, "short_avg_price": short_avg_price,
+        "last_price": last_price, "long_profit": 0, "short_profit": 0
+    }
+
+
+def load(rows):
+    book = PositionBook()
+    book.load(rows, TQ.get, lambda symbol: 5 if symbol.startswith("ZCE") else 10,
+              lambda symbol: 2.0 if symbol.startswith("ZCE") else 1.0)
+    return book
+
+
+def test_load_skips_unmapped_symbols():
+    """无法转换为天勤代码的持仓不进入簿记,同一合约共用合约表下标"""
+    book = load([
+        position("p1", "a", "ZCE|F|TA|505", 1, 5000),
+        position("p2", "b", "ZCE|F|TA|505", 2, 5002),
+        position("p3", "a", "DCE|F|X|1", 1, 100),
+    ])
+
+    assert book.ids == ["p1", "p2"]
+    assert book.tq_symbols == ["CZCE.TA505"]
+    assert book.symbol_index.tolist() == [0, 0]
+
+
+def test_mark_long_and_short_profit():
+    """按合约最新价计算多空浮盈,只有变化的行标记为待写"""
+    book = load([
+        position("p1", "a", "ZCE|F|TA|505", long_position=2, long_avg_price=5000),
+        position("p2", "a", "SHFE|F|RB|2505", short_position=1, short_avg_price=3500),
+    ])
+    prices = book.price_vector({"CZCE.TA505": {"last_price": 5010.0}, "SHFE.rb2505": {"last_price": 3490.0}})
+
+    assert book.mark(prices).tolist() == [0, 1]
+    assert book.long_profit.tolist() == [100.0, 0.0]
+    assert book.short_profit.tolist() == [0.0, 100.0]
+    assert book.mark(prices).tolist() == []
+
+
+def test_mark_ignores_missing_quotes():
+    """无行情的合约不计算、不标记"""
+    book = load([position("p1", "a", "ZCE|F|TA|505", long_position=1, long_avg_price=5000)])
+
+    assert book.mark(book.price_vector({})).tolist() == []
+    assert not book.dirty.any()
+
+
+def test_rows_for_and_due():
+    """按合约取持仓行;待写行按间隔限频"""
+    book = load([
+        position("p1", "a", "ZCE|F|TA|505", 1, 5000),
+        position("p2", "a", "SHFE|F|RB|2505", 1, 3500),
+        position("p3", "b", "ZCE|F|TA|505", 1, 5000),
+    ])
+    rows = book.rows_for(["CZCE.TA505", "DCE.m2505"])
+    assert sorted(rows.tolist()) == [0, 2]
+
+    book.mark(book.price_vector({"CZCE.TA505": {"last_price": 5004.0}}), rows)
+    assert book.due(now=100.0, interval=1.0).tolist() == [0, 2]
+    book.mark_written(np.array([0]), now=100.0)
+    assert book.due(now=100.5, interval=1.0).tolist() == [2]
+
+
+def test_upsert_updates_and_appends():
+    """已有持仓更新持仓量和均价,新持仓(含新合约)追加一行"""
+    book = load([position("p1", "a", "ZCE|F|TA|505", 1, 5000)])
+
+    assert book.upsert(position("p1", "a", "ZCE|F|TA|505", 3, 5002)) == 0
+    assert book.long_volume.tolist() == [3]
+    assert book.upsert(position("p2", "a", "SHFE|F|RB|2505", short_position=1, short_avg_price=3500)) == 1
+    assert book.tq_symbols == ["CZCE.TA505", "SHFE.rb2505"]
+    assert book.rows_for(["SHFE.rb2505"]).tolist() == [1]
+    assert book.upsert(position("p3", "a", "DCE|F|X|1", 1, 100)) is None
+
+
+def test_remove_account_compacts_rows_and_symbols():
+    """移除账户的持仓行,合约表只保留仍有持仓的合约,其余行的状态不变"""
+    book = load([
+        position("p1", "a", "ZCE|F|TA|505", long_position=1, long_avg_price=5000),
+        position("p2", "b", "SHFE|F|RB|2505", long_position=1, long_avg_price=3500),
+        position("p3", "a", "SHFE|F|RB|2505", long_position=1, long_avg_price=3500),
+    ])
+    book.mark(book.price_vector({"SHFE.rb2505": {"last_price": 3510.0}}))
+
+    assert book.remove_account("a") == 2
+    assert book.ids == ["p2"]
+    assert book.tq_symbols == ["SHFE.rb2505"]
+    assert book.symbol_index.tolist() == [0]
+    assert book.long_profit.tolist() == [100.0]
+    assert book.dirty.tolist() == [True]
+    assert book.rows_for(["SHFE.rb2505"]).tolist() == [0]
+    assert book.upsert(position("p2", "b", "SHFE|F|RB|2505", 2, 3505)) == 0
+    assert book.remove_account("a") == 0
@@ -0,0 +1,149 @@
+"""
+持仓检查点测试(engines/position_engine.py CheckpointReplayer, engines/position_checkpoints.py)
+"""
+import asyncio
+
+from engines.position_checkpoints import CheckpointStore
+from engines.position_engine import CheckpointReplayer, PositionState, replay_trades
+
+
+def trade(n, timestamp, direction="buy", offset="open", volume=1, price=3500):
+    return {
+        "id": f"t{n:03d}",
+        "direction": direction,
+        "offset": offset,
+        "volume": volume,
+        "price": price,
+        "timestamp": timestamp
+    }
+
+
+def day_trades(count, day="2025-01-02", start=0):
+    return [trade(start + i, f"{day}T09:{i:02d}:00") for i in range(count)]
+
+
+def test_checkpoint_every_n_trades():
+    """每满every笔生成检查点,最终状态与直接重放一致"""
+    trades = day_trades(5)
+    replayer = CheckpointReplayer(tick=1.0, every=2)
+    replayer.feed(trades)
+
+    assert [c.trade_count for c in replayer.checkpoints] == [2, 4]
+    assert [c.last_trade_id for c in replayer.checkpoints] == ["t001", "t003"]
+    assert replayer.state.same_as(replay_trades(trades, tick=1.0))
+    assert replayer.replayed == 5
+
+
+def test_checkpoint_on_trading_day_switch():
+    """夜盘成交属于下一交易日,切换前生成上一交易日收盘的检查点"""
+    trades = [
+        trade(0, "2025-01-02T09:00:00"),
+        trade(1, "2025-01-02T14:59:00"),
+        trade(2, "2025-01-02T21:00:00"),  # 2025-01-03交易日
+        trade(3, "2025-01-03T09:00:00"),
+    ]
+    replayer = CheckpointReplayer(tick=1.0, every=100)
+    replayer.feed(trades)
+
+    assert [c.last_trade_id for c in replayer.checkpoints] == ["t001"]
+    assert replayer.state.trade_count == 4
+
+
+def test_checkpoint_day_switch_on_interval_boundary():
+    """间隔检查点恰好落在交易日末尾时不重复生成"""
+    trades = day_trades(2) + day_trades(1, day="2025-01-03", start=2)
+    replayer = CheckpointReplayer(tick=1.0, every=2)
+    replayer.feed(trades)
+
+    assert [c.trade_count for c in replayer.checkpoints] == [2]
+
+
+def test_checkpoint_state_continues_across_pages():
+    """分页喂入与一次喂入生成相同的检查点"""
+    trades = day_trades(3) + day_trades(4, day="2025-01-03", start=3)
+    whole = CheckpointReplayer(tick=1.0, every=3)
+    whole.feed(trades)
+
+    paged = CheckpointReplayer(tick=1.0, every=3)
+    for i in range(0, len(trades), 2):
+        paged.feed(trades[i:i + 2])
+
+    assert [c.last_trade_id for c in paged.checkpoints] == [c.last_trade_id for c in whole.checkpoints]
+    assert paged.state.same_as(whole.state)
+
+
+def test_checkpoint_resumes_from_restored_state():
+    """从检查点恢复后,间隔按累计成交笔数延续,不重复生成起始检查点"""
+    start = replay_trades(day_trades(3), tick=1.0)
+    replayer = CheckpointReplayer(start, every=4)
+    replayer.feed(day_trades(3, start=3))
+
+    assert [c.trade_count for c in replayer.checkpoints] == [4]
+    assert replayer.state.trade_count == 6
+    assert start.trade_count == 3  # 起始状态不被修改
+
+
+class FakeDatabase:
+    """只实现检查点查询/删除的内存数据库"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.deleted = []
+
+    async def select(self, table, columns="*", filters=None, order=(), limit=None):
+        rows = sorted(
+            self.rows, key=lambda row: (row["last_trade_time"], row["last_trade_id"]), reverse=True
+        )
+        return rows[:limit]
+
+    async def delete(self, table, filters):
+        self.deleted.append(filters["id"])
+        self.rows = [row for row in self.rows if row["id"] != filters["id"]]
+        return [filters]
+
+
+def checkpoint_row(n, trade_count, price_tick=1.0):
+    state = PositionState(
+        long_position=1, long_avg=35000000, last_trade_id=f"t{n:03d}",
+        last_trade_time=f"2025-01-02T09:{n:02d}:00", tick=price_tick, trade_count=trade_count
+    )
+    return {"id": f"c{n}", **state.to_checkpoint("a", "SHFE|F|RB|2505")}
+
+
+def latest_valid(rows, counts, price_tick=1.0):
+    """counts: {水位成交ID: 数据库中水位之前(含)的成交笔数}"""
+    store = CheckpointStore(FakeDatabase(rows))
+
+    async def count_through(account_id, symbol, trade_time, trade_id):
+        return counts[trade_id]
+
+    store._count_through = count_through
+    return store, asyncio.run(store.latest_valid("a", "SHFE|F|RB|2505", price_tick))
+
+
+def test_latest_valid_returns_matching_count():
+    """成交笔数一致的最近检查点有效"""
+    store, row = latest_valid(
+        [checkpoint_row(1, 2), checkpoint_row(3, 4)], {"t003": 4, "t001": 2}
+    )
+
+    assert row["id"] == "c3"
+    assert store.db.deleted == []
+
+
+def test_latest_valid_deletes_stale_checkpoints():
+    """补录成交后笔数不一致的检查点被删除,回退到更早的有效检查点"""
+    store, row = latest_valid(
+        [checkpoint_row(1, 2), checkpoint_row(3, 4)], {"t003": 5, "t001": 2}
+    )
+
+    assert row["id"] == "c1"
+    assert store.db.deleted == ["c3"]
+
+
+def test_latest_valid_skips_other_price_tick():
+    """最小变动价位变化后定点均价不可用,跳过但不删除"""
+    store, row = latest_valid([checkpoint_row(1, 2, price_tick=0.5)], {"t001": 2})
+
+    assert row is None
+    assert store.db.deleted == []
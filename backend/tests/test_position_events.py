@@ -0,0 +1,75 @@
+"""
+持仓变更通知测试(services/position_events.py)
+"""
+import asyncio
+import json
+
+from services.position_events import (
+    FIELDS, MAX_PAYLOAD_BYTES, POSITIONS_CHANNEL, PositionPublisher, decode, encode
+)
+
+
+def position(n):
+    return {
+        "id": f"{n:08d}-0000-0000-0000-000000000000", "account_id": "a", "symbol": "ZCE|F|TA|505",
+        "long_position": n, "long_avg_price": 5000.5, "short_position": 0, "short_avg_price": None,
+        "last_price": None, "long_profit": 0, "short_profit": 0, "updated_at": "2025-01-02T09:00:00"
+    }
+
+
+def test_encode_keeps_book_fields_only():
+    """payload只含持仓簿记需要的字段,往返后一致"""
+    payloads = encode([position(1)])
+
+    assert len(payloads) == 1
+    assert decode(payloads[0]) == [{field: position(1)[field] for field in FIELDS}]
+
+
+def test_encode_splits_large_batches():
+    """变更较多时拆成多条,每条不超过上限且都是合法JSON"""
+    positions = [position(n) for n in range(200)]
+    payloads = encode(positions)
+
+    assert len(payloads) > 1
+    assert all(len(payload) <= MAX_PAYLOAD_BYTES for payload in payloads)
+    assert [row["long_position"] for payload in payloads for row in decode(payload)] == list(range(200))
+    assert encode([]) == []
+
+
+class FakeDatabase:
+    def __init__(self, sent=True):
+        self.sent = sent
+        self.notified = []
+
+    async def notify(self, channel, payload):
+        if isinstance(self.sent, Exception):
+            raise self.sent
+        self.notified.append((channel, payload))
+        return self.sent
+
+
+def publish(db, positions):
+    publisher = PositionPublisher(db)
+
+    async def run():
+        publisher(positions)
+        await asyncio.gather(*publisher._tasks)
+
+    asyncio.run(run())
+    return publisher
+
+
+def test_publisher_notifies_channel():
+    """回调不阻塞,后台发送到持仓通道"""
+    db = FakeDatabase()
+    publisher = publish(db, [position(1)])
+
+    assert [channel for channel, _ in db.notified] == [POSITIONS_CHANNEL]
+    assert json.loads(db.notified[0][1])[0]["long_position"] == 1
+    assert publisher.stats() == {"published": 1, "unsent": 0, "pending": 0}
+
+
+def test_publisher_counts_unsent():
+    """连接池不可用或发送失败时计入unsent"""
+    assert publish(FakeDatabase(sent=False), [position(1)]).unsent == 1
+    assert publish(FakeDatabase(sent=ConnectionError("closed")), [position(1)]).unsent == 1
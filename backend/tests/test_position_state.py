@@ -0,0 +1,117 @@
+"""
+持仓状态测试(engines/position_engine.py PositionState)
+"""
+from engines.position_engine import PositionState
+from utils import fixed_point as fp
+
+
+def trade(trade_id, direction, offset, volume, price, timestamp="2025-01-02T09:00:00"):
+    return {
+        "id": trade_id,
+        "direction": direction,
+        "offset": offset,
+        "volume": volume,
+        "price": price,
+        "timestamp": timestamp
+    }
+
+
+def test_apply_many_open_weighted_average():
+    """开仓按定点加权平均,与fp.weighted_average一致"""
+    state = PositionState(tick=1.0)
+    state.apply_many([
+        trade("t1", "buy", "open", 1, 3500),
+        trade("t2", "buy", "open", 2, 3503),
+    ])
+
+    expected = fp.weighted_average(
+        fp.to_fixed(3500, 1.0), 1, fp.to_fixed(3503, 1.0), 2
+    )
+    assert state.long_position == 3
+    assert state.long_avg == expected
+    assert state.long_avg_price == 3502.0
+
+
+def test_apply_many_close_keeps_average_until_flat():
+    """平仓只减仓位不改均价,平完后均价归零,超量平仓不出现负仓位"""
+    state = PositionState(tick=1.0)
+    state.apply_many([
+        trade("t1", "sell", "open", 3, 3500),
+        trade("t2", "buy", "close", 1, 3490),
+    ])
+    assert state.short_position == 2
+    assert state.short_avg_price == 3500.0
+
+    state.apply_many([trade("t3", "buy", "close", 5, 3480)])
+    assert state.short_position == 0
+    assert state.short_avg == 0
+    assert state.long_position == 0
+
+
+def test_apply_many_updates_watermark_and_count():
+    """水位取最后一笔成交,成交笔数累加"""
+    state = PositionState(tick=1.0, trade_count=10)
+    state.apply_many([
+        trade("t1", "buy", "open", 1, 3500, "2025-01-02T09:00:00"),
+        trade("t2", "sell", "close", 1, 3510, "2025-01-02T09:01:00"),
+    ])
+
+    assert state.last_trade_id == "t2"
+    assert state.last_trade_time == "2025-01-02T09:01:00"
+    assert state.trade_count == 12
+
+
+def test_apply_many_matches_single_apply():
+    """整批叠加与逐笔叠加结果相同"""
+    trades = [
+        trade("t1", "buy", "open", 2, 4567.8),
+        trade("t2", "sell", "open", 1, 4570.2),
+        trade("t3", "buy", "open", 3, 4566.4),
+        trade("t4", "sell", "close", 4, 4571.0),
+        trade("t5", "buy", "close", 1, 4569.6),
+    ]
+    batch = PositionState(tick=0.2)
+    batch.apply_many(trades)
+    single = PositionState(tick=0.2)
+    for item in trades:
+        single.apply(item)
+
+    assert batch.same_as(single)
+    assert batch.long_position == 1
+    assert batch.short_position == 0
+
+
+def test_apply_many_empty_batch():
+    """空批次不改变状态"""
+    state = PositionState(long_position=1, long_avg=100, last_trade_id="t1", trade_count=1)
+    state.apply_many([])
+
+    assert state.same_as(PositionState(long_position=1, long_avg=100, last_trade_id="t1", trade_count=1))
+
+
+def test_can_append_after_watermark():
+    """水位之后的成交(时间更晚,或同一时间ID更大)可以直接叠加"""
+    state = PositionState(last_trade_id="t5", last_trade_time="2025-01-02T09:00:00")
+
+    assert state.can_append([trade("t9", "buy", "open", 1, 1, "2025-01-02T09:00:01")])
+    assert state.can_append([trade("t6", "buy", "open", 1, 1, "2025-01-02T09:00:00")])
+    assert state.can_append([])
+
+
+def test_can_append_rejects_backfill_and_duplicates():
+    """早于水位的补录成交和已计入的成交需要重建"""
+    state = PositionState(last_trade_id="t5", last_trade_time="2025-01-02T09:00:00")
+
+    assert not state.can_append([trade("t9", "buy", "open", 1, 1, "2025-01-02T08:59:59")])
+    assert not state.can_append([trade("t5", "buy", "open", 1, 1, "2025-01-02T09:00:00")])
+    assert not state.can_append([trade("t4", "buy", "open", 1, 1, "2025-01-02T09:00:00")])
+    assert not state.can_append([
+        trade("t9", "buy", "open", 1, 1, "2025-01-02T09:00:01"),
+        trade("t1", "buy", "open", 1, 1, "2025-01-02T08:00:00"),
+    ])
+
+
+def test_can_append_requires_watermark():
+    """没有水位(未从数据库恢复)时不能增量叠加"""
+    assert not PositionState().can_append([trade("t1", "buy", "open", 1, 1)])
+    assert not PositionState(last_trade_id="t1").can_append([trade("t2", "buy", "open", 1, 1)])
@@ -0,0 +1,96 @@
+"""
+进程内发布订阅测试(utils/pubsub.py)
+
+订阅对象需在事件循环中创建(与WebSocket连接中的用法一致)
+"""
+import asyncio
+import time
+
+from utils.pubsub import ConflatedSubscription, PubSub, Subscription
+
+
+def test_conflated_merges_pending_fields():
+    """未取走的变化按键合并,字段取最新值,被覆盖的旧值计入dropped"""
+    async def run():
+        subscription = ConflatedSubscription("a", min_interval=0)
+        subscription.put({"p1": {"last_price": 1, "profit": 10}})
+        subscription.put({"p1": {"last_price": 2}, "p2": {"last_price": 5}})
+        subscription.put({"p1": {"last_price": 3, "volume": 4}})
+        pending = len(subscription)
+        return subscription, pending, await subscription.get()
+
+    subscription, pending, merged = asyncio.run(run())
+    assert pending == 2
+    assert subscription.dropped == 2
+    assert subscription.conflated == 2
+    assert merged == {
+        "p1": {"last_price": 3, "profit": 10, "volume": 4},
+        "p2": {"last_price": 5}
+    }
+    assert len(subscription) == 0
+
+
+def test_conflated_does_not_alias_message():
+    """合并不修改发布方的消息(同一消息分发给多个订阅者)"""
+    message = {"p1": {"last_price": 1}}
+
+    async def run():
+        subscription = ConflatedSubscription("a", min_interval=0)
+        subscription.put(message)
+        subscription.put({"p1": {"last_price": 2}})
+
+    asyncio.run(run())
+    assert message == {"p1": {"last_price": 1}}
+
+
+def test_conflated_get_respects_min_interval():
+    """两次取出至少间隔min_interval秒,等待期间的变化并入下一次取出"""
+    async def run():
+        subscription = ConflatedSubscription("a", min_interval=0.05)
+        subscription.put({"p1": {"last_price": 1}})
+        first = await subscription.get()
+        subscription.put({"p1": {"last_price": 2}})
+        started = time.monotonic()
+        waiting = asyncio.create_task(subscription.get())
+        await asyncio.sleep(0)
+        subscription.put({"p1": {"last_price": 3}})
+        return first, await waiting, time.monotonic() - started
+
+    first, second, elapsed = asyncio.run(run())
+    assert first == {"p1": {"last_price": 1}}
+    assert second == {"p1": {"last_price": 3}}
+    assert elapsed >= 0.04
+
+
+def test_queue_drops_oldest_when_full():
+    """队列订阅满时丢弃最早的消息"""
+    async def run():
+        subscription = Subscription("a", max_size=2)
+        for n in range(3):
+            subscription.put(n)
+        return subscription, await subscription.get()
+
+    subscription, first = asyncio.run(run())
+    assert subscription.dropped == 1
+    assert first == 1
+
+
+def test_pubsub_routes_by_topic():
+    """按主题分发,两种订阅方式共存,最后一个订阅者退订后移除主题"""
+    async def run():
+        hub = PubSub(max_queue=10)
+        queue = hub.subscribe("a")
+        conflated = hub.subscribe("a", min_interval=0)
+        other = hub.subscribe("b")
+
+        assert hub.publish("a", {"p1": {"last_price": 1}}) == 2
+        assert (len(queue), len(conflated), len(other)) == (1, 1, 0)
+
+        hub.unsubscribe(queue)
+        hub.unsubscribe(conflated)
+        return hub
+
+    hub = asyncio.run(run())
+    assert not hub.has_subscribers("a")
+    assert hub.publish("a", {}) == 0
+    assert hub.stats()["topics"] == 1
@@ -0,0 +1,92 @@
+"""
+最新行情共享表测试(utils/quote_table.py)
+"""
+import time
+
+from utils import quote_table
+from utils.quote_table import MAX_READ_RETRIES, QuoteTable
+
+SYMBOL = "SHFE.rb2505"
+
+
+def open_pair(tmp_path, capacity=8):
+    path = str(tmp_path / "quotes.bin")
+    writer = QuoteTable.create(path, capacity)
+    return writer, QuoteTable.open(path)
+
+
+def test_reader_sees_writer_updates(tmp_path):
+    """只写出现的字段,浮点NaN读为None"""
+    writer, reader = open_pair(tmp_path)
+    writer.update(SYMBOL, {"last_price": 3500.0, "volume": 10, "datetime": "2025-01-02 09:00:00.000000"})
+    writer.update(SYMBOL, {"last_price": 3501.0})
+
+    quote = reader.get(SYMBOL)
+    assert quote["last_price"] == 3501.0
+    assert quote["volume"] == 10
+    assert quote["datetime"] == "2025-01-02 09:00:00.000000"
+    assert quote["bid_price1"] is None
+    assert reader.get("SHFE.hc2505") is None
+
+
+def test_read_retries_while_row_is_written(tmp_path):
+    """seq为奇数(写入中)时重试,超过最大重试次数返回None"""
+    writer, reader = open_pair(tmp_path)
+    writer.update(SYMBOL, {"last_price": 3500.0})
+    writer._rows["seq"][0] += 1
+
+    assert reader.get(SYMBOL) is None
+    assert reader.retries == MAX_READ_RETRIES
+
+    writer._rows["seq"][0] += 1
+    assert reader.get(SYMBOL)["last_price"] == 3500.0
+
+
+def test_get_many_keeps_order_and_retries_torn_rows(tmp_path):
+    """批量读取与输入顺序一一对应,只有写入中的行单独重试"""
+    writer, reader = open_pair(tmp_path)
+    writer.update("SHFE.rb2505", {"last_price": 3500.0})
+    writer.update("SHFE.hc2505", {"last_price": 3300.0})
+    writer._rows["seq"][1] += 1
+
+    quotes = reader.get_many(["SHFE.hc2505", "DCE.m2505", "SHFE.rb2505"])
+    assert quotes[0] is None
+    assert quotes[1] is None
+    assert quotes[2]["last_price"] == 3500.0
+    assert reader.retries == MAX_READ_RETRIES + 1
+
+
+def test_reader_indexes_symbols_added_later(tmp_path):
+    """读取方打开后写入的新合约按需加入索引"""
+    writer, reader = open_pair(tmp_path)
+    writer.update(SYMBOL, {"last_price": 3500.0})
+    assert reader.symbols() == [SYMBOL]
+
+    writer.update("SHFE.hc2505", {"last_price": 3300.0})
+    assert reader.get("SHFE.hc2505")["last_price"] == 3300.0
+
+
+def test_is_stale_follows_heartbeat(tmp_path):
+    """从未心跳或心跳超时视为过期"""
+    writer, reader = open_pair(tmp_path)
+    assert reader.is_stale(max_age=10)
+
+    writer.heartbeat()
+    assert not reader.is_stale(max_age=10)
+
+    writer._header["heartbeat"] = time.time() - 60
+    assert reader.is_stale(max_age=10)
+    assert reader.stats()["stale"]
+
+
+def test_get_quote_table_rejects_stale(tmp_path, monkeypatch):
+    """心跳超时的共享表默认不返回,allow_stale时仍可取得"""
+    writer, _ = open_pair(tmp_path)
+    monkeypatch.setattr(quote_table.settings, "quote_table_path", writer.path)
+    monkeypatch.setattr(quote_table, "_quote_table", None)
+
+    assert quote_table.get_quote_table() is None
+    assert quote_table.get_quote_table(allow_stale=True) is not None
+
+    writer.heartbeat()
+    assert quote_table.get_quote_table() is not None
@@ -0,0 +1,122 @@
+"""
+成交预写日志测试(services/trade_journal.py)
+"""
+import asyncio
+import json
+
+from models.schemas import TradeEvent
+from services.trade_journal import JournalEntry, TradeJournal
+
+
+class FakeIngest:
+    """记录每次批量写入的成交和ID,按需失败"""
+
+    def __init__(self, failures=0, statuses=None):
+        self.failures = failures
+        self.statuses = statuses or {}
+        self.batches = []
+
+    async def ingest_batch(self, trades, ids=None):
+        self.batches.append((list(trades), list(ids)))
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("timeout")
+        return [{"status": self.statuses.get(trade.order_id, "ok")} for trade in trades]
+
+
+def event(n):
+    return TradeEvent(
+        account_id="85178443", symbol="ZCE|F|TA|2505", direction="buy", offset="open",
+        volume=1, price=5500.0, order_id=f"o{n}", timestamp="2025-01-02T09:00:00"
+    )
+
+
+def write_journal(path, seqs, checkpoint=None, torn=False):
+    with open(path, "w", encoding="utf-8") as f:
+        for seq in seqs:
+            record = {"seq": seq, "ts": 1700000000.0 + seq, "trade": event(seq).model_dump(mode="json")}
+            f.write(json.dumps(record) + "\n")
+        if torn:
+            f.write('{"seq": 99, "ts"')
+    if checkpoint is not None:
+        with open(f"{path}.ckpt", "w", encoding="utf-8") as f:
+            f.write(str(checkpoint))
+
+
+def test_recover_replays_after_checkpoint(tmp_path):
+    """重启时重放检查点之后的成交,忽略崩溃时写了一半的行,序号接续"""
+    path = str(tmp_path / "trades.journal")
+    write_journal(path, [1, 2, 3, 4], checkpoint=2, torn=True)
+    ingest = FakeIngest()
+    journal = TradeJournal(ingest, path)
+
+    async def run():
+        await journal.start()
+        await journal.stop()
+
+    asyncio.run(run())
+    flushed = [trade.order_id for trades, _ in ingest.batches for trade in trades]
+    assert flushed == ["o3", "o4"]
+    assert journal.replayed == 2
+    assert journal.stats()["next_seq"] == 5
+    with open(f"{path}.ckpt", encoding="utf-8") as f:
+        assert f.read() == "4"
+
+
+def test_recover_without_checkpoint(tmp_path):
+    """没有检查点文件时重放全部成交"""
+    path = str(tmp_path / "trades.journal")
+    write_journal(path, [1, 2])
+    journal = TradeJournal(FakeIngest(), path)
+    journal._recover()
+
+    assert [entry.seq for entry in journal._pending] == [1, 2]
+
+
+def test_retry_reuses_trade_ids(tmp_path):
+    """刷写失败后重试使用相同的成交ID,成交保留在队列中"""
+    path = str(tmp_path / "trades.journal")
+    write_journal(path, [1, 2])
+    ingest = FakeIngest(failures=1)
+    journal = TradeJournal(ingest, path, flush_interval=60)
+
+    async def run():
+        await journal.start()
+        try:
+            await journal._flush_once()
+        except ConnectionError:
+            pass
+        assert len(journal._pending) == 2
+        flushed = await journal._flush_once()
+        await journal.stop()
+        return flushed
+
+    assert asyncio.run(run())
+    first_ids, retry_ids = ingest.batches[0][1], ingest.batches[1][1]
+    assert first_ids == retry_ids
+    assert len(set(first_ids)) == 2
+    assert not journal._pending
+
+
+def test_account_not_found_is_dropped(tmp_path):
+    """账户不存在的成交不再重试,计入dropped"""
+    path = str(tmp_path / "trades.journal")
+    write_journal(path, [1, 2])
+    journal = TradeJournal(FakeIngest(statuses={"o1": "account_not_found"}), path)
+
+    async def run():
+        await journal.start()
+        await journal.stop()
+
+    asyncio.run(run())
+    assert journal.dropped == 1
+    assert journal.flushed == 2
+
+
+def test_trade_id_depends_on_seq_and_time():
+    """成交ID由序号和追加时间确定"""
+    trade = event(1)
+
+    assert JournalEntry(1, 100.0, trade).trade_id == JournalEntry(1, 100.0, trade).trade_id
+    assert JournalEntry(1, 100.0, trade).trade_id != JournalEntry(2, 100.0, trade).trade_id
+    assert JournalEntry(1, 100.0, trade).trade_id != JournalEntry(1, 200.0, trade).trade_id
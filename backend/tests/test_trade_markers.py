@@ -0,0 +1,91 @@
+"""
+成交标记测试(services/kline_service.py trade_markers)
+"""
+from datetime import datetime
+
+from services.kline_service import trade_markers
+from services.market_event_pump import EXCHANGE_TZ
+
+MINUTE = 60
+DAY = 86400
+
+
+def epoch(value: str) -> int:
+    """交易所本地时间 → epoch秒"""
+    return int(datetime.fromisoformat(value).replace(tzinfo=EXCHANGE_TZ).timestamp())
+
+
+def fill(timestamp, direction, volume, price):
+    return {"timestamp": timestamp, "direction": direction, "volume": volume, "price": price}
+
+
+BARS = [epoch("2025-01-02T09:00:00") + i * MINUTE for i in range(3)]
+
+
+def test_snaps_fills_to_bar_start():
+    """成交吸附到所属K线的起始时间"""
+    markers = trade_markers(BARS, [
+        fill("2025-01-02T09:00:59", "buy", 1, 3500),
+        fill("2025-01-02T09:02:00", "sell", 2, 3510),
+    ], MINUTE, "SHFE")
+
+    assert [m["time"] for m in markers] == [BARS[0], BARS[2]]
+    assert [m["shape"] for m in markers] == ["arrowUp", "arrowDown"]
+    assert markers[1]["text"] == "sell 2手 @3510.0"
+
+
+def test_drops_fills_outside_window():
+    """首根K线之前和末根K线结束之后的成交不生成标记"""
+    markers = trade_markers(BARS, [
+        fill("2025-01-02T08:59:59", "buy", 1, 3500),
+        fill("2025-01-02T09:03:00", "buy", 1, 3500),
+    ], MINUTE, "SHFE")
+
+    assert markers == []
+
+
+def test_merges_fills_in_bar_with_vwap():
+    """同一根K线内的成交合并为净手数和成交均价"""
+    markers = trade_markers(BARS, [
+        fill("2025-01-02T09:01:05", "buy", 1, 3500),
+        fill("2025-01-02T09:01:10", "buy", 3, 3504),
+        fill("2025-01-02T09:01:20", "sell", 1, 3510),
+    ], MINUTE, "SHFE")
+
+    assert len(markers) == 1
+    # VWAP = (3500 + 3504 * 3 + 3510) / 5
+    assert markers[0]["text"] == "buy 3手 @3504.4 (3笔)"
+
+
+def test_offsetting_fills_are_flat():
+    """同一根K线内买卖相抵时为中性标记,保留双方手数"""
+    markers = trade_markers(BARS, [
+        fill("2025-01-02T09:00:01", "buy", 2, 3500),
+        fill("2025-01-02T09:00:02", "sell", 2, 3502),
+    ], MINUTE, "SHFE")
+
+    assert markers[0]["shape"] == "circle"
+    assert markers[0]["text"] == "buy 2手 / sell 2手 @3501.0 (2笔)"
+
+
+def test_daily_bars_use_trading_day():
+    """日线按交易日吸附: 周五夜盘成交属于下周一的日K线"""
+    friday = epoch("2025-01-03T00:00:00")
+    monday = epoch("2025-01-06T00:00:00")
+    markers = trade_markers([friday, monday], [
+        fill("2025-01-03T10:00:00", "buy", 1, 3500),
+        fill("2025-01-03T21:30:00", "sell", 1, 3520),
+        fill("2025-01-04T01:00:00", "sell", 1, 3530),
+    ], DAY, "SHFE")
+
+    assert [m["time"] for m in markers] == [friday, monday]
+    assert markers[1]["text"] == "sell 2手 @3525.0 (2笔)"
+
+
+def test_accepts_timezone_aware_timestamps():
+    """带时区偏移的成交时间换算到交易所本地时间"""
+    markers = trade_markers(BARS, [
+        fill("2025-01-02T01:01:30+00:00", "buy", 1, 3500),
+    ], MINUTE, "SHFE")
+
+    assert [m["time"] for m in markers] == [BARS[1]]
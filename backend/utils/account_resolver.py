@@ -0,0 +1,156 @@
+"""
+账户ID解析缓存
+
+极星账户ID(polar_account_id) → 账户UUID 的进程内缓存:
+- LRU淘汰 + TTL过期
+- 不存在的账户做短时负缓存,避免重复查询
+- 命中/未命中计数用于监控
+
+一致性: 后端没有账户写入路径(账户由前端/运维直接写库),
+缓存与数据库的偏差只由TTL界定 —— 新建账户最多负缓存期(account_cache_negative_ttl)后可见,
+修改/删除最多正缓存期(account_cache_ttl)后生效;需要立即生效时调用
+POST /api/accounts/cache/invalidate
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from config import settings
+from utils.db import async_db, get_supabase_client
+
+
+class AccountResolver:
+    """账户ID解析器(带缓存)"""
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float = 300,
+        negative_ttl: float = 30
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # {polar_account_id: (account_uuid或None, 过期时间)}
+        self._cache: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def db(self):
+        return get_supabase_client()
+
+    def _get_cached(self, polar_account_id: str) -> Tuple[bool, Optional[str]]:
+        """查缓存,返回(是否命中, 账户UUID)"""
+        entry = self._cache.get(polar_account_id)
+        if entry is None:
+            return False, None
+
+        account_uuid, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._cache[polar_account_id]
+            return False, None
+
+        self._cache.move_to_end(polar_account_id)
+        if account_uuid is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return True, account_uuid
+
+    def _put(self, polar_account_id: str, account_uuid: Optional[str]):
+        ttl = self.ttl if account_uuid else self.negative_ttl
+        self._cache[polar_account_id] = (account_uuid, time.monotonic() + ttl)
+        self._cache.move_to_end(polar_account_id)
+
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    async def resolve(self, polar_account_id: str) -> Optional[str]:
+        """
+        解析单个极星账户ID
+
+        Returns:
+            账户UUID,账户不存在时返回None
+        """
+        resolved = await self.resolve_many([polar_account_id])
+        return resolved.get(polar_account_id)
+
+    async def resolve_many(self, polar_account_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        批量解析极星账户ID,未命中的一次查询
+
+        Returns:
+            {polar_account_id: account_uuid}, 不存在的账户不在结果中
+        """
+        resolved: Dict[str, str] = {}
+        missing = []
+
+        for polar_account_id in set(polar_account_ids):
+            found, account_uuid = self._get_cached(polar_account_id)
+            if not found:
+                missing.append(polar_account_id)
+            elif account_uuid:
+                resolved[polar_account_id] = account_uuid
+
+        if not missing:
+            return resolved
+
+        self.misses += len(missing)
+        # 在线程池中执行,未命中时不阻塞事件循环
+        rows = await async_db.rest(
+            self.db.table("accounts")
+            .select("id, polar_account_id")
+            .in_("polar_account_id", sorted(missing))
+        )
+
+        found_map = {row['polar_account_id']: row['id'] for row in rows}
+        for polar_account_id in missing:
+            account_uuid = found_map.get(polar_account_id)
+            self._put(polar_account_id, account_uuid)
+            if account_uuid:
+                resolved[polar_account_id] = account_uuid
+
+        return resolved
+
+    def invalidate(self, polar_account_id: Optional[str] = None) -> int:
+        """
+        失效缓存
+
+        Args:
+            polar_account_id: 指定账户,为空时清空全部
+
+        Returns:
+            清除的条目数
+        """
+        if polar_account_id is None:
+            count = len(self._cache)
+            self._cache.clear()
+            return count
+
+        return 1 if self._cache.pop(polar_account_id, None) else 0
+
+    def stats(self) -> Dict:
+        """缓存统计"""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0
+        }
+
+
+# 全局实例
+account_resolver = AccountResolver(
+    max_size=settings.account_cache_size,
+    ttl=settings.account_cache_ttl,
+    negative_ttl=settings.account_cache_negative_ttl
+)
@@ -1,8 +1,31 @@
 """
 数据库连接工具
+
+- get_supabase_client: 同步PostgREST客户端(单例)
+- async_db: 异步数据访问层,基于asyncpg连接池直连PostgreSQL,
+  不阻塞事件循环;连接池不可用时回退到PostgREST(在线程池中执行)。
+  另提供跨进程的NOTIFY/LISTEN(只在连接池可用时)
+
+异步层的增删改查与PostgREST语义一致:
+- 字段值通过jsonb_populate_record(set)按表结构转换类型
+- 返回记录通过to_jsonb生成,与PostgREST返回的JSON格式相同
 """
+import asyncio
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+from postgrest.exceptions import APIError
 from supabase import create_client, Client
 from config import settings
+from utils.logger import get_logger
+
+try:
+    import asyncpg
+except ImportError:  # 未安装时只使用PostgREST
+    asyncpg = None
+
+logger = get_logger(__name__)
 
 
 # Supabase客户端(单例)
@@ -42,3 +65,429 @@ async def test_connection() -> bool:
     except Exception as e:
         print(f"Database connection test failed: {e}")
         return False
+
+
+_IDENTIFIER = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+Columns = Union[str, Sequence[str]]
+
+
+def _ident(name: str) -> str:
+    """校验并引用标识符(表名/列名只允许小写字母、数字和下划线)"""
+    name = name.strip()
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"非法标识符: {name}")
+    return f'"{name}"'
+
+
+def _names(columns: Columns) -> List[str]:
+    if isinstance(columns, str):
+        return [column.strip() for column in columns.split(",")]
+    return list(columns)
+
+
+class _InsertIgnoringDuplicates:
+    """逐条插入并忽略唯一冲突(PostgREST无法以部分唯一索引作为冲突目标)"""
+
+    def __init__(self, query: Any, rows: List[Dict]):
+        self.query = query
+        self.rows = rows
+
+    def execute(self) -> Any:
+        data = []
+        for row in self.rows:
+            try:
+                data.extend(self.query.insert(row).execute().data or [])
+            except APIError as e:
+                if e.code != "23505":  # unique_violation
+                    raise
+        return _Result(data)
+
+
+class _Result:
+    def __init__(self, data: List[Dict]):
+        self.data = data
+
+
+class AsyncDatabase:
+    """
+    异步数据访问层
+
+    每个方法都有超时(默认settings.db_query_timeout秒),超时抛出asyncio.TimeoutError。
+    连接池未建立或连接异常时自动回退到PostgREST,SQL错误(如约束冲突)直接抛出
+    """
+
+    def __init__(
+        self,
+        dsn: Optional[str] = None,
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 5
+    ):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._pool = None
+        # LISTEN专用连接 {通道: 连接}
+        self._listeners: Dict[str, Any] = {}
+
+        # 统计
+        self.pool_queries = 0
+        self.rest_queries = 0
+        self.fallbacks = 0
+        self.timeouts = 0
+        self.notifies = 0
+
+    @property
+    def client(self) -> Client:
+        return get_supabase_client()
+
+    @property
+    def pooled(self) -> bool:
+        """是否使用连接池"""
+        return self._pool is not None
+
+    async def connect(self) -> bool:
+        """
+        建立连接池,失败时保持PostgREST模式
+
+        Returns:
+            连接池是否可用
+        """
+        if self._pool is not None:
+            return True
+        if asyncpg is None or not self.dsn:
+            logger.info("[数据库] 未启用连接池,使用PostgREST")
+            return False
+
+        try:
+            self._pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                command_timeout=self.timeout,
+                timeout=self.timeout
+            )
+            logger.info(f"[数据库] 连接池已建立({self.min_size}-{self.max_size})")
+            return True
+        except Exception as e:
+            logger.warning(f"[数据库] 连接池建立失败,使用PostgREST: {e}")
+            return False
+
+    async def close(self):
+        """关闭连接池和LISTEN连接"""
+        listeners, self._listeners = self._listeners, {}
+        for connection in listeners.values():
+            await connection.close()
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await pool.close()
+
+    async def select(
+        self,
+        table: str,
+        columns: Columns = "*",
+        filters: Optional[Dict[str, Any]] = None,
+        order: Sequence[str] = (),
+        limit: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        查询记录
+
+        Args:
+            table: 表或视图名
+            columns: 返回字段,默认全部
+            filters: 等值过滤条件 {列名: 值}
+            order: 排序字段,降序写作"列名.desc"
+            limit: 最大条数
+            timeout: 超时(秒)
+        """
+        filters = filters or {}
+        names = None if columns == "*" else _names(columns)
+
+        t = _ident(table)
+        if names is None:
+            output = "to_jsonb(t)"
+        else:
+            output = "jsonb_build_object(" + ", ".join(
+                f"'{name}', t.{_ident(name)}" for name in names
+            ) + ")"
+
+        sql = f"SELECT {output} FROM {t} t"
+        args: List[Any] = []
+        if filters:
+            sql += f", jsonb_populate_record(NULL::{t}, $1::jsonb) f WHERE " + " AND ".join(
+                f"t.{_ident(column)} = f.{_ident(column)}" for column in filters
+            )
+            args.append(json.dumps(filters))
+        if order:
+            terms = []
+            for term in order:
+                column, _, direction = term.partition(".")
+                terms.append(f"t.{_ident(column)}" + (" DESC" if direction == "desc" else ""))
+            sql += " ORDER BY " + ", ".join(terms)
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+
+        def rest():
+            query = self.client.table(table).select(
+                "*" if names is None else ", ".join(names)
+            )
+            for column, value in filters.items():
+                query = query.eq(column, value)
+            for term in order:
+                column, _, direction = term.partition(".")
+                query = query.order(column, desc=direction == "desc")
+            if limit is not None:
+                query = query.limit(limit)
+            return query
+
+        return await self._run(sql, args, rest, timeout)
+
+    async def insert(
+        self,
+        table: str,
+        rows: Union[Dict, List[Dict]],
+        on_conflict: Optional[str] = None,
+        ignore_duplicates: bool = False,
+        conflict_where: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        插入记录(on_conflict不为空时为upsert)
+
+        Args:
+            table: 表名
+            rows: 记录或记录列表(字段相同)
+            on_conflict: 冲突判断的列,逗号分隔
+            ignore_duplicates: 冲突时忽略(否则更新其余字段)
+            conflict_where: 冲突列对应部分唯一索引的谓词(SQL常量,不能含外部输入)。
+                PostgREST无法指定该谓词,回退时只支持ignore_duplicates: 逐条插入并忽略唯一冲突
+            timeout: 超时(秒)
+
+        Returns:
+            实际写入的记录
+        """
+        rows = rows if isinstance(rows, list) else [rows]
+        if not rows:
+            return []
+
+        t = _ident(table)
+        columns = [_ident(column) for column in rows[0]]
+        column_list = ", ".join(columns)
+        sql = (
+            f"INSERT INTO {t} AS t ({column_list}) "
+            f"SELECT {column_list} FROM jsonb_populate_recordset(NULL::{t}, $1::jsonb)"
+        )
+        if on_conflict:
+            conflict = [_ident(column) for column in _names(on_conflict)]
+            sql += f" ON CONFLICT ({', '.join(conflict)})"
+            if conflict_where:
+                sql += f" WHERE {conflict_where}"
+            sql += " DO "
+            updates = [column for column in columns if column not in conflict]
+            if ignore_duplicates or not updates:
+                sql += "NOTHING"
+            else:
+                sql += "UPDATE SET " + ", ".join(
+                    f"{column} = EXCLUDED.{column}" for column in updates
+                )
+        sql += " RETURNING to_jsonb(t)"
+
+        if conflict_where and not ignore_duplicates:
+            raise ValueError("conflict_where只支持ignore_duplicates")
+
+        def rest():
+            query = self.client.table(table)
+            if conflict_where:
+                return _InsertIgnoringDuplicates(query, rows)
+            if on_conflict:
+                return query.upsert(rows, on_conflict=on_conflict,
+                                    ignore_duplicates=ignore_duplicates)
+            return query.insert(rows)
+
+        return await self._run(sql, [json.dumps(rows)], rest, timeout)
+
+    async def update(
+        self,
+        table: str,
+        values: Dict[str, Any],
+        filters: Dict[str, Any],
+        timeout: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        按等值条件更新记录
+
+        Returns:
+            更新后的记录(没有匹配时为空)
+        """
+        if not filters:
+            raise ValueError("update必须指定过滤条件")
+
+        t = _ident(table)
+        sql = (
+            f"UPDATE {t} AS t SET "
+            + ", ".join(f"{_ident(column)} = v.{_ident(column)}" for column in values)
+            + f" FROM jsonb_populate_record(NULL::{t}, $1::jsonb) v,"
+            + f" jsonb_populate_record(NULL::{t}, $2::jsonb) f WHERE "
+            + " AND ".join(f"t.{_ident(column)} = f.{_ident(column)}" for column in filters)
+            + " RETURNING to_jsonb(t)"
+        )
+
+        def rest():
+            query = self.client.table(table).update(values)
+            for column, value in filters.items():
+                query = query.eq(column, value)
+            return query
+
+        return await self._run(sql, [json.dumps(values), json.dumps(filters)], rest, timeout)
+
+    async def delete(
+        self,
+        table: str,
+        filters: Dict[str, Any],
+        timeout: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        按等值条件删除记录
+
+        Returns:
+            被删除的记录
+        """
+        if not filters:
+            raise ValueError("delete必须指定过滤条件")
+
+        t = _ident(table)
+        sql = (
+            f"DELETE FROM {t} AS t USING jsonb_populate_record(NULL::{t}, $1::jsonb) f WHERE "
+            + " AND ".join(f"t.{_ident(column)} = f.{_ident(column)}" for column in filters)
+            + " RETURNING to_jsonb(t)"
+        )
+
+        def rest():
+            query = self.client.table(table).delete()
+            for column, value in filters.items():
+                query = query.eq(column, value)
+            return query
+
+        return await self._run(sql, [json.dumps(filters)], rest, timeout)
+
+    async def rest(self, query: Any, timeout: Optional[float] = None) -> List[Dict]:
+        """在线程池中执行已构造的PostgREST查询(用于连接池不支持的查询)"""
+        return await self._run_rest(lambda: query, timeout)
+
+    async def notify(self, channel: str, payload: str, timeout: Optional[float] = None) -> bool:
+        """
+        发送NOTIFY(payload不超过8000字节)
+
+        Returns:
+            是否已发送,连接池不可用时返回False(PostgREST不支持NOTIFY)
+        """
+        pool = self._pool
+        if pool is None:
+            return False
+        try:
+            await pool.execute("SELECT pg_notify($1, $2)", channel, payload,
+                               timeout=timeout or self.timeout)
+        except (OSError, asyncpg.InterfaceError, asyncpg.PostgresConnectionError) as e:
+            logger.warning(f"[数据库] NOTIFY {channel} 失败: {e}")
+            return False
+        self.notifies += 1
+        return True
+
+    async def listen(self, channel: str, callback: Callable[[str], None]) -> bool:
+        """
+        用一个独占连接LISTEN通道,收到NOTIFY时以payload回调
+
+        连接断开后listening(channel)变为False,由调用方回退到轮询或重新listen
+
+        Returns:
+            是否已开始监听,连接池不可用时返回False
+        """
+        if self._pool is None:
+            return False
+        if channel in self._listeners:
+            return True
+        try:
+            connection = await asyncpg.connect(self.dsn, timeout=self.timeout)
+            await connection.add_listener(
+                channel, lambda _connection, _pid, _channel, payload: callback(payload)
+            )
+        except Exception as e:
+            logger.warning(f"[数据库] LISTEN {channel} 失败: {e}")
+            return False
+
+        def terminated(_connection):
+            if self._listeners.get(channel) is connection:
+                del self._listeners[channel]
+                logger.warning(f"[数据库] LISTEN {channel} 连接已断开")
+
+        connection.add_termination_listener(terminated)
+        self._listeners[channel] = connection
+        return True
+
+    def listening(self, channel: str) -> bool:
+        """是否正在监听通道"""
+        return channel in self._listeners
+
+    async def _run(
+        self,
+        sql: str,
+        args: List[Any],
+        rest: Callable[[], Any],
+        timeout: Optional[float]
+    ) -> List[Dict]:
+        timeout = timeout or self.timeout
+        pool = self._pool
+        if pool is not None:
+            try:
+                records = await pool.fetch(sql, *args, timeout=timeout)
+                self.pool_queries += 1
+                return [json.loads(record[0]) for record in records]
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise
+            except (OSError, asyncpg.InterfaceError, asyncpg.PostgresConnectionError) as e:
+                self.fallbacks += 1
+                logger.warning(f"[数据库] 连接池查询失败,回退PostgREST: {e}")
+
+        return await self._run_rest(rest, timeout)
+
+    async def _run_rest(self, rest: Callable[[], Any], timeout: Optional[float]) -> List[Dict]:
+        self.rest_queries += 1
+        try:
+            result = await asyncio.wait_for(
+                asyncio.to_thread(lambda: rest().execute()),
+                timeout or self.timeout
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        return result.data or []
+
+    def stats(self) -> Dict:
+        """访问统计"""
+        stats = {
+            "pooled": self.pooled,
+            "pool_queries": self.pool_queries,
+            "rest_queries": self.rest_queries,
+            "fallbacks": self.fallbacks,
+            "timeouts": self.timeouts,
+            "notifies": self.notifies,
+            "listening": sorted(self._listeners)
+        }
+        if self._pool is not None:
+            stats["pool_size"] = self._pool.get_size()
+            stats["pool_idle"] = self._pool.get_idle_size()
+        return stats
+
+
+# 全局实例(连接池在应用启动时建立)
+async_db = AsyncDatabase(
+    dsn=settings.database_url if settings.db_pool_enabled else None,
+    min_size=settings.db_pool_min_size,
+    max_size=settings.db_pool_max_size,
+    timeout=settings.db_query_timeout
+)
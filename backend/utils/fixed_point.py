@@ -0,0 +1,123 @@
+"""
+定点数计算核心
+
+价格以整数"价位"表示: 价格 / 最小变动价位(price_tick)。
+均价可能落在两个价位之间,统一再放大SCALE倍保存(下称定点价格):
+
+    定点价格 = round(价格 / price_tick * SCALE)
+
+持仓量为整数,浮盈和锁定利润以定点价格差 × 手数 × 合约乘数 计算,
+只在输出时换算回金额。所有函数同时支持Python标量和NumPy数组
+
+数值范围: 价格/价位 ≤ 1e7 时,定点价格 ≤ 1e11,
+再乘以手数×合约乘数 ≤ 1e7 仍在int64范围内
+"""
+from typing import Union
+
+import numpy as np
+
+# 均价保留的价位以下精度
+SCALE = 10000
+# 未登记最小变动价位时的默认值
+DEFAULT_TICK = 0.01
+
+IntLike = Union[int, np.ndarray]
+FloatLike = Union[float, np.ndarray]
+
+# 标量快速路径识别的类型(逐笔重放是热点,避免走NumPy)
+_SCALARS = (int, float)
+
+
+def to_fixed(price: FloatLike, tick: FloatLike = DEFAULT_TICK) -> IntLike:
+    """
+    价格 → 定点价格
+
+    Args:
+        price: 价格(标量或数组)
+        tick: 最小变动价位(标量或与price等长的数组)
+    """
+    if type(tick) in _SCALARS and not isinstance(price, np.ndarray):
+        return int(round(float(price) * SCALE / tick))
+    return np.rint(np.asarray(price, dtype=np.float64) * SCALE / tick).astype(np.int64)
+
+
+def to_price(fixed: IntLike, tick: FloatLike = DEFAULT_TICK) -> FloatLike:
+    """定点价格 → 价格"""
+    if type(tick) in _SCALARS and not isinstance(fixed, np.ndarray):
+        return fixed * tick / SCALE
+    return np.asarray(fixed, dtype=np.float64) * tick / SCALE
+
+
+def _div_round(numerator: IntLike, denominator: IntLike) -> IntLike:
+    """整数除法,四舍五入(分母为正)"""
+    return (numerator + denominator // 2) // denominator
+
+
+def weighted_average(
+    avg: IntLike,
+    volume: IntLike,
+    price: IntLike,
+    add_volume: IntLike
+) -> IntLike:
+    """
+    开仓后的加权平均成本
+
+    Args:
+        avg: 原均价(定点)
+        volume: 原持仓量
+        price: 成交价(定点)
+        add_volume: 成交量
+
+    Returns:
+        新均价(定点),总持仓为0时返回0
+    """
+    total = volume + add_volume
+    cost = avg * volume + price * add_volume
+
+    if type(total) is int:
+        return (cost + total // 2) // total if total > 0 else 0
+
+    safe_total = np.where(total > 0, total, 1)
+    return np.where(total > 0, _div_round(cost, safe_total), 0)
+
+
+def pnl(
+    avg: IntLike,
+    price: IntLike,
+    volume: IntLike,
+    multiplier: IntLike,
+    tick: FloatLike = DEFAULT_TICK,
+    direction: IntLike = 1
+) -> FloatLike:
+    """
+    持仓浮盈
+
+    Args:
+        avg: 持仓均价(定点)
+        price: 最新价(定点)
+        volume: 持仓量
+        multiplier: 合约乘数
+        tick: 最小变动价位
+        direction: 1多头 / -1空头
+
+    Returns:
+        浮盈金额
+    """
+    units = (price - avg) * volume * multiplier * direction
+    return to_price(units, tick)
+
+
+def locked_profit(
+    avg: IntLike,
+    lock_price: IntLike,
+    lock_volume: IntLike,
+    multiplier: IntLike,
+    tick: FloatLike = DEFAULT_TICK,
+    direction: IntLike = 1
+) -> FloatLike:
+    """
+    锁仓锁定的利润: 按锁仓价计算被锁定部分的浮盈
+
+    参数含义同pnl,direction为被锁持仓的方向(1多头 / -1空头)
+    """
+    return pnl(avg, lock_price, lock_volume, multiplier, tick, direction)
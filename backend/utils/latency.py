@@ -0,0 +1,40 @@
+"""
+延迟统计
+
+保留最近window个样本计算分位数,累计计数和最大值覆盖全部样本
+"""
+from collections import deque
+from typing import Dict
+
+import numpy as np
+
+
+class LatencyStats:
+    """延迟分布(单位: 秒记录, 毫秒输出)"""
+
+    def __init__(self, window: int = 4096):
+        self._samples: "deque[float]" = deque(maxlen=window)
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self) -> Dict:
+        """{count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}"""
+        if not self._samples:
+            return {"count": 0}
+
+        samples = np.fromiter(self._samples, dtype=np.float64) * 1000
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return {
+            "count": self.count,
+            "mean_ms": round(float(samples.mean()), 3),
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
@@ -0,0 +1,147 @@
+"""
+进程内发布订阅
+
+按主题把消息分发给各订阅者(如WebSocket连接),发布不等待、不阻塞发布方:
+- 队列订阅: 每个订阅者一个有界队列,满时丢弃最早的消息并计数
+- 合并订阅: 消息为{键: {字段: 值}},未取走的变化按键合并(字段取最新值),
+  两次取出至少间隔min_interval秒;积压只与键数有关,慢订阅者不会无限堆积,
+  被覆盖的旧字段值计入丢弃数
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, Optional, Set, Union
+
+
+class Subscription:
+    """一个订阅者的消息队列"""
+
+    def __init__(self, topic: Hashable, max_size: int):
+        self.topic = topic
+        self._messages: Deque[Any] = deque(maxlen=max_size)
+        self._available = asyncio.Event()
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def put(self, message: Any):
+        if len(self._messages) == self._messages.maxlen:
+            self.dropped += 1
+        self._messages.append(message)
+        self._available.set()
+
+    async def get(self) -> Any:
+        while not self._messages:
+            self._available.clear()
+            await self._available.wait()
+        return self._messages.popleft()
+
+
+class ConflatedSubscription:
+    """一个订阅者的合并队列(按键保留最新状态)"""
+
+    def __init__(self, topic: Hashable, min_interval: float):
+        self.topic = topic
+        self.min_interval = min_interval
+        self._pending: Dict[Hashable, Dict] = {}
+        self._available = asyncio.Event()
+        self._taken_at = -math.inf
+        # 未发送即被新值覆盖的字段值数
+        self.dropped = 0
+        # 与未取走的变化合并的次数
+        self.conflated = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, message: Dict[Hashable, Dict]):
+        for key, fields in message.items():
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = dict(fields)
+            else:
+                self.dropped += sum(1 for field in fields if field in pending)
+                pending.update(fields)
+                self.conflated += 1
+        self._available.set()
+
+    async def get(self) -> Dict[Hashable, Dict]:
+        """取出合并后的全部变化(距上次取出不足min_interval时等待,期间的变化继续合并)"""
+        while not self._pending:
+            self._available.clear()
+            await self._available.wait()
+        wait = self._taken_at + self.min_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._taken_at = time.monotonic()
+        pending, self._pending = self._pending, {}
+        return pending
+
+
+class PubSub:
+    """按主题分发消息"""
+
+    def __init__(self, max_queue: int = 1000):
+        self.max_queue = max_queue
+        self._subscribers: Dict[Hashable, Set[Union[Subscription, ConflatedSubscription]]] = {}
+
+        # 统计
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(
+        self,
+        topic: Hashable,
+        min_interval: Optional[float] = None
+    ) -> Union[Subscription, ConflatedSubscription]:
+        """
+        订阅主题
+
+        Args:
+            min_interval: 为None时使用队列订阅;否则使用合并订阅,两次取出的最小间隔(秒)
+        """
+        if min_interval is None:
+            subscription = Subscription(topic, self.max_queue)
+        else:
+            subscription = ConflatedSubscription(topic, min_interval)
+        self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Union[Subscription, ConflatedSubscription]):
+        subscribers = self._subscribers.get(subscription.topic)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.topic]
+
+    def has_subscribers(self, topic: Hashable) -> bool:
+        return topic in self._subscribers
+
+    def publish(self, topic: Hashable, message: Any) -> int:
+        """
+        发布消息(事件循环中调用)
+
+        Returns:
+            收到消息的订阅者数
+        """
+        self.published += 1
+        subscribers = self._subscribers.get(topic, ())
+        for subscription in subscribers:
+            subscription.put(message)
+        self.delivered += len(subscribers)
+        return len(subscribers)
+
+    def stats(self) -> Dict:
+        subscriptions = [s for subscribers in self._subscribers.values() for s in subscribers]
+        return {
+            "topics": len(self._subscribers),
+            "subscribers": len(subscriptions),
+            "published": self.published,
+            "delivered": self.delivered,
+            "queued": sum(len(s) for s in subscriptions),
+            "dropped": sum(s.dropped for s in subscriptions),
+            "conflated": sum(getattr(s, "conflated", 0) for s in subscriptions)
+        }
@@ -0,0 +1,364 @@
+"""
+最新行情共享表
+
+行情进程把各合约的最新行情写入一个固定布局的内存映射文件,
+任意进程(如多个uvicorn worker)直接映射读取,不需要TqApi,也不加锁
+
+文件布局:
+- 文件头(HEADER_DTYPE): 魔数、版本、容量、已分配行数、写入方心跳
+- 行情行(ROW_DTYPE) × 容量: 每个合约占一行,行号只增不减
+
+一致性(seqlock):
+- 写: seq加1(奇数,写入中) → 写字段 → seq再加1(偶数)
+- 读: 读seq(奇数则重试) → 复制整行 → 再读seq,两次不同说明读到一半被改写,重试
+
+只允许一个写入方(行情进程);读取方按需重建合约→行号索引
+"""
+import math
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import settings
+
+MAGIC = b"QFQUOTE1"
+VERSION = 1
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("capacity", "<u4"),
+    ("count", "<u4"),         # 已分配行数
+    ("reserved", "<u4"),
+    ("heartbeat", "<f8"),     # 写入方最后活跃时间(epoch秒)
+    ("padding", "S32"),
+])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+
+ROW_DTYPE = np.dtype([
+    ("seq", "<u8"),
+    ("symbol", "S32"),        # 天勤格式合约代码
+    ("last_price", "<f8"),
+    ("bid_price1", "<f8"),
+    ("ask_price1", "<f8"),
+    ("bid_volume1", "<i8"),
+    ("ask_volume1", "<i8"),
+    ("open", "<f8"),
+    ("highest", "<f8"),
+    ("lowest", "<f8"),
+    ("pre_settlement", "<f8"),
+    ("volume", "<i8"),
+    ("open_interest", "<i8"),
+    ("datetime", "S32"),      # 交易所行情时间
+    ("updated_at", "<f8"),    # 写入时间(epoch秒)
+])
+
+# 行情字段(不含seq/symbol/updated_at)
+QUOTE_FIELDS = tuple(
+    name for name in ROW_DTYPE.names if name not in ("seq", "symbol", "updated_at")
+)
+
+# 读取时的最大重试次数
+MAX_READ_RETRIES = 100
+
+
+class QuoteTable:
+    """最新行情共享表(内存映射文件)"""
+
+    # 读取方检查文件是否被替换的间隔(秒)
+    REOPEN_CHECK_INTERVAL = 1.0
+
+    def __init__(self, path: str, writable: bool = False):
+        self.path = path
+        self.writable = writable
+        self._index: Dict[str, int] = {}
+        self._map()
+
+        # 统计
+        self.reads = 0
+        self.retries = 0
+
+    @classmethod
+    def create(cls, path: str, capacity: int = 4096) -> 'QuoteTable':
+        """
+        打开或创建共享表(写入方)
+
+        已有文件布局一致时沿用(行情进程重启期间读取方不受影响),
+        否则生成新文件后原子替换
+        """
+        if not cls._compatible(path, capacity):
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            header = np.zeros(1, dtype=HEADER_DTYPE)
+            header["magic"] = MAGIC
+            header["version"] = VERSION
+            header["capacity"] = capacity
+
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(header.tobytes())
+                f.truncate(HEADER_SIZE + ROW_DTYPE.itemsize * capacity)
+            os.replace(tmp_path, path)
+
+        return cls(path, writable=True)
+
+    @classmethod
+    def open(cls, path: str) -> Optional['QuoteTable']:
+        """打开共享表(读取方),文件不存在或布局不符时返回None"""
+        if not cls._compatible(path):
+            return None
+        return cls(path)
+
+    @staticmethod
+    def _compatible(path: str, capacity: Optional[int] = None) -> bool:
+        try:
+            with open(path, "rb") as f:
+                raw = f.read(HEADER_SIZE)
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+        if len(raw) < HEADER_SIZE:
+            return False
+
+        header = np.frombuffer(raw, dtype=HEADER_DTYPE)[0]
+        return (
+            header["magic"] == MAGIC
+            and header["version"] == VERSION
+            and (capacity is None or header["capacity"] == capacity)
+            and size == HEADER_SIZE + ROW_DTYPE.itemsize * int(header["capacity"])
+        )
+
+    def _map(self):
+        mode = "r+" if self.writable else "r"
+        self._header = np.memmap(self.path, dtype=HEADER_DTYPE, mode=mode, shape=(1,))
+        self.capacity = int(self._header["capacity"][0])
+        self._mmap = np.memmap(
+            self.path, dtype=ROW_DTYPE, mode=mode, offset=HEADER_SIZE, shape=(self.capacity,)
+        )
+        # 普通ndarray视图,避免memmap子类在每次索引时的额外开销
+        self._rows = self._mmap.view(np.ndarray)
+        self._seq = self._rows["seq"]
+        self._inode = os.stat(self.path).st_ino
+        self._checked_at = time.monotonic()
+        self._index = {}
+        self._indexed = 0
+
+    # ---------- 写入方 ----------
+
+    def update(self, symbol: str, fields: Dict):
+        """
+        写入合约最新行情(只写fields中出现的行情字段)
+
+        Raises:
+            RuntimeError: 非写入方或容量已满
+        """
+        if not self.writable:
+            raise RuntimeError("行情共享表为只读")
+
+        slot = self._slot(symbol)
+        if slot is None:
+            slot = self._allocate(symbol)
+
+        row = self._rows[slot:slot + 1]
+        row["seq"] += 1
+        for name in QUOTE_FIELDS:
+            value = fields.get(name)
+            if value is None:
+                continue
+            if name == "datetime":
+                row[name] = str(value).encode()
+            elif ROW_DTYPE[name].kind == "i" and isinstance(value, float) and math.isnan(value):
+                # 整数字段无NaN,保持原值
+                continue
+            else:
+                row[name] = value
+        row["updated_at"] = time.time()
+        row["seq"] += 1
+
+    def heartbeat(self):
+        """写入方心跳"""
+        self._header["heartbeat"] = time.time()
+
+    def flush(self):
+        """把映射内容刷回文件(进程间共享不需要,只影响落盘)"""
+        self._mmap.flush()
+        self._header.flush()
+
+    def _allocate(self, symbol: str) -> int:
+        count = int(self._header["count"][0])
+        if count >= self.capacity:
+            raise RuntimeError(f"行情共享表已满({self.capacity})")
+
+        row = np.zeros(1, dtype=ROW_DTYPE)
+        row["symbol"] = symbol.encode()
+        for name in QUOTE_FIELDS:
+            if ROW_DTYPE[name].kind == "f":
+                row[name] = np.nan
+        self._rows[count] = row[0]
+        # 行写好后再增加行数,读取方不会看到未初始化的行
+        self._header["count"] = count + 1
+        self._index[symbol] = count
+        self._indexed = count + 1
+        return count
+
+    # ---------- 读取方 ----------
+
+    def get(self, symbol: str) -> Optional[Dict]:
+        """
+        读取合约最新行情
+
+        Returns:
+            行情字段(浮点NaN转为None,另含updated_at),合约不存在或连续读到写入中时返回None
+        """
+        self._maybe_reopen()
+        slot = self._slot(symbol)
+        if slot is None:
+            return None
+
+        self.reads += 1
+        return self._read(slot)
+
+    def get_many(self, symbols: List[str]) -> List[Optional[Dict]]:
+        """
+        批量读取多个合约的最新行情
+
+        一次复制全部所需行,前后两次读seq校验,只有读到写入中的行单独重试
+
+        Returns:
+            与symbols一一对应,合约不存在(或连续读到写入中)时为None
+        """
+        self._maybe_reopen()
+        quotes: List[Optional[Dict]] = [None] * len(symbols)
+        positions, slots = [], []
+        for position, symbol in enumerate(symbols):
+            slot = self._slot(symbol)
+            if slot is not None:
+                positions.append(position)
+                slots.append(slot)
+        if not slots:
+            return quotes
+
+        self.reads += len(slots)
+        index = np.array(slots, dtype=np.intp)
+        before = self._seq[index]
+        rows = self._rows[index]
+        after = self._seq[index]
+        consistent = (before == after) & (before % 2 == 0)
+        for position, slot, row, ok in zip(positions, slots, rows, consistent.tolist()):
+            if ok:
+                quotes[position] = self._to_dict(row)
+            else:
+                self.retries += 1
+                quotes[position] = self._read(slot)
+        return quotes
+
+    def _read(self, slot: int) -> Optional[Dict]:
+        """按seqlock读取一行"""
+        for _ in range(MAX_READ_RETRIES):
+            before = int(self._seq[slot])
+            if before % 2:
+                self.retries += 1
+                continue
+            row = self._rows[slot].copy()
+            if int(self._seq[slot]) == before:
+                return self._to_dict(row)
+            self.retries += 1
+        return None
+
+    def symbols(self) -> List[str]:
+        """已写入的合约"""
+        self._refresh_index()
+        return list(self._index)
+
+    def heartbeat_age(self) -> Optional[float]:
+        """写入方心跳距今秒数,从未写入时返回None"""
+        heartbeat = float(self._header["heartbeat"][0])
+        return time.time() - heartbeat if heartbeat else None
+
+    def is_stale(self, max_age: Optional[float] = None) -> bool:
+        """
+        写入方是否已停止(心跳超过max_age秒或从未写入)
+
+        Args:
+            max_age: 心跳最大间隔(秒),默认settings.quote_table_max_age
+        """
+        age = self.heartbeat_age()
+        if max_age is None:
+            max_age = settings.quote_table_max_age
+        return age is None or age > max_age
+
+    def _slot(self, symbol: str) -> Optional[int]:
+        slot = self._index.get(symbol)
+        if slot is None and self._indexed < int(self._header["count"][0]):
+            self._refresh_index()
+            slot = self._index.get(symbol)
+        return slot
+
+    def _refresh_index(self):
+        count = int(self._header["count"][0])
+        for slot in range(self._indexed, count):
+            self._index[self._rows["symbol"][slot].decode()] = slot
+        self._indexed = count
+
+    def _maybe_reopen(self):
+        """写入方替换了文件(布局变化)时重新映射"""
+        if self.writable or time.monotonic() - self._checked_at < self.REOPEN_CHECK_INTERVAL:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            if os.stat(self.path).st_ino != self._inode and self._compatible(self.path):
+                self._map()
+        except OSError:
+            pass
+
+    @staticmethod
+    def _to_dict(row: np.void) -> Dict:
+        quote = dict(zip(ROW_DTYPE.names, row.tolist()))
+        del quote["seq"], quote["symbol"]
+        for name, value in quote.items():
+            if isinstance(value, bytes):
+                quote[name] = value.decode()
+            elif isinstance(value, float) and math.isnan(value):
+                quote[name] = None
+        return quote
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "capacity": self.capacity,
+            "symbols": int(self._header["count"][0]),
+            "heartbeat_age": self.heartbeat_age(),
+            "stale": self.is_stale(),
+            "reads": self.reads,
+            "read_retries": self.retries
+        }
+
+
+# 读取方单例(按需打开,行情进程未启动时为None)
+_quote_table: Optional[QuoteTable] = None
+
+
+def get_quote_table(allow_stale: bool = False) -> Optional[QuoteTable]:
+    """
+    获取行情共享表(读取方,单例模式)
+
+    行情进程停止后文件仍在,但内容不再更新,心跳超时的共享表默认不返回
+
+    Args:
+        allow_stale: 心跳超时时仍返回共享表(用于监控,或天勤API也不可用时的兜底)
+
+    Returns:
+        共享表,文件尚未由行情进程创建(或心跳超时且不允许过期)时返回None
+    """
+    global _quote_table
+
+    if _quote_table is None:
+        _quote_table = QuoteTable.open(settings.quote_table_path)
+
+    if _quote_table is not None and not allow_stale and _quote_table.is_stale():
+        return None
+    return _quote_table
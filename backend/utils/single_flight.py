@@ -0,0 +1,88 @@
+"""
+单飞(single-flight)请求合并
+
+同一路由、相同参数的并发读请求共享同一次数据库查询:
+- 第一个请求发起查询,之后到达的请求等待同一个结果
+- 查询结束后立即移除,下一个请求重新查询(不做缓存)
+- 查询在独立任务中执行,发起请求被取消(客户端断开)不影响其他等待者
+
+共享结果是同一个对象,调用方只读不改
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class RouteStats:
+    """单个路由的合并统计"""
+
+    def __init__(self):
+        self.calls = 0       # 请求数
+        self.executions = 0  # 实际查询数
+        self.shared = 0      # 共享结果的请求数
+
+    def to_dict(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "shared": self.shared,
+            "coalescing_ratio": round(self.shared / self.calls, 4) if self.calls else 0.0
+        }
+
+
+class SingleFlight:
+    """并发相同读请求合并"""
+
+    def __init__(self):
+        self._inflight: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+        self._stats: Dict[str, RouteStats] = {}
+
+    async def do(
+        self,
+        route: str,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        执行查询,相同(route, key)的查询进行中时直接等待其结果
+
+        Args:
+            route: 路由(统计维度)
+            key: 请求参数(可哈希)
+            fn: 发起查询的协程函数
+
+        Returns:
+            查询结果(异常同样共享)
+        """
+        stats = self._stats.get(route)
+        if stats is None:
+            stats = self._stats[route] = RouteStats()
+        stats.calls += 1
+
+        flight_key = (route, key)
+        task = self._inflight.get(flight_key)
+        if task is not None:
+            stats.shared += 1
+        else:
+            stats.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[flight_key] = task
+            task.add_done_callback(lambda done: self._finish(flight_key, done))
+
+        return await asyncio.shield(task)
+
+    def _finish(self, flight_key: Tuple[str, Hashable], task: asyncio.Future):
+        self._inflight.pop(flight_key, None)
+        if not task.cancelled():
+            # 所有等待者都已取消时避免"exception was never retrieved"警告
+            task.exception()
+
+    def stats(self) -> Dict:
+        """各路由合并统计"""
+        return {
+            "inflight": len(self._inflight),
+            "routes": {route: stats.to_dict() for route, stats in self._stats.items()}
+        }
+
+
+# 全局实例
+single_flight = SingleFlight()
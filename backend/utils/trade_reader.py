@@ -0,0 +1,127 @@
+"""
+成交记录流式读取
+
+按(timestamp, id)键集分页遍历trades表:
+- 每页只取调用方需要的字段
+- 下一页从上一页最后一条记录之后开始,不使用OFFSET,页数再多也不变慢
+- 可选时间窗口和起始水位
+
+调用方逐页处理,内存占用只与页大小有关,与成交历史长度无关
+"""
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Union
+
+from supabase import Client
+
+from utils.db import async_db, get_supabase_client
+
+# 分页读取的默认页大小(不超过PostgREST的max-rows)
+DEFAULT_PAGE_SIZE = 1000
+
+TimeBound = Union[datetime, str, None]
+
+
+def through_watermark(trade_time: str, trade_id: str) -> str:
+    """PostgREST过滤条件: (timestamp, id) <= 水位"""
+    return f'timestamp.lt."{trade_time}",and(timestamp.eq."{trade_time}",id.lte.{trade_id})'
+
+
+def after_watermark(trade_time: str, trade_id: str) -> str:
+    """PostgREST过滤条件: (timestamp, id) > 水位"""
+    return f'timestamp.gt."{trade_time}",and(timestamp.eq."{trade_time}",id.gt.{trade_id})'
+
+
+def _columns(columns: Union[str, Iterable[str]]) -> str:
+    """补齐分页需要的id/timestamp字段"""
+    if isinstance(columns, str):
+        if columns.strip() == "*":
+            return "*"
+        columns = [column.strip() for column in columns.split(",")]
+
+    selected = list(columns)
+    for required in ("id", "timestamp"):
+        if required not in selected:
+            selected.append(required)
+    return ", ".join(selected)
+
+
+def _isoformat(bound: TimeBound) -> Optional[str]:
+    return bound.isoformat() if isinstance(bound, datetime) else bound
+
+
+async def iter_trade_pages(
+    account_id: str,
+    symbol: Optional[str] = None,
+    columns: Union[str, Iterable[str]] = "*",
+    start: TimeBound = None,
+    end: TimeBound = None,
+    after: Optional[Dict] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    db: Client = None
+) -> AsyncIterator[List[Dict]]:
+    """
+    按(timestamp, id)正序逐页读取成交
+
+    Args:
+        account_id: 账户ID(UUID)
+        symbol: 合约代码(极星格式),为空时读取账户全部合约
+        columns: 需要的字段,id和timestamp会自动补上
+        start: 起始时间(含)
+        end: 结束时间(含)
+        after: 起始水位 {"timestamp": ..., "id": ...},只读取其后的成交
+        page_size: 页大小
+        db: 数据库客户端
+
+    Yields:
+        每页成交记录
+    """
+    db = db or get_supabase_client()
+    selected = _columns(columns)
+    start, end = _isoformat(start), _isoformat(end)
+    cursor = (after["timestamp"], after["id"]) if after else None
+
+    while True:
+        query = db.table("trades")\
+            .select(selected)\
+            .eq("account_id", account_id)
+        if symbol:
+            query = query.eq("symbol", symbol)
+        if start:
+            query = query.gte("timestamp", start)
+        if end:
+            query = query.lte("timestamp", end)
+        if cursor:
+            query = query.or_(after_watermark(*cursor))
+
+        # 在线程池中执行,读取长历史时不阻塞事件循环
+        page = await async_db.rest(
+            query
+            .order("timestamp", desc=False)
+            .order("id", desc=False)
+            .limit(page_size)
+        )
+
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+
+        cursor = (page[-1]["timestamp"], page[-1]["id"])
+
+
+async def iter_trades(
+    account_id: str,
+    symbol: Optional[str] = None,
+    columns: Union[str, Iterable[str]] = "*",
+    start: TimeBound = None,
+    end: TimeBound = None,
+    after: Optional[Dict] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    db: Client = None
+) -> AsyncIterator[Dict]:
+    """逐条读取成交,参数同iter_trade_pages"""
+    async for page in iter_trade_pages(
+        account_id, symbol, columns, start, end, after, page_size, db
+    ):
+        for trade in page:
+            yield trade
@@ -0,0 +1,45 @@
+"""
+交易日工具
+
+国内期货夜盘归属下一个交易日:
+- 21:00之后的成交属于下一个交易日(周五夜盘属于下周一)
+- 次日凌晨(夜盘跨零点部分)属于当天,周六凌晨属于下周一
+
+法定节假日未处理,节前夜盘停盘,不影响按交易日切分
+"""
+from datetime import date, datetime, timedelta
+from typing import Union
+
+from dateutil.parser import isoparse
+
+# 夜盘开始时间(小时,交易所本地时间),此后的成交和K线归属下一个交易日(含20:55集合竞价)
+NIGHT_SESSION_START = 20
+
+
+def _next_weekday(day: date) -> date:
+    day += timedelta(days=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day
+
+
+def trading_day(ts: Union[datetime, str]) -> date:
+    """
+    成交时间 → 所属交易日
+
+    Args:
+        ts: 成交时间(datetime或ISO字符串,按交易所本地时间)
+
+    Returns:
+        交易日
+    """
+    if isinstance(ts, str):
+        ts = isoparse(ts)
+
+    day = ts.date()
+    if ts.hour >= NIGHT_SESSION_START:
+        return _next_weekday(day)
+    if day.weekday() >= 5:
+        # 周六凌晨(周五夜盘跨零点)及周末的记录归入下周一
+        return _next_weekday(day)
+    return day
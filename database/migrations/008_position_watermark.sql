@@ -0,0 +1,18 @@
+-- =====================================================
+-- 持仓增量计算水位
+-- =====================================================
+
+-- 1. 持仓表记录已计入的最后一笔成交
+ALTER TABLE positions ADD COLUMN IF NOT EXISTS last_trade_id UUID;          -- 最后计入的成交ID
+ALTER TABLE positions ADD COLUMN IF NOT EXISTS last_trade_time TIMESTAMP;   -- 最后计入的成交时间
+
+-- 2. 按账户+合约+时间顺序读取成交
+CREATE INDEX IF NOT EXISTS idx_trades_account_symbol_time
+    ON trades(account_id, symbol, timestamp, id);
+
+-- =====================================================
+-- 注释
+-- =====================================================
+
+COMMENT ON COLUMN positions.last_trade_id IS '增量持仓水位: 已计入持仓的最后一笔成交ID';
+COMMENT ON COLUMN positions.last_trade_time IS '增量持仓水位: 已计入持仓的最后一笔成交时间';
@@ -0,0 +1,21 @@
+-- =====================================================
+-- 成交去重: (账户, 订单号, 成交序号) 唯一
+-- =====================================================
+
+-- 1. 同一订单可能分多次成交,用成交序号区分
+--    推送方未提供成交序号时为NULL,这类成交不参与去重(历史成交均为NULL,无需清理)
+ALTER TABLE trades ADD COLUMN IF NOT EXISTS fill_seq INTEGER;  -- 订单内成交序号
+
+-- 2. 部分唯一索引: 只约束带成交序号、且订单号有效的成交
+--    (下单失败时极星推送的order_id为"-1",不能作为去重依据)
+ALTER TABLE trades DROP CONSTRAINT IF EXISTS uq_trades_account_order_fill;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_trades_account_order_fill
+    ON trades(account_id, order_id, fill_seq)
+    WHERE fill_seq IS NOT NULL AND order_id <> '-1';
+
+-- =====================================================
+-- 注释
+-- =====================================================
+
+COMMENT ON COLUMN trades.fill_seq IS '订单内成交序号,与account_id/order_id一起唯一标识一笔成交;为空时不去重';
+COMMENT ON INDEX uq_trades_account_order_fill IS '成交去重: 重复推送的成交被忽略';
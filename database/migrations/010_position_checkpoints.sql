@@ -0,0 +1,39 @@
+-- =====================================================
+-- 持仓检查点: 重建时从最近的检查点开始重放
+-- =====================================================
+
+-- 1. 检查点表
+CREATE TABLE IF NOT EXISTS position_checkpoints (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    account_id UUID NOT NULL REFERENCES accounts(id) ON DELETE CASCADE,
+    symbol VARCHAR(50) NOT NULL,                       -- 合约代码(极星格式)
+    trading_day DATE NOT NULL,                         -- 最后计入成交所属交易日
+
+    long_position INTEGER NOT NULL DEFAULT 0,
+    long_avg_fixed BIGINT NOT NULL DEFAULT 0,          -- 多头均价(定点,见utils/fixed_point.py)
+    short_position INTEGER NOT NULL DEFAULT 0,
+    short_avg_fixed BIGINT NOT NULL DEFAULT 0,         -- 空头均价(定点)
+    price_tick DECIMAL(12,6) NOT NULL,                 -- 定点换算使用的最小变动价位
+
+    last_trade_id UUID NOT NULL,                       -- 最后计入的成交ID
+    last_trade_time TIMESTAMP NOT NULL,                -- 最后计入的成交时间
+    trade_count INTEGER NOT NULL,                      -- 已计入的成交笔数(用于校验检查点)
+
+    created_at TIMESTAMP DEFAULT NOW(),
+
+    UNIQUE(account_id, symbol, last_trade_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_position_checkpoints_latest
+    ON position_checkpoints(account_id, symbol, last_trade_time DESC, last_trade_id DESC);
+
+-- 2. 持仓表记录已计入的成交笔数(增量更新时决定何时写检查点)
+ALTER TABLE positions ADD COLUMN IF NOT EXISTS trade_count INTEGER;
+
+-- =====================================================
+-- 注释
+-- =====================================================
+
+COMMENT ON TABLE position_checkpoints IS '持仓检查点,按交易日切换或每N笔成交生成';
+COMMENT ON COLUMN position_checkpoints.trade_count IS '检查点水位之前(含)的成交笔数,与trades表不一致时检查点失效';
+COMMENT ON COLUMN positions.trade_count IS '已计入持仓的成交笔数';
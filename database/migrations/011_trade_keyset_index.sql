@@ -0,0 +1,8 @@
+-- =====================================================
+-- 成交键集分页索引
+-- =====================================================
+
+-- 按账户读取全部合约成交时按(timestamp, id)翻页
+-- (按账户+合约读取使用008中的idx_trades_account_symbol_time)
+CREATE INDEX IF NOT EXISTS idx_trades_account_time
+    ON trades(account_id, timestamp, id);
@@ -15,6 +15,9 @@ from scipy.stats import linregress
 class QuantFuPusher:
     """QuantFu 数据推送器 - 将成交数据推送到 QuantFu 平台"""
 
+    # 订单终态(见ctcfs): 完全成交/已撤单/已撤余单/指令失败/无效单/余单失败,此后不会再有成交
+    TERMINAL_ORDER_STATES = ("6", "9", "A", "B", "F", "I")
+
     def __init__(self, api_url: str = None, api_key: str = None, enable: bool = True):
         self.enable = enable
         if not enable:
@@ -24,13 +27,34 @@ class QuantFuPusher:
         self.api_key = api_key or os.getenv('QUANTFU_API_KEY', 'default-api-key')
         self.success_count = 0
         self.fail_count = 0
+        # 各订单已推送的成交笔数 {订单号: 笔数},用于生成订单内成交序号(服务端据此去重)
+        self.order_fills = {}
+
+    def next_fill_seq(self, order_id) -> int:
+        """订单的下一个成交序号(从0开始),订单号无效(空或下单失败的"-1")时返回None"""
+        if order_id is None or str(order_id) in ("", "-1"):
+            return None
+        order_id = str(order_id)
+        seq = self.order_fills.get(order_id, 0)
+        self.order_fills[order_id] = seq + 1
+        return seq
+
+    def finish_order(self, order_id):
+        """订单到达终态后丢弃其成交计数(order_fills只保留未结束的订单)"""
+        if not self.enable or order_id is None:
+            return
+        self.order_fills.pop(str(order_id), None)
 
     def push_trade(self, account_id: str, symbol: str, direction: str, offset: str,
-                   volume: int, price: float, order_id: str = None, commission: float = 0) -> bool:
-        """推送成交数据"""
+                   volume: int, price: float, order_id: str = None, commission: float = 0,
+                   fill_seq: int = None) -> bool:
+        """推送成交数据(fill_seq为空时按订单自动递增;重推同一笔成交时传入原序号)"""
         if not self.enable:
             return True
 
+        if fill_seq is None:
+            fill_seq = self.next_fill_seq(order_id)
+
         try:
             trade_data = {
                 "account_id": account_id,
@@ -46,6 +70,8 @@ class QuantFuPusher:
 
             if order_id:
                 trade_data["order_id"] = str(order_id)
+            if fill_seq is not None:
+                trade_data["fill_seq"] = fill_seq
             if commission > 0:
                 trade_data["commission"] = commission
 
@@ -1511,6 +1537,10 @@ def trigger_data_handle(context):
         pass
     if context.triggerType() == "O" and context.triggerData()['Cont'] == trade_contractNo:  
         triData = context.triggerData()
+        # --- ai start ---
+        if triData["OrderState"] in QuantFuPusher.TERMINAL_ORDER_STATES:
+            quantfu_pusher.finish_order(triData["StrategyOrderId"])
+        # --- ai end ---
         # send_msg_thread("委托状态变化触发", f"{triData}", is_all_notice=False)
         send_msg_thread("委托状态触发", f"服务器标识:{triData['SessionId']},行情合约:{triData['Cont']},订单号:{triData['OrderId']},开平仓信号:{triData['Offset']},做多做空信号:{triData['Direct']},"
                         f"委托状态:{ctcfs(triData['OrderState'])},策略ID:{triData['StrategyId']},策略订单号:{triData['StrategyOrderId']}"
@@ -1543,6 +1573,9 @@ def trigger_data_handle(context):
                 lock_buy_postion = 0
                 PlotText(Low()[-1], f"手动多平成交", color=RGB_Purple(), main=True)
                 send_msg_thread("手动多平成交", f"数量:{triData['OrderQty']},OrderId:{triData['OrderId']},OrderNo:{triData['OrderNo']}",is_all_notice=False)
+            # --- ai start ---
+            quantfu_pusher.finish_order(exit_order_id)
+            # --- ai end ---
             exit_order_id = -1
             ret_exit = -1
         elif triData["StrategyId"] != 0 and triData["OrderState"] == '6' and (triData["Offset"] == "C" or triData["Offset"] == "T"):
@@ -1576,6 +1609,9 @@ def trigger_data_handle(context):
                 if is_trending and is_trending_order_result is False:
                     is_trending_order_result = True
                     market_order(context,f"新做空趋势",Enum_Sell(),triData['MatchQty'])
+            # --- ai start ---
+            quantfu_pusher.finish_order(exit_order_id)
+            # --- ai end ---
             exit_order_id = -1
             ret_exit = -1
         elif triData["StrategyId"] != 0 and triData["OrderState"] == '6' and triData["Offset"] == "O":
@@ -1585,6 +1621,9 @@ def trigger_data_handle(context):
             elif triData['Direct'] == 'S':
                 # PlotText(Low()[-1], f"空开成交", color=RGB_Purple(), main=True)
                 send_msg_thread("空开成交", f"策略单号:{triData['StrategyOrderId']},OrderId:{triData['OrderId']},OrderNo:{triData['OrderNo']}",is_all_notice=False)
+            # --- ai start ---
+            quantfu_pusher.finish_order(enter_order_id)
+            # --- ai end ---
             enter_order_id = -1
             ret_enter = -1
     if context.triggerType() == 'N' and context.triggerData()['ServerType'] == 'T':  